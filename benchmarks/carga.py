@@ -0,0 +1,213 @@
+"""
+Prueba de carga reproducible contra una api local poblada con benchmarks.semilla.
+Mezcla /token, /nucleos/all, /compras/create y /ofertas/all y reporta rendimiento, percentiles de latencia y
+sentencias SQL por petición (cabecera X-SQL-Count). El resultado se guarda en JSON para comparar versiones.
+Las compras se hacen como los compradores de la semilla, cada uno con su token, en su núcleo y con ofertas de la
+tienda que lo atiende que aún no compró; cada trabajador recorre compradores distintos y entra con /token antes de
+medir la compra.
+
+Todas las peticiones salen de una IP y el límite por IP de /token (LIMITE_IP, 30/60 por defecto) convertiría casi
+todas las entradas en 429, la api se levanta para la prueba con un límite alto.
+
+Uso: LIMITE_IP=1000000/60 python main.py  (la api)
+     python -m benchmarks.carga --url http://127.0.0.1:8000 --duracion 60 --concurrencia 16
+     python -m benchmarks.carga --comparar benchmarks/resultados/a.json benchmarks/resultados/b.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+MEZCLA = 'token=5,nucleos=40,compras=15,ofertas=40'
+
+
+def _token(sesion, url, semilla, rnd, cuenta):
+    ci = f"{rnd.randint(1, semilla['usuarios']):011d}"
+    return sesion.post(f"{url}/token", data={'username': ci, 'password': semilla['clave']})
+
+
+def _nucleos(sesion, url, semilla, rnd, cuenta):
+    body = {'bodega': {'id_bodega': rnd.randint(1, semilla['bodegas'])}}
+    return sesion.post(f"{url}/nucleos/all", params={'skip': 0, 'limit': 100}, json=body)
+
+
+def _ofertas(sesion, url, semilla, rnd, cuenta):
+    body = {'tienda': {'id_tienda': rnd.randint(1, semilla['tiendas'])}}
+    return sesion.post(f"{url}/ofertas/all", params={'skip': 0, 'limit': 100}, json=body)
+
+
+def _compras(sesion, url, semilla, rnd, cuenta):
+    body = {'fecha': datetime.datetime.now().isoformat(), 'terminado': False, 'pagado': False,
+            'oferta': {'id_oferta': cuenta['id_oferta']}, 'nucleo': {'id_nucleo': cuenta['id_nucleo']},
+            'usuario': {'id_usuario': cuenta['id_usuario']}, 'estado': {'id_estado': 1}}
+    return sesion.post(f"{url}/compras/create", json=body, headers=cuenta['headers'])
+
+
+def _pendientes(semilla, n, total):
+    """
+    Compras que le tocan al trabajador n: las ofertas libres de sus compradores, que no comparte con otro trabajador
+    para no repetir compras ni entradas de una cuenta. Al acabarse vuelve a empezar y las repetidas responden 400
+    """
+    return itertools.cycle([(id_usuario, id_nucleo, id_oferta)
+                            for id_usuario, id_nucleo, ofertas in semilla['compradores'][n::total]
+                            for id_oferta in ofertas])
+
+
+def _comprador(sesion, url, semilla, pendientes, tokens):
+    """
+    Siguiente compra con el token de su comprador, que se pide una vez por comprador. Sin token la compra da 401
+    """
+    id_usuario, id_nucleo, id_oferta = next(pendientes)
+    if id_usuario not in tokens:
+        tokens[id_usuario] = {}
+        try:
+            respuesta = sesion.post(f"{url}/token", data={'username': f"{id_usuario:011d}",
+                                                         'password': semilla['clave']})
+            if respuesta.status_code == 200:
+                tokens[id_usuario] = {'Authorization': f"Bearer {respuesta.json()['access_token']}"}
+            else:
+                print(f"Comprador {id_usuario} sin token: {respuesta.status_code}")
+        except requests.RequestException as e:
+            print(f"Comprador {id_usuario} sin token: {e}")
+    return {'id_usuario': id_usuario, 'id_nucleo': id_nucleo, 'id_oferta': id_oferta, 'headers': tokens[id_usuario]}
+
+
+ESCENARIOS = {'token': _token, 'nucleos': _nucleos, 'compras': _compras, 'ofertas': _ofertas}
+
+
+def _trabajador(n, args, semilla, mezcla, fin, muestras, lock):
+    rnd = random.Random(args.semilla + n)
+    nombres, pesos = zip(*mezcla.items())
+    sesion = requests.Session()
+    pendientes, tokens, cuenta = _pendientes(semilla, n, args.concurrencia), {}, None
+    propias = []
+    while time.monotonic() < fin:
+        nombre = rnd.choices(nombres, pesos)[0]
+        if nombre == 'compras':
+            cuenta = _comprador(sesion, args.url, semilla, pendientes, tokens)
+        inicio = time.perf_counter()
+        try:
+            respuesta = ESCENARIOS[nombre](sesion, args.url, semilla, rnd, cuenta)
+            estado, sql = respuesta.status_code, int(respuesta.headers.get('x-sql-count', -1))
+        except requests.RequestException:
+            estado, sql = 0, -1
+        propias.append((nombre, (time.perf_counter() - inicio) * 1000, estado, sql))
+    with lock:
+        muestras.extend(propias)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    return round(valores[min(len(valores) - 1, int(len(valores) * p / 100))], 2)
+
+
+def _resumir(muestras, segundos):
+    rutas = defaultdict(list)
+    for muestra in muestras:
+        rutas[muestra[0]].append(muestra)
+    rutas['total'] = muestras
+    resumen = {}
+    for nombre, lista in rutas.items():
+        tiempos = sorted(m[1] for m in lista)
+        sql = [m[3] for m in lista if m[3] >= 0]
+        resumen[nombre] = {'peticiones': len(lista), 'errores': sum(1 for m in lista if not 200 <= m[2] < 300),
+                           'rps': round(len(lista) / segundos, 2), 'p50': _percentil(tiempos, 50),
+                           'p90': _percentil(tiempos, 90), 'p99': _percentil(tiempos, 99),
+                           'max': round(tiempos[-1], 2) if tiempos else None,
+                           'sql_media': round(sum(sql) / len(sql), 2) if sql else None}
+    return resumen
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def _imprimir(resumen):
+    print(f"{'escenario':<10} {'peticiones':>10} {'errores':>8} {'rps':>9} {'p50':>9} {'p90':>9} {'p99':>9} "
+          f"{'sql':>6}")
+    for nombre, r in resumen.items():
+        print(f"{nombre:<10} {r['peticiones']:>10} {r['errores']:>8} {r['rps']:>9} {r['p50']!s:>9} {r['p90']!s:>9} "
+              f"{r['p99']!s:>9} {r['sql_media']!s:>6}")
+
+
+def cargar(args):
+    with open(args.datos) as file:
+        semilla = json.load(file)
+    if len(semilla.get('compradores', [])) < args.concurrencia:
+        raise SystemExit(f"{args.datos} tiene menos compradores que trabajadores, volver a poblar con benchmarks.semilla")
+    mezcla = {k: float(v) for k, v in (par.split('=') for par in args.mezcla.split(','))}
+    muestras, lock = [], threading.Lock()
+    fin = time.monotonic() + args.duracion
+    hilos = [threading.Thread(target=_trabajador, args=(n, args, semilla, mezcla, fin, muestras, lock))
+             for n in range(args.concurrencia)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+
+    resultado = {'fecha': datetime.datetime.now().isoformat(timespec='seconds'), 'version': _version(),
+                 'etiqueta': args.etiqueta, 'parametros': {'url': args.url, 'duracion': args.duracion,
+                                                           'concurrencia': args.concurrencia, 'mezcla': mezcla,
+                                                           'semilla': args.semilla},
+                 'datos': semilla, 'escenarios': _resumir(muestras, segundos)}
+    os.makedirs(args.salida, exist_ok=True)
+    archivo = os.path.join(args.salida, f"{datetime.datetime.now():%Y-%m-%d %H%M%S} {args.etiqueta or resultado['version']}.json")
+    with open(archivo, 'w') as file:
+        json.dump(resultado, file, indent=3)
+    _imprimir(resultado['escenarios'])
+    if any(m[2] == 429 for m in muestras):
+        print("Hubo respuestas 429, levantar la api con LIMITE_IP alto (ver el docstring)")
+    print(f"Resultado guardado en {archivo}")
+
+
+def comparar(a: str, b: str):
+    with open(a) as file:
+        antes = json.load(file)
+    with open(b) as file:
+        despues = json.load(file)
+    print(f"{antes.get('etiqueta') or antes.get('version')} → {despues.get('etiqueta') or despues.get('version')}")
+    for nombre, r in despues['escenarios'].items():
+        viejo = antes['escenarios'].get(nombre)
+        if not viejo:
+            continue
+        cambios = []
+        for clave in ('rps', 'p50', 'p99', 'sql_media'):
+            if viejo[clave] and r[clave] is not None:
+                cambios.append(f"{clave} {viejo[clave]} → {r[clave]} ({(r[clave] - viejo[clave]) / viejo[clave]:+.1%})")
+        print(f"{nombre:<10} " + '  '.join(cambios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la api')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--duracion', type=int, default=60, help='Segundos de carga')
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--mezcla', default=MEZCLA, help='Pesos por escenario, por ejemplo token=5,nucleos=40')
+    parser.add_argument('--datos', default='benchmarks/semilla.json', help='Resumen generado por benchmarks.semilla')
+    parser.add_argument('--semilla', type=int, default=2023)
+    parser.add_argument('--etiqueta', default=None)
+    parser.add_argument('--salida', default='benchmarks/resultados')
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'DESPUES'))
+    args = parser.parse_args()
+    if args.comparar:
+        comparar(*args.comparar)
+    else:
+        cargar(args)
+
+
+if __name__ == "__main__":
+    main()
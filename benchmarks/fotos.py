@@ -0,0 +1,86 @@
+"""
+Compara las fotos de xutil en el formato anterior (JSON con indent=3) contra JSON Lines comprimidas leídas con mmap:
+tamaño en disco, escritura, lectura y lectura más el armado de las llaves que usa service.diferencias. Usa una foto
+real de async/ con --archivo o núcleos sintéticos.
+
+Uso: python -m benchmarks.fotos --nucleos 200000 --repeticiones 5
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from statistics import median
+
+from service import xutil
+
+
+def _sinteticos(cantidad: int):
+    nucleos = []
+    for i in range(cantidad):
+        miembros = [{'identidad_numero': f'{85010100000 + i * 4 + j}', 'jefe_nucleo': j == 0,
+                     'nombre': f'Consumidor {i * 4 + j}', 'nacimiento': '1985-01-01'}
+                    for j in range(random.randint(1, 4))]
+        nucleos.append({'id': i, 'numero_nucleo': i % 900, 'cons_cant': len(miembros), 'bodega_id': i // 300,
+                        'oficina_id': i // 6000, 'direccion': f'Calle {i % 200} # {i}, entre A y B',
+                        'cons_lista': json.dumps(miembros, ensure_ascii=False)})
+    return nucleos
+
+
+def _llaves(filas):
+    return {(res['bodega_id'], str(res['numero_nucleo'])): res['cons_lista'] for res in filas}
+
+
+def _medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return median(tiempos) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del formato de las fotos de xutil')
+    parser.add_argument('--archivo', help='Foto existente, .json o .jsonl.gz')
+    parser.add_argument('--nucleos', type=int, default=200000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.archivo:
+        carpeta, nombre = os.path.split(args.archivo)
+        xutil.CARPETA = carpeta or '.'
+        filas = xutil._leer(nombre.split(' ', 1)[1].split('.')[0], nombre[:10])
+    else:
+        filas = _sinteticos(args.nucleos)
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        xutil.CARPETA = carpeta
+        anterior = xutil._ruta('nucleo', '2000-01-01', 'json')
+
+        def escribir_anterior():
+            with open(anterior, "w") as file:
+                json.dump(filas, file, ensure_ascii=False, indent=3)
+
+        def leer_anterior():
+            with open(anterior, "r") as file:
+                return json.load(file)
+
+        # Fechas distintas para que _leer elija la foto nueva y no la anterior
+        casos = (('json indent=3', escribir_anterior, leer_anterior, anterior),
+                 ('jsonl.gz + mmap', lambda: xutil._escribir('nucleo', '2000-01-02', filas),
+                  lambda: xutil._leer('nucleo', '2000-01-02'), xutil._ruta('nucleo', '2000-01-02')))
+        print(f"{len(filas)} núcleos, orjson {'sí' if xutil.orjson else 'no'}")
+        print(f"   {'formato':<18} {'tamaño':>10} {'escribir':>12} {'leer':>12} {'leer + llaves':>15}")
+        for nombre, escribir, leer, ruta in casos:
+            ms_escribir = _medir(escribir, args.repeticiones)
+            assert len(leer()) == len(filas)
+            ms_leer = _medir(leer, args.repeticiones)
+            ms_llaves = _medir(lambda: _llaves(leer()), args.repeticiones)
+            print(f"   {nombre:<18} {os.path.getsize(ruta) / 2 ** 20:8.1f} MB {ms_escribir:9.1f} ms "
+                  f"{ms_leer:9.1f} ms {ms_llaves:12.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
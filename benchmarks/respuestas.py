@@ -0,0 +1,96 @@
+"""
+Compara el camino de respuesta por defecto de FastAPI (validar con response_model, jsonable y json.dumps)
+contra forwards._serialize (TypeAdapter una vez + dump_json) sobre páginas de filas del ORM sin base de datos.
+
+Uso: python -m benchmarks.respuestas --filas 1000 --repeticiones 20
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from statistics import median
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from modules.bodegas import BodegaS
+from modules.compras import CompraS, CompraP
+from modules.consumidores import ConsumidorS
+from modules.estados import EstadoS
+from modules.nucleos import NucleoS, NucleoP
+from modules.ofertas import OfertaS
+from modules.usuarios import UsuarioS
+from service import forwards
+from service.respuestas import RespuestaJSON
+
+
+def _compras(filas: int):
+    ahora = datetime.datetime.now()
+    estado = EstadoS(id_estado=1, nombre='pendiente', descripcion='Compra pendiente')
+    oferta = OfertaS(id_oferta=1, descripcion='Módulo de aseo', fecha_inicio=ahora.date(), fecha_fin=ahora.date(),
+                     cantidad=filas)
+    compras = []
+    for i in range(filas):
+        usuario = UsuarioS(id_usuario=i, ci=f'{85010100000 + i}', num_cel=f'5{i:07d}', nombre_completo=f'Usuario {i}',
+                           fecha_creacion=ahora, desac=False)
+        nucleo = NucleoS(id_nucleo=i, numero=str(i), cant_miembros=3, cant_modulos=1, desac=False)
+        compras.append(CompraS(id_compra=i, fecha=ahora, terminado=bool(i % 2), pagado=bool(i % 3), seleccion='1,2',
+                               notificado=True, oferta=oferta, nucleo=nucleo, usuario=usuario, estado=estado))
+    return compras
+
+
+def _nucleos(filas: int):
+    ahora = datetime.datetime.now()
+    bodega = BodegaS(id_bodega=1, numero='101', direccion='Calle 1', grupos_rs='', es_especial=False, desac=False)
+    nucleos = []
+    for i in range(filas):
+        consumidores = [ConsumidorS(id_consumidor=i * 3 + j, verificado=True, fecha_creacion=ahora, desac=False)
+                        for j in range(3)]
+        nucleos.append(NucleoS(id_nucleo=i, numero=str(i), cant_miembros=3, cant_modulos=1, desac=False,
+                               bodega=bodega, consumidor_jefe=consumidores[0], consumidores=consumidores, compras=[]))
+    return nucleos
+
+
+async def _defecto(field, filas):
+    content = await serialize_response(field=field, response_content=filas)
+    return JSONResponse(content).body
+
+
+async def _ordenado(field, filas):
+    content = await serialize_response(field=field, response_content=filas)
+    return RespuestaJSON(content).body
+
+
+async def _rapido(schema, filas):
+    return (await forwards._serialize(filas, schema)).body
+
+
+async def _medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cuerpo = await funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return median(tiempos) * 1000, len(cuerpo)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark de serialización de respuestas')
+    parser.add_argument('--filas', type=int, default=1000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    for schema, filas in ((CompraP, _compras(args.filas)), (NucleoP, _nucleos(args.filas))):
+        field = create_response_field(name=f'Response_{schema.__name__}', type_=List[schema])
+        print(f"{schema.__name__} ({args.filas} filas)")
+        for nombre, funcion in (('fastapi + json', lambda: _defecto(field, filas)),
+                                ('fastapi + orjson', lambda: _ordenado(field, filas)),
+                                ('adapter + dump_json', lambda: _rapido(schema, filas))):
+            ms, size = await _medir(funcion, args.repeticiones)
+            print(f"   {nombre:<20} {ms:9.2f} ms  {size} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+Puebla una base de datos local con un conjunto sintético a escala nacional
+(provincias → municipios → oficinas → bodegas → núcleos → consumidores → compras) usando las tablas del ORM.
+
+Uso: python -m benchmarks.semilla --limpiar --nucleos 50
+El resumen de lo creado queda en benchmarks/semilla.json y lo usa benchmarks.carga
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+
+from passlib.context import CryptContext
+from sqlalchemy import Integer, text
+
+from database import engine, Base
+from router import api_router  # noqa: F401, registra todas las tablas del ORM
+from modules.provincias import ProvinciaS
+from modules.municipios import MunicipioS
+from modules.oficinas import OficinaS
+from modules.bodegas import BodegaS
+from modules.cadenas import CadenaS
+from modules.tiendas import TiendaS
+from modules.estados import EstadoS
+from modules.ciclos import CicloS
+from modules.ofertas import OfertaS
+from modules.usuarios import UsuarioS
+from modules.nucleos import NucleoS
+from modules.consumidores import ConsumidorS
+from modules.compras import CompraS
+from service.particiones import MESES, _mes
+
+CLAVE = 'tetoca'
+# Compradores que se guardan en el resumen para benchmarks.carga
+COMPRADORES = 1000
+
+
+class _Lotes:
+    """
+    Acumula filas de una tabla y las inserta en bloque, se vacían explícitamente en el orden de las llaves foráneas
+    """
+
+    def __init__(self, conn, tabla):
+        self.conn = conn
+        self.tabla = tabla
+        self.filas = []
+
+    def add(self, **fila):
+        self.filas.append(fila)
+
+    def flush(self):
+        if self.filas:
+            self.conn.execute(self.tabla.__table__.insert(), self.filas)
+            self.filas = []
+
+
+def sembrar(args):
+    rnd = random.Random(args.semilla)
+    hash_clave = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(CLAVE)
+    hoy = datetime.date.today()
+    inicio = time.perf_counter()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if args.limpiar:
+            tablas = ', '.join(t.name for t in Base.metadata.sorted_tables)
+            conn.execute(text(f"TRUNCATE {tablas} RESTART IDENTITY CASCADE"))
+
+        lotes = {t: _Lotes(conn, t) for t in (ProvinciaS, MunicipioS, OficinaS, BodegaS, CadenaS, TiendaS, EstadoS,
+                                               CicloS, OfertaS, UsuarioS, NucleoS, ConsumidorS, CompraS)}
+        for i, nombre in enumerate(('pendiente', 'pagado', 'terminado'), 1):
+            lotes[EstadoS].add(id_estado=i, nombre=nombre, descripcion=nombre)
+        for i, siglas in enumerate(('CIMEX', 'TRD'), 1):
+            lotes[CadenaS].add(id_cadena=i, nombre=f"Cadena {siglas}", siglas=siglas, desac=False)
+        ciclos = []
+        for i in range(1, args.ciclos + 1):
+            fecha = _mes(hoy, i - args.ciclos)
+            ciclos.append((i, fecha))
+            lotes[CicloS].add(id_ciclo=i, nombre=f"Ciclo {fecha:%Y-%m}", descripcion='', fecha_inicio=fecha,
+                              fecha_fin=fecha + datetime.timedelta(days=27))
+        lotes[CicloS].flush()
+        conn.exec_driver_sql(MESES.format(desde=f"'{ciclos[0][1]}'::date", hasta="now()"))
+        lotes[EstadoS].flush()
+        lotes[CadenaS].flush()
+
+        ids = dict(municipio=0, oficina=0, bodega=0, tienda=0, oferta=0, nucleo=0, consumidor=0, compra=0)
+        # Jefe de núcleo, su núcleo y las ofertas que aún no compró de la tienda que lo atiende, para que la carga
+        # compre como él sin repetir compras
+        compradores = []
+        for id_provincia in range(1, args.provincias + 1):
+            lotes[ProvinciaS].add(id_provincia=id_provincia, nombre=f"Provincia {id_provincia}",
+                                  siglas=f"P{id_provincia}", ubicacion='', desac=False)
+            for _ in range(args.municipios):
+                ids['municipio'] += 1
+                id_municipio = ids['municipio']
+                lotes[MunicipioS].add(id_municipio=id_municipio, nombre=f"Municipio {id_municipio}",
+                                      siglas=f"M{id_municipio}", ubicacion='', desac=False, id_provincia=id_provincia)
+                tiendas = []
+                for id_cadena in (1, 2):
+                    ids['tienda'] += 1
+                    tiendas.append((ids['tienda'], []))
+                    lotes[TiendaS].add(id_tienda=ids['tienda'], nombre=f"Tienda {ids['tienda']}", direccion='',
+                                       desac=False, frecuencia_venta=0, id_municipio=id_municipio,
+                                       id_cadena=id_cadena)
+                for _ in range(args.oficinas):
+                    ids['oficina'] += 1
+                    lotes[OficinaS].add(id_oficina=ids['oficina'], nombre=f"Oficina {ids['oficina']}",
+                                        direccion='', desac=False, id_municipio=id_municipio)
+                    for _ in range(args.bodegas):
+                        ids['bodega'] += 1
+                        id_tienda, nucleos_tienda = rnd.choice(tiendas)
+                        lotes[BodegaS].add(id_bodega=ids['bodega'], numero=str(ids['bodega']), direccion='',
+                                           grupos_rs='', es_especial=False, desac=False, id_tienda=id_tienda,
+                                           id_oficina=ids['oficina'])
+                        for numero in range(1, args.nucleos + 1):
+                            ids['nucleo'] += 1
+                            miembros = rnd.randint(1, args.consumidores)
+                            usuarios = []
+                            for _ in range(miembros):
+                                ids['consumidor'] += 1
+                                usuarios.append(ids['consumidor'])
+                                lotes[UsuarioS].add(id_usuario=ids['consumidor'], ci=f"{ids['consumidor']:011d}",
+                                                    num_cel=f"5{ids['consumidor']:07d}", hash_clave=hash_clave,
+                                                    desac=False)
+                            lotes[NucleoS].add(id_nucleo=ids['nucleo'], numero=str(numero), cant_miembros=miembros,
+                                               cant_modulos=0, desac=False, id_bodega=ids['bodega'])
+                            nucleos_tienda.append((ids['nucleo'], usuarios[0], usuarios))
+                for id_tienda, nucleos_tienda in tiendas:
+                    libres = {id_nucleo: [] for id_nucleo, _, _ in nucleos_tienda}
+                    for id_ciclo, fecha in ciclos:
+                        ids['oferta'] += 1
+                        lotes[OfertaS].add(id_oferta=ids['oferta'], descripcion=f"Oferta {ids['oferta']}",
+                                           fecha_inicio=fecha, fecha_fin=fecha + datetime.timedelta(days=27),
+                                           cantidad=len(nucleos_tienda), id_ciclo=id_ciclo, id_tienda=id_tienda)
+                        for id_nucleo, jefe, _ in nucleos_tienda:
+                            if rnd.random() < args.compras:
+                                ids['compra'] += 1
+                                lotes[CompraS].add(id_compra=ids['compra'],
+                                                   fecha=datetime.datetime.combine(
+                                                       fecha + datetime.timedelta(days=rnd.randint(0, 27)),
+                                                       datetime.time(rnd.randint(8, 17))),
+                                                   terminado=rnd.random() < 0.5, pagado=rnd.random() < 0.7,
+                                                   seleccion='', notificado=True, id_oferta=ids['oferta'],
+                                                   id_nucleo=id_nucleo, id_usuario=jefe, id_estado=rnd.randint(1, 3))
+                            else:
+                                libres[id_nucleo].append(ids['oferta'])
+                    compradores.extend([jefe, id_nucleo, libres[id_nucleo]] for id_nucleo, jefe, _ in nucleos_tienda
+                                       if libres[id_nucleo])
+                for _, nucleos_tienda in tiendas:
+                    for id_nucleo, _, usuarios in nucleos_tienda:
+                        for id_usuario in usuarios:
+                            lotes[ConsumidorS].add(id_consumidor=id_usuario, id_usuario=id_usuario,
+                                                   id_nucleo=id_nucleo, verificado=True, desac=False)
+                # Se vacía un municipio completo a la vez en el orden de las llaves foráneas
+                for lote in (ProvinciaS, MunicipioS, TiendaS, OficinaS, BodegaS, UsuarioS, NucleoS, ConsumidorS,
+                             OfertaS, CompraS):
+                    lotes[lote].flush()
+            print(f"Provincia {id_provincia}: {ids['nucleo']} núcleos, {ids['consumidor']} consumidores, "
+                  f"{ids['compra']} compras")
+
+        # El consumidor jefe es el primero de cada núcleo
+        conn.execute(text("UPDATE nucleos SET id_consumidor_jefe = c.jefe "
+                          "FROM (SELECT id_nucleo, MIN(id_consumidor) AS jefe FROM consumidores "
+                          "GROUP BY id_nucleo) c WHERE nucleos.id_nucleo = c.id_nucleo"))
+        for tabla in Base.metadata.sorted_tables:
+            for columna in tabla.primary_key.columns:
+                if isinstance(columna.type, Integer):
+                    conn.execute(text(f"SELECT setval(s.seq, COALESCE((SELECT MAX({columna.name}) FROM {tabla.name}), 0) + 1, false) "
+                                      f"FROM (SELECT pg_get_serial_sequence('{tabla.name}', '{columna.name}') AS seq) s "
+                                      f"WHERE s.seq IS NOT NULL"))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE"))
+
+    resumen = {'fecha': datetime.datetime.now().isoformat(timespec='seconds'), 'clave': CLAVE,
+               'segundos': round(time.perf_counter() - inicio, 1), 'estados': 3,
+               'ciclos': args.ciclos, 'provincias': args.provincias, 'municipios': ids['municipio'],
+               'oficinas': ids['oficina'], 'bodegas': ids['bodega'], 'tiendas': ids['tienda'],
+               'ofertas': ids['oferta'], 'nucleos': ids['nucleo'], 'usuarios': ids['consumidor'],
+               'compras': ids['compra'], 'compradores': rnd.sample(compradores, min(len(compradores), COMPRADORES))}
+    with open(args.salida, 'w') as file:
+        json.dump(resumen, file, indent=3)
+    print(json.dumps(resumen, indent=3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conjunto de datos sintético para benchmarks')
+    parser.add_argument('--limpiar', action='store_true', help='Vacía todas las tablas antes de poblar')
+    parser.add_argument('--provincias', type=int, default=16)
+    parser.add_argument('--municipios', type=int, default=10, help='Municipios por provincia')
+    parser.add_argument('--oficinas', type=int, default=2, help='Oficinas por municipio')
+    parser.add_argument('--bodegas', type=int, default=10, help='Bodegas por oficina')
+    parser.add_argument('--nucleos', type=int, default=50, help='Núcleos por bodega')
+    parser.add_argument('--consumidores', type=int, default=5, help='Máximo de consumidores por núcleo')
+    parser.add_argument('--ciclos', type=int, default=6)
+    parser.add_argument('--compras', type=float, default=0.6, help='Fracción de núcleos que compra cada oferta')
+    parser.add_argument('--semilla', type=int, default=2023)
+    parser.add_argument('--salida', default='benchmarks/semilla.json')
+    sembrar(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
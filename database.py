@@ -1,9 +1,17 @@
+import itertools
 import os
+import time
 
-from sqlalchemy import create_engine
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from jose import JWTError
+
+from service import normalizar, tokens
+from service.cache import TTLCache
 
 load_dotenv()
 
@@ -12,18 +20,94 @@ passw = os.getenv('POSTGRES_PASSWORD')
 server = os.getenv('POSTGRES_SERVER')
 port = os.getenv('POSTGRES_PORT')
 dbs = os.getenv('POSTGRES_DB')
+# Réplicas de solo lectura separadas por coma como servidor:puerto, con el mismo usuario y base de datos
+replicas_env = os.getenv('POSTGRES_REPLICAS', '')
+# Segundos que un cliente sigue leyendo de la primaria después de escribir, para que vea sus propios cambios
+PEGADO_S = int(os.getenv('REPLICAS_PEGADO', 5))
+# Segundos que una réplica caída queda fuera de la rotación
+CAIDA_S = int(os.getenv('REPLICAS_CAIDA', 30))
+COOKIE = 'tetoca_escritura'
 
 engine = create_engine(url=f"postgresql+psycopg2://{user}:{passw}@{server}:{port}/{dbs}")
+replicas = [create_engine(url=f"postgresql+psycopg2://{user}:{passw}@{replica.strip()}/{dbs}", pool_pre_ping=True)
+            for replica in replicas_env.split(',') if replica.strip()]
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLectura = sessionmaker(autocommit=False, autoflush=False)
+
+_turno = itertools.count()
+_caidas = {}
+# Usuarios del token que escribieron hace poco en este proceso, para los clientes que no guardan cookies
+_escritores = TTLCache(maxsize=int(os.getenv('REPLICAS_ESCRITORES', 10000)), ttl=PEGADO_S)
+
+
+def _usuario(request: Request):
+    """
+    Usuario del token Bearer de la petición, None sin token o si no vale
+    """
+    esquema, _, token = request.headers.get('authorization', '').partition(' ')
+    if esquema.lower() != 'bearer' or not token:
+        return None
+    try:
+        return tokens.verificar(token).get('user')
+    except JWTError:
+        return None
 
 
-def get_db():
+def get_db(request: Request, response: Response):
+    """
+    Sesión en la primaria. Al confirmar una escritura el cliente queda pegado a la primaria PEGADO_S segundos por la
+    cookie y por el usuario de su token. La cookie va en la respuesta inyectada: se pierde si el endpoint devuelve su
+    propia Response o falla después de confirmar, y el pegado por usuario solo lo ve este proceso, así que un cliente
+    sin cookies cuya lectura caiga en otro worker puede leer de una réplica atrasada
+    """
     db = SessionLocal()
+
+    def _confirmado(session):
+        response.set_cookie(COOKIE, str(int(time.time())), max_age=PEGADO_S, httponly=True)
+        usuario = _usuario(request)
+        if usuario is not None:
+            _escritores.set(usuario, True)
+
+    event.listen(db, 'after_commit', _confirmado)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _conexion():
+    """
+    Conexión a la siguiente réplica disponible en turno, None si no hay réplicas o todas fallan
+    """
+    ahora = time.monotonic()
+    inicio = next(_turno)
+    for n in range(len(replicas)):
+        replica = replicas[(inicio + n) % len(replicas)]
+        if _caidas.get(replica, 0) > ahora:
+            continue
+        try:
+            return replica.connect()
+        except OperationalError:
+            _caidas[replica] = ahora + CAIDA_S
+    return None
+
+
+def get_db_lectura(request: Request):
+    """
+    Sesión para endpoints de solo lectura, va a una réplica salvo que el cliente haya escrito hace poco o que
+    ninguna réplica responda, en ese caso usa la primaria
+    """
+    pegado = COOKIE in request.cookies or _escritores.get(_usuario(request)) is not None
+    conn = None if pegado else _conexion()
+    db = SessionLectura(bind=conn or engine)
     try:
         yield db
     finally:
         db.close()
+        if conn is not None:
+            conn.close()
 
 
 Base = declarative_base()
+normalizar.registrar(Base.metadata)
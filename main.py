@@ -4,21 +4,37 @@ import argparse
 
 import uvicorn
 from fastapi import FastAPI
-from starlette.responses import FileResponse
-from database import engine, Base
+from starlette.responses import FileResponse, PlainTextResponse
+from database import engine, replicas, Base
 from router import api_router
+from service.respuestas import RespuestaJSON
+from service.metricas import MetricasMiddleware, instrumentar, registro
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
 from service.uic import actualizar_pass_hash, vinculacion
-from service.xutil import sync_all, sync_all_bd, sync_reset, sync_import, sync_cerodb, info
+from service.lentas import registrar, resumen
+from service.migraciones import migrar
+from service.indices import asesor
+from service.particiones import sync_particiones
+from modules.reportes import refrescar
+from service.xutil import sync_all, sync_all_bd, sync_reset, sync_import, sync_cerodb, sync_contadores, info
 
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+app = FastAPI(default_response_class=RespuestaJSON)
 
 app.add_middleware(CORSMiddleware, allow_credentials=True,  allow_methods=["GET", "POST", "DELETE", "PUT", "PATCH"],
-                   allow_headers=["*"], allow_origins=["*"])
+                   allow_headers=["*"], allow_origins=["*"], expose_headers=["ETag"])
+app.add_middleware(MetricasMiddleware)
+for motor in (engine, *replicas):
+    instrumentar(motor)
+
+
+@app.on_event('startup')
+async def iniciar():
+    # Solo la api registra las consultas lentas, los comandos de main.py y los benchmarks no abren el hilo ni logs/
+    registrar(engine, *replicas)
 
 
 @app.get('/')
@@ -31,6 +47,11 @@ async def favicon():
     return FileResponse('public/tetoca.png')
 
 
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registro.exportar(), media_type='text/plain; version=0.0.4')
+
+
 app.include_router(api_router)
 
 
@@ -39,9 +60,19 @@ async def main():
     parser.add_argument('--vincularse', action='store_true', help='Toma excel de vinculacion de datos')
     parser.add_argument('--actualizarhash', action='store_true', help='Revisa usuarios aún no activos y crea contraseñas seguras')
     parser.add_argument('--descargaoregi', action='store_true', help='Descarga datos de oregi')
+    parser.add_argument('--diferencias', action='store_true', help='Muestra sin aplicar lo que cambiaría la última descarga de oregi')
     parser.add_argument('--revisarbd', action='store_true', help='Si existen archivo para poblar base de datos')
     parser.add_argument('--cerobd', action='store_true', help='Elimina el contenido de la base de datos')
+    parser.add_argument('--conservarcatalogos', action='store_true', help='Con --cerobd no vacía las tablas de catálogo')
     parser.add_argument('--info', action='store_true', help='Información del Sistema')
+    parser.add_argument('--contadores', action='store_true', help='Corrige la cantidad de miembros de los núcleos')
+    parser.add_argument('--lentas', action='store_true', help='Resume las consultas lentas registradas')
+    parser.add_argument('--migrar', action='store_true', help='Aplica los cambios de esquema pendientes')
+    parser.add_argument('--indices', action='store_true', help='Sugiere índices a crear y a eliminar')
+    parser.add_argument('--particiones', action='store_true', help='Crea las particiones de compras de los próximos meses y separa las viejas')
+    parser.add_argument('--reportes', action='store_true', help='Refresca los reportes de las ofertas de ciclos abiertos')
+    parser.add_argument('--reportestodo', action='store_true', help='Refresca los reportes de todas las ofertas')
+    parser.add_argument('--analitica', action='store_true', help='Calcula pronósticos de demanda y utilización de ciclos')
 
     args = parser.parse_args()
 
@@ -52,13 +83,31 @@ async def main():
     elif args.descargaoregi:
         await sync_all()
         await sync_all_bd()
+    elif args.diferencias:
+        await sync_all_bd(ensayo=True, todo=True)
     elif args.revisarbd:
         await sync_reset()
         await sync_import()
     elif args.cerobd:
-        await sync_cerodb()
+        await sync_cerodb(args.conservarcatalogos)
     elif args.info:
         await info()
+    elif args.contadores:
+        await sync_contadores()
+    elif args.lentas:
+        await resumen()
+    elif args.migrar:
+        await migrar()
+    elif args.indices:
+        await asesor()
+    elif args.particiones:
+        await sync_particiones()
+    elif args.reportes or args.reportestodo:
+        await refrescar(args.reportestodo)
+    elif args.analitica:
+        # pandas solo se carga para este comando, no en la api
+        from service.analitica import analitica
+        await analitica()
     else:
         print("No se proporcionó ninguna bandera")
         host = os.getenv('HOST')
@@ -1,15 +1,21 @@
+import hashlib
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from jose import JWTError
 from passlib.context import CryptContext
-import os
-from datetime import datetime, timedelta
 from typing import Annotated
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, Request, status, APIRouter
 from pydantic import BaseModel
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, func
 from sqlalchemy.orm import Session
-from database import get_db
+from database import Base, get_db
 from .usuarios import UsuarioS, UsuarioP, UsuarioE
 from .nucleos import NucleoS
+from service import limites, tokens
 
 router = APIRouter()
 
@@ -19,6 +25,26 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 usuarios_activos = list()
 usuarios_desacti = list()
 
+# Vida de los tokens de refresco, el de acceso dura ACCESS_TOKEN_EXPIRE_MINUTES
+REFRESCO_DIAS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+
+
+# noinspection PyTypeChecker
+class RefrescoS(Base):
+    """
+    Tokens de refresco, se guarda solo su sha256. Cada uso lo reemplaza por otro de la misma familia, si uno ya usado
+    vuelve a presentarse se revoca la familia entera
+    """
+    __tablename__ = "refrescos"
+    id_refresco = Column(Integer, primary_key=True)
+    id_usuario = Column(Integer, ForeignKey('usuarios.id_usuario', ondelete='CASCADE'), nullable=False, index=True)
+    huella = Column(String(64), nullable=False, unique=True)
+    familia = Column(String(32), nullable=False, index=True)
+    creado = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expira = Column(DateTime(timezone=True), nullable=False)
+    usado = Column(Boolean, nullable=False, default=False)
+    revocado = Column(Boolean, nullable=False, default=False)
+
 
 async def _verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -43,7 +69,7 @@ async def get_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session =
     cred_exc = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
                              headers={"WWW-Authenticate": "Bearer"}, )
     try:
-        payload = jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=[os.getenv('ALGORITHM')])
+        payload = tokens.verificar(token)
         username = payload.get("user")
         if not username:
             raise cred_exc
@@ -65,11 +91,44 @@ async def get_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session =
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class Refresco(BaseModel):
+    refresh_token: str
+
+
+def _huella(refresco: str) -> str:
+    return hashlib.sha256(refresco.encode()).hexdigest()
+
+
+def _sesion(db: Session, id_usuario: int, familia: str | None = None):
+    """
+    Token de acceso y de refresco nuevos, los refrescos vencidos del usuario se limpian de paso
+    """
+    refresco = secrets.token_urlsafe(32)
+    db.query(RefrescoS).filter(RefrescoS.id_usuario == id_usuario, RefrescoS.expira < func.now()).delete()
+    db.add(RefrescoS(id_usuario=id_usuario, huella=_huella(refresco), familia=familia or uuid.uuid4().hex,
+                     expira=func.now() + timedelta(days=REFRESCO_DIAS)))
+    db.commit()
+    if id_usuario not in usuarios_activos:
+        usuarios_activos.append(id_usuario)
+    if id_usuario in usuarios_desacti:
+        usuarios_desacti.remove(id_usuario)
+    return {"access_token": tokens.emitir({"user": str(id_usuario)}), "token_type": "bearer",
+            "refresh_token": refresco}
+
+
+def _revocar(db: Session, id_usuario: int):
+    db.query(RefrescoS).filter(RefrescoS.id_usuario == id_usuario, RefrescoS.revocado.is_(False)) \
+        .update({'revocado': True})
+    db.commit()
 
 
 @router.post("/token", response_model=Token, summary="Autenticar por Token", response_description="Crear Token", )
-async def token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+async def token(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
                 db: Session = Depends(get_db)):
+    limites.revisar(request, form_data.username)
     user = await _get_user(form_data.username, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password",
@@ -79,14 +138,35 @@ async def token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     elif not await _verify_password(form_data.password, user.hash_clave):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password",
                             headers={"WWW-Authenticate": "Bearer"})
-    expires_delta = timedelta(minutes=int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES')))
-    to_encode = {"user": str(user.id_usuario), "exp": datetime.utcnow() + expires_delta}
-    access_token = jwt.encode(to_encode, os.getenv('SECRET_KEY'), algorithm=os.getenv('ALGORITHM'))
-    if user.id_usuario not in usuarios_activos:
-        usuarios_activos.append(user.id_usuario)
-    if user.id_usuario in usuarios_desacti:
-        usuarios_desacti.remove(user.id_usuario)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return _sesion(db, user.id_usuario)
+
+
+# noinspection PyTypeChecker
+@router.post("/refrescar", response_model=Token, summary="Renovar el token de acceso sin clave")
+async def refrescar(request: Request, p: Refresco, db: Session = Depends(get_db)):
+    limites.revisar(request)
+    cred_exc = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token",
+                             headers={"WWW-Authenticate": "Bearer"})
+    refresco = db.query(RefrescoS).filter(RefrescoS.huella == _huella(p.refresh_token)).with_for_update().first()
+    if not refresco or refresco.revocado:
+        raise cred_exc
+    if refresco.usado:
+        # Un token ya rotado que vuelve es una copia robada o la sesión original, se corta toda la familia
+        db.query(RefrescoS).filter(RefrescoS.familia == refresco.familia).update({'revocado': True})
+        db.commit()
+        raise cred_exc
+    if refresco.expira < datetime.now(timezone.utc):
+        raise cred_exc
+    user = await _get_user_id(refresco.id_usuario, db)
+    if not user or user.desac:
+        raise HTTPException(status_code=status.HTTP_423_LOCKED, detail="Inactive user")
+    refresco.usado = True
+    return _sesion(db, user.id_usuario, refresco.familia)
+
+
+@router.get("/jwks", summary="Claves públicas para verificar los tokens")
+async def jwks():
+    return tokens.jwks()
 
 
 @router.post("/perfil", response_model=UsuarioE)
@@ -106,7 +186,8 @@ class UserComCon(UserCom):
 
 # noinspection PyTypeChecker
 @router.post("/registro", response_model=Token)
-async def registro(p: UserComCon, db: Session = Depends(get_db)):
+async def registro(request: Request, p: UserComCon, db: Session = Depends(get_db)):
+    limites.revisar(request, p.ci, p.num_cel)
     query = db.query(UsuarioS).filter((UsuarioS.ci == p.ci) | (UsuarioS.num_cel == p.num_cel))
 
     usuario = query.first()
@@ -137,15 +218,13 @@ async def registro(p: UserComCon, db: Session = Depends(get_db)):
         except (Exception,):
             raise HTTPException(status_code=400, detail="No se pudo hacer el registro")
         else:
-            expires_delta = timedelta(minutes=int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES')))
-            to_encode = {"user": str(usuario.id_usuario), "exp": datetime.utcnow() + expires_delta}
-            access_token = jwt.encode(to_encode, os.getenv('SECRET_KEY'), algorithm=os.getenv('ALGORITHM'))
-            return {"access_token": access_token, "token_type": "bearer"}
+            return _sesion(db, usuario.id_usuario)
 
 
 # noinspection PyTypeChecker
 @router.post("/compaginar", response_model=bool)
-async def compagina(p: UserCom, db: Session = Depends(get_db)):
+async def compagina(request: Request, p: UserCom, db: Session = Depends(get_db)):
+    limites.revisar(request, p.ci, p.num_cel)
     query = db.query(UsuarioS).filter(UsuarioS.ci == p.ci).filter(UsuarioS.num_cel == p.num_cel)
     usuario = query.first()
     if usuario:
@@ -157,9 +236,12 @@ async def compagina(p: UserCom, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/recuperar", response_model=bool)
-async def recuperar(p: UserComCon, db: Session = Depends(get_db)):
+async def recuperar(request: Request, p: UserComCon, db: Session = Depends(get_db)):
+    limites.revisar(request, p.ci, p.num_cel)
     query = db.query(UsuarioS).filter(UsuarioS.ci == p.ci).filter(UsuarioS.num_cel == p.num_cel)
     usuario = query.first()
+    if not usuario:
+        return {'option': False}
     for cons in usuario.consumidores:
         if str(cons.id_nucleo) == p.nucleo:
             query_aux = {'hash_clave': await get_password_hash(p.clave)}
@@ -169,13 +251,16 @@ async def recuperar(p: UserComCon, db: Session = Depends(get_db)):
             except (Exception,):
                 raise HTTPException(status_code=400, detail="No se pudo hacer el cambio de contraseña")
             else:
+                # Con la clave cambiada las sesiones abiertas ya no se pueden renovar
+                _revocar(db, usuario.id_usuario)
                 return {'option': True}
     return {'option': False}
 
 
 # noinspection PyTypeChecker
 @router.post("/logout", status_code=status.HTTP_200_OK)
-async def perfil(user: Annotated[UsuarioP, Depends(get_user)]):
+async def perfil(user: Annotated[UsuarioP, Depends(get_user)], db: Session = Depends(get_db)):
+    _revocar(db, user.id_usuario)
     if user.id_usuario in usuarios_activos:
         usuarios_activos.remove(user.id_usuario)
     if user.id_usuario not in usuarios_desacti:
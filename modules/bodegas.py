@@ -1,12 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, Boolean
 from sqlalchemy.orm import Session, relationship, Mapped
 from fastapi import Depends, APIRouter
 from typing import List, Optional, Annotated
 
 from service import forwards
+from service.permisos import Permisos, exigir_oficina, principal
 
 router = APIRouter()
 
@@ -91,7 +92,7 @@ class BodegaS(Base):
     __tablename__ = "bodegas"
     id_bodega = Column(Integer, primary_key=True, index=True)
     numero = Column(String, nullable=False, index=True)
-    direccion = Column(String, nullable=True, index=True)
+    direccion = Column(String, nullable=True, index=False)
     grupos_rs = Column(String, nullable=True, index=False)
     es_especial = Column(Boolean, nullable=False, index=True, default=False)
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
@@ -170,23 +171,27 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[BodegaP])
-async def read_all(skip: int = 0, limit: int = 100, p: BodegaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: BodegaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, BodegaS, BodegaP, fields)
+    return await forwards.page(query, BodegaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=BodegaP)
-async def read(p: BodegaR, db: Session = Depends(get_db)):
+async def read(p: BodegaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=BodegaP)
-async def create(p: BodegaC, db: Session = Depends(get_db)):
+async def create(p: BodegaC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    exigir_oficina(permisos, p.oficina.id_oficina)
     query = db.query(BodegaS).filter(BodegaS.numero == p.numero)
-    query = query.filter(BodegaS.id_oficina == p.id_oficina)
+    query = query.filter(BodegaS.id_oficina == p.oficina.id_oficina)
     query = query.filter(BodegaS.id_tienda == p.tienda.id_tienda)
     model = BodegaS(numero=p.numero, direccion=p.direccion, grupos_rs=p.grupos_rs, es_especial=p.es_especial,
                     id_tienda=p.tienda.id_tienda, id_oficina=p.oficina.id_oficina)
@@ -195,48 +200,54 @@ async def create(p: BodegaC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=BodegaP)
-async def update(up: BodegaU, db: Session = Depends(get_db)):
+async def update(up: BodegaU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
+    if not permisos.admin:
+        exigir_oficina(permisos, query.with_entities(BodegaS.id_oficina).scalar(), up.id_oficina)
     return await forwards.update(up, query, ['id_bodega'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=BodegaE)
-async def delete(p: BodegaId, db: Session = Depends(get_db)):
+async def delete(p: BodegaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == p.id_bodega)
+    if not permisos.admin:
+        exigir_oficina(permisos, query.with_entities(BodegaS.id_oficina).scalar())
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=BodegaP)
-async def activate(up: BodegaId, db: Session = Depends(get_db)):
+async def activate(up: BodegaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
+    if not permisos.admin:
+        exigir_oficina(permisos, query.with_entities(BodegaS.id_oficina).scalar())
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/nucleos", response_model=BodegaNu)
-async def oficina(up: BodegaId, db: Session = Depends(get_db)):
+async def oficina(up: BodegaId, db: Session = Depends(get_db_lectura)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/oficina", response_model=BodegaOf)
-async def oficina(up: BodegaId, db: Session = Depends(get_db)):
+async def oficina(up: BodegaId, db: Session = Depends(get_db_lectura)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/tienda", response_model=BodegaTi)
-async def oficina(up: BodegaId, db: Session = Depends(get_db)):
+async def oficina(up: BodegaId, db: Session = Depends(get_db_lectura)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/vinculacion", response_model=BodegaTi)
-async def oficina(up: BodegaId, ti:TiendaId, db: Session = Depends(get_db)):
+async def oficina(up: BodegaId, ti:TiendaId, db: Session = Depends(get_db_lectura)):
     query = db.query(BodegaS).filter(BodegaS.id_bodega == up.id_bodega)
     return await forwards.read(query)
@@ -1,11 +1,12 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, Integer, String, Boolean
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, Integer, String, Boolean, Text
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 from service import forwards
+from service.normalizar import catalogo, coincide, normalizada, trigrama
 
 router = APIRouter()
 
@@ -64,8 +65,13 @@ class CadenaS(Base):
     nombre = Column(String, unique=True, nullable=False, index=True)
     descripcion = Column(String, unique=False, nullable=True, index=False)
     siglas = Column(String, unique=False, nullable=True, index=False)
+    siglas_norm = Column(Text, normalizada('siglas'))
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     tiendas: Mapped[List["TiendaS"]] = relationship(back_populates="cadena", cascade="all, delete")
+    __table_args__ = (trigrama('cadenas', 'siglas_norm'),)
+
+
+catalogo(CadenaS, 'siglas')
 
 
 from .tiendas import TiendaE, TiendaS
@@ -88,7 +94,7 @@ async def _find(p: BaseModel, db: Session):
         if p.descripcion:
             query = query.filter(CadenaS.descripcion.ilike(f'%{p.descripcion}%'))
         if p.siglas:
-            query = query.filter(CadenaS.siglas.ilike(f'%{p.siglas}%'))
+            query = query.filter(coincide(db, CadenaS, 'siglas', p.siglas))
         if p.desac is not None:
             query = query.filter(CadenaS.desac == p.desac)
         if p.tienda:
@@ -97,7 +103,7 @@ async def _find(p: BaseModel, db: Session):
             if r.id_tienda:
                 query = query.filter(TiendaS.id_tienda == r.id_tienda)
             if r.nombre:
-                query = query.filter(TiendaS.nombre.ilike(f'%{r.nombre}%'))
+                query = query.filter(coincide(db, TiendaS, 'nombre', r.nombre))
             if r.direccion:
                 query = query.filter(TiendaS.direccion.ilike(f'%{r.direccion}%'))
             if r.frecuencia_venta:
@@ -107,14 +113,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[CadenaP])
-async def read_all(skip: int = 0, limit: int = 100, p: CadenaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: CadenaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, CadenaS, CadenaP, fields)
+    return await forwards.page(query, CadenaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=CadenaP)
-async def read(p: CadenaR, db: Session = Depends(get_db)):
+async def read(p: CadenaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -150,6 +159,6 @@ async def activate(up: CadenaId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/tiendas", response_model=CadenaTi)
-async def read_tiendas(p: CadenaId, db: Session = Depends(get_db)):
+async def read_tiendas(p: CadenaId, db: Session = Depends(get_db_lectura)):
     query = db.query(CadenaS).filter(CadenaS.id_cadena == p.id_cadena)
     return await forwards.read(query)
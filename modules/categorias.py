@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
@@ -93,14 +93,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[CategoriaP])
-async def read_all(skip: int = 0, limit: int = 100, p: CategoriaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: CategoriaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, CategoriaS, CategoriaP, fields)
+    return await forwards.page(query, CategoriaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=CategoriaP)
-async def read(p: CategoriaR, db: Session = Depends(get_db)):
+async def read(p: CategoriaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -129,6 +132,6 @@ async def delete(p: CategoriaId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/productos", response_model=CategoriaPr)
-async def read_productos(p: CategoriaId, db: Session = Depends(get_db)):
+async def read_productos(p: CategoriaId, db: Session = Depends(get_db_lectura)):
     query = db.query(CategoriaS).filter(CategoriaS.id_categoria == p.id_categoria)
     return await forwards.read(query)
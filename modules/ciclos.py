@@ -3,13 +3,14 @@ from __future__ import annotations
 import datetime
 
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, Date, String, func
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, requiere_rol
 
 router = APIRouter()
 
@@ -114,21 +115,24 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[CicloP])
-async def read_all(skip: int = 0, limit: int = 100, p: CicloR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: CicloR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, CicloS, CicloP, fields)
+    return await forwards.page(query, CicloP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=CicloP)
-async def read(p: CicloR, db: Session = Depends(get_db)):
+async def read(p: CicloR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=CicloP)
-async def create(p: CicloC, db: Session = Depends(get_db)):
+async def create(p: CicloC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(CicloS).filter(CicloS.nombre == p.nombre)
     model = CicloS(nombre=p.nombre, fecha_inicio=p.fecha_inicio, fecha_fin=p.fecha_fin,
                    descripcion=p.descripcion)
@@ -137,20 +141,20 @@ async def create(p: CicloC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=CicloP)
-async def update(up: CicloU, db: Session = Depends(get_db)):
+async def update(up: CicloU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(CicloS).filter(CicloS.id_ciclo == up.id_ciclo)
     return await forwards.update(up, query, ['id_ciclo'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=CicloE)
-async def delete(p: CicloId, db: Session = Depends(get_db)):
+async def delete(p: CicloId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(CicloS).filter(CicloS.id_ciclo == p.id_ciclo)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/ofertas", response_model=CicloOf)
-async def read_ofertas(p: CicloId, db: Session = Depends(get_db)):
+async def read_ofertas(p: CicloId, db: Session = Depends(get_db_lectura)):
     query = db.query(CicloS).filter(CicloS.id_ciclo == p.id_ciclo)
     return await forwards.read(query)
@@ -1,19 +1,26 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, ForeignKey, DateTime, Integer, func, Boolean, String
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, ForeignKey, DateTime, Integer, func, Boolean, String, Index, DDL, event, false
 from sqlalchemy.orm import Session, Mapped, relationship
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, HTTPException, status
 from typing import List, Optional
 import datetime
+import os
 
 from service import forwards
+from service.permisos import Permisos, exigir_tienda, principal
+from service.particiones import INICIAL
 
 router = APIRouter()
+# Estado con el que nace la compra que hace el propio consumidor
+ESTADO_INICIAL = int(os.getenv('COMPRAS_ESTADO_INICIAL', 1))
 
 
 class CompraId(BaseModel):
     id_compra: int
+    # Con la fecha de la compra la consulta va directo a su partición
+    fecha: datetime.datetime | None = None
 
     class Config:
         from_attributes = True
@@ -32,6 +39,7 @@ class CompraP(CompraId):
 
 
 class CompraU(CompraId):
+    # Fecha nueva, la compra se busca solo por id_compra
     fecha: datetime.datetime | None = None
     terminado: bool | None = None
     pagado: bool | None = None
@@ -50,6 +58,14 @@ class CompraE(BaseModel):
     seleccion: str | None = None
 
 
+class CompraEx(CompraE):
+    id_oferta: int
+    id_nucleo: int
+    id_usuario: int
+    id_estado: int
+    notificado: bool | None = None
+
+
 class CompraR(BaseModel):
     id_compra: int | None = None
     fecha: datetime.datetime | None = None
@@ -60,6 +76,9 @@ class CompraR(BaseModel):
     usuario: Optional['UsuarioE'] = None
     estado: Optional['EstadoE'] = None
     seleccion: str | None = None
+    notificado: bool | None = None
+    fecha_desde: datetime.datetime | None = None
+    fecha_hasta: datetime.datetime | None = None
 
 
 class CompraC(BaseModel):
@@ -100,15 +119,17 @@ class CompraEs(CompraId):
 # noinspection PyTypeChecker
 class CompraS(Base):
     __tablename__ = "compras"
-    id_compra = Column(Integer, primary_key=True, index=True)
-    fecha = Column(DateTime(timezone=True), server_default=func.now())
+    # Particionada por mes de fecha, la llave primaria tiene que incluir la columna de partición. Postgres no deja
+    # un índice único solo de id_compra en una tabla particionada, que no se repita lo garantiza la secuencia
+    id_compra = Column(Integer, primary_key=True, autoincrement=True)
+    fecha = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
     terminado = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     pagado = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     id_oferta = Column(Integer, ForeignKey('ofertas.id_oferta', ondelete='CASCADE'),
                        nullable=False, index=True)
     oferta: Mapped['OfertaS'] = relationship('OfertaS', back_populates="compras")
     id_nucleo = Column(Integer, ForeignKey('nucleos.id_nucleo', ondelete='CASCADE'),
-                       nullable=False, index=True)
+                       nullable=False, index=False)
     nucleo: Mapped['NucleoS'] = relationship('NucleoS', back_populates="compras")
     id_usuario = Column(Integer, ForeignKey('usuarios.id_usuario', ondelete='CASCADE'),
                         nullable=False, index=True)
@@ -118,12 +139,20 @@ class CompraS(Base):
     estado: Mapped['EstadoS'] = relationship('EstadoS', back_populates="compras")
     seleccion = Column(String, unique=False, nullable=True, index=False)
     notificado = Column(Boolean, unique=False, nullable=True, index=False, default=True)
+    __table_args__ = (Index('ix_compras_nucleo_oferta', id_nucleo, id_oferta),
+                      {'postgresql_partition_by': 'RANGE (fecha)'})
+
+
+for sentencia in INICIAL:
+    event.listen(CompraS.__table__, 'after_create', DDL(sentencia))
 
 
 from .usuarios import UsuarioE, UsuarioId, UsuarioS
 from .nucleos import NucleoE, NucleoId, NucleoS
 from .ofertas import OfertaE, OfertaId, OfertaS
 from .estados import EstadoE, EstadoId, EstadoS
+from .consumidores import ConsumidorS
+from .bodegas import BodegaS
 
 CompraP.model_rebuild()
 CompraR.model_rebuild()
@@ -143,6 +172,11 @@ async def _find(p: BaseModel, db: Session):
             query = query.filter(CompraS.id_compra == p.id_compra)
         if p.fecha:
             query = query.filter(CompraS.fecha == p.fecha)
+        # Con un rango de fechas el planificador solo recorre las particiones de esos meses
+        if p.fecha_desde:
+            query = query.filter(CompraS.fecha >= p.fecha_desde)
+        if p.fecha_hasta:
+            query = query.filter(CompraS.fecha < p.fecha_hasta)
         if p.terminado is not None:
             query = query.filter(CompraS.terminado == p.terminado)
         if p.pagado is not None:
@@ -214,86 +248,144 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[CompraP])
-async def read_all(skip: int = 0, limit: int = 100, p: CompraR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: CompraR = None, db: Session = Depends(get_db_lectura)):
+    query = await _find(p, db)
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, CompraS, CompraP, fields)
+    return await forwards.page(query, CompraP)
+
+
+# noinspection PyTypeChecker
+@router.post("/export")
+async def export(formato: str = 'ndjson', p: CompraR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    return await forwards.export(query, CompraEx, formato)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=CompraP)
-async def read(p: CompraR, db: Session = Depends(get_db)):
+async def read(p: CompraR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
+def _por_id(db: Session, id_compra: int, fecha: datetime.datetime | None = None, buscar: bool = True):
+    """
+    Query de una compra con id_compra y fecha, así el planificador solo abre su partición. Sin fecha y con buscar
+    se lee antes la fecha: esa búsqueda recorre el índice de la llave en cada partición, pero el update o delete que
+    sigue ya no planifica ni bloquea todas
+    """
+    if fecha is None and buscar:
+        fecha = db.query(CompraS.fecha).filter(CompraS.id_compra == id_compra).limit(1).scalar()
+        if fecha is None:
+            return db.query(CompraS).filter(false())
+    query = db.query(CompraS).filter(CompraS.id_compra == id_compra)
+    return query if fecha is None else query.filter(CompraS.fecha == fecha)
+
+
+def _tiendas(db: Session, query, *ofertas: int | None):
+    """
+    Tienda de la oferta de las compras de query y de las ofertas dadas
+    """
+    tiendas = [query.join(CompraS.oferta).with_entities(OfertaS.id_tienda).scalar()] if query is not None else []
+    ids = [id_oferta for id_oferta in ofertas if id_oferta is not None]
+    if ids:
+        tiendas += [id_tienda for id_tienda, in db.query(OfertaS.id_tienda).filter(OfertaS.id_oferta.in_(ids))]
+    return tiendas
+
+
 # noinspection PyTypeChecker
 @router.post("/create", response_model=CompraP)
-async def create(p: CompraC, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_nucleo == p.id_nucleo, CompraS.id_usuario == p.id_usuario,
-                                     CompraS.id_oferta == p.id_oferta, CompraS.id_estado == p.estado)
-    model = CompraS(terminado=p.terminado, pagado=p.pagado,
-                    id_usuario=p.id_usuario, id_nucleo=p.id_nucleo, id_oferta=p.id_oferta, id_estado=p.id_estado)
+async def create(p: CompraC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    terminado, pagado, id_estado = p.terminado, p.pagado, p.estado.id_estado
+    tiendas = _tiendas(db, None, p.oferta.id_oferta)
+    if not (permisos.admin or (tiendas and all(permisos.tienda(id_tienda) for id_tienda in tiendas))):
+        # El consumidor compra para sí mismo, en un núcleo del que es miembro activo y que atiende la tienda de la
+        # oferta; la compra nace sin pagar ni terminar y en el estado inicial
+        miembro = db.query(ConsumidorS.id_consumidor).join(NucleoS, NucleoS.id_nucleo == ConsumidorS.id_nucleo).join(
+            BodegaS, BodegaS.id_bodega == NucleoS.id_bodega).filter(
+            ConsumidorS.id_usuario == permisos.id_usuario, ConsumidorS.id_nucleo == p.nucleo.id_nucleo,
+            ConsumidorS.desac.is_(False), BodegaS.id_tienda.in_(tiendas)).first()
+        if p.usuario.id_usuario != permisos.id_usuario or miembro is None:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+        terminado, pagado, id_estado = False, False, ESTADO_INICIAL
+    query = db.query(CompraS).filter(CompraS.id_nucleo == p.nucleo.id_nucleo, CompraS.id_usuario == p.usuario.id_usuario,
+                                     CompraS.id_oferta == p.oferta.id_oferta, CompraS.id_estado == id_estado)
+    model = CompraS(fecha=p.fecha, terminado=terminado, pagado=pagado, seleccion=p.seleccion,
+                    id_usuario=p.usuario.id_usuario, id_nucleo=p.nucleo.id_nucleo, id_oferta=p.oferta.id_oferta,
+                    id_estado=id_estado)
     return await forwards.create(model, query, db)
 
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=CompraP)
-async def update(up: CompraU, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == up.id_compra)
+async def update(up: CompraU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    query = _por_id(db, up.id_compra)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query, up.id_oferta))
     return await forwards.update(up, query, ['id_compra'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=CompraE)
-async def delete(p: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == p.id_compra)
+async def delete(p: CompraId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    query = _por_id(db, p.id_compra, p.fecha)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query))
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/pagado", response_model=CompraP)
-async def pagado(up: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == up.id_compra)
+async def pagado(up: CompraId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    query = _por_id(db, up.id_compra, up.fecha)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query))
     return await forwards.changeTrue(query, db, 'pagado')
 
 
 # noinspection PyTypeChecker
 @router.put("/terminado", response_model=CompraP)
-async def terminado(up: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == up.id_compra)
+async def terminado(up: CompraId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    query = _por_id(db, up.id_compra, up.fecha)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query))
     return await forwards.changeTrue(query, db, 'terminado')
 
 
 # noinspection PyTypeChecker
 @router.put("/notificado", response_model=CompraP)
-async def terminado(up: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == up.id_compra)
+async def terminado(up: CompraId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    query = _por_id(db, up.id_compra, up.fecha)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query))
     return await forwards.changeTrue(query, db, 'notificado')
 
 
 # noinspection PyTypeChecker
 @router.post("/oferta", response_model=CompraOf)
-async def read_oferta(p: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == p.id_compra)
+async def read_oferta(p: CompraId, db: Session = Depends(get_db_lectura)):
+    query = _por_id(db, p.id_compra, p.fecha, buscar=False)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/nucleo", response_model=CompraNu)
-async def read_nucleo(p: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == p.id_compra)
+async def read_nucleo(p: CompraId, db: Session = Depends(get_db_lectura)):
+    query = _por_id(db, p.id_compra, p.fecha, buscar=False)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/usuario", response_model=CompraUs)
-async def read_usuario(p: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == p.id_compra)
+async def read_usuario(p: CompraId, db: Session = Depends(get_db_lectura)):
+    query = _por_id(db, p.id_compra, p.fecha, buscar=False)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/estado", response_model=CompraEs)
-async def read_estado(p: CompraId, db: Session = Depends(get_db)):
-    query = db.query(CompraS).filter(CompraS.id_compra == p.id_compra)
+async def read_estado(p: CompraId, db: Session = Depends(get_db_lectura)):
+    query = _por_id(db, p.id_compra, p.fecha, buscar=False)
     return await forwards.read(query)
@@ -1,11 +1,12 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, String
 from sqlalchemy.orm import Session
 from fastapi import Depends, APIRouter
 from typing import List
 from service import forwards
+from service.permisos import Permisos, requiere_rol
 
 router = APIRouter()
 
@@ -58,21 +59,24 @@ async def _find(p: BaseModel, db: Session):
 
 
 @router.post("/all", response_model=List[ConfiguracionP])
-async def read_all(skip: int = 0, limit: int = 100, p: ConfiguracionR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: ConfiguracionR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, ConfiguracionS, ConfiguracionP, fields)
+    return await forwards.page(query, ConfiguracionP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=ConfiguracionP)
-async def read(p: ConfiguracionR, db: Session = Depends(get_db)):
+async def read(p: ConfiguracionR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=ConfiguracionP)
-async def create(p: ConfiguracionC, db: Session = Depends(get_db)):
+async def create(p: ConfiguracionC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ConfiguracionS).filter(ConfiguracionS.nombre == p.nombre)
     model = ConfiguracionS(nombre=p.nombre, valor=p.valor)
     return await forwards.create(model, query, db)
@@ -80,13 +84,13 @@ async def create(p: ConfiguracionC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=ConfiguracionP)
-async def update(up: ConfiguracionU, db: Session = Depends(get_db)):
+async def update(up: ConfiguracionU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ConfiguracionS).filter(ConfiguracionS.nombre == up.nombre)
     return await forwards.update(up, query, ['nombre'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=ConfiguracionE)
-async def delete(p: ConfiguracionId, db: Session = Depends(get_db)):
+async def delete(p: ConfiguracionId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ConfiguracionS).filter(ConfiguracionS.nombre == p.nombre)
     return await forwards.delete(query, db)
@@ -2,13 +2,14 @@ from __future__ import annotations
 import datetime
 
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, ForeignKey, Integer, DateTime, func, Boolean, UniqueConstraint
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, ForeignKey, Integer, DateTime, func, Boolean, UniqueConstraint, event, update as sql_update
 from sqlalchemy.orm import Session, Mapped, relationship, mapped_column
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, exigir_oficina, principal
 
 router = APIRouter()
 
@@ -43,6 +44,11 @@ class ConsumidorE(BaseModel):
     desac: bool | None = None
 
 
+class ConsumidorEx(ConsumidorE):
+    id_usuario: int
+    id_nucleo: int
+
+
 class ConsumidorR(BaseModel):
     id_consumidor: int | None = None
     verificado: bool | None = None
@@ -74,7 +80,7 @@ class ConsumidorUs(ConsumidorId):
 class ConsumidorS(Base):
     __tablename__ = "consumidores"
     id_consumidor = Column(Integer, primary_key=True, index=True)
-    id_usuario = Column(Integer, ForeignKey('usuarios.id_usuario', ondelete='CASCADE'), nullable=False, index=True)
+    id_usuario = Column(Integer, ForeignKey('usuarios.id_usuario', ondelete='CASCADE'), nullable=False, index=False)
     usuario: Mapped['UsuarioS'] = relationship('UsuarioS', back_populates="consumidores")
     id_nucleo: Mapped[int] = mapped_column(ForeignKey('nucleos.id_nucleo', ondelete='CASCADE'), index=True)
     nucleo: Mapped['NucleoS'] = relationship(back_populates="consumidores", foreign_keys=id_nucleo)
@@ -87,6 +93,7 @@ class ConsumidorS(Base):
 
 from .usuarios import UsuarioE, UsuarioS, UsuarioId
 from .nucleos import NucleoE, NucleoS, NucleoId
+from .bodegas import BodegaS
 
 ConsumidorP.model_rebuild()
 ConsumidorR.model_rebuild()
@@ -96,6 +103,28 @@ ConsumidorNu.model_rebuild()
 ConsumidorUs.model_rebuild()
 
 
+def _miembros(id_nucleo: int, delta: int):
+    """
+    Sentencia que ajusta el contador cant_miembros del núcleo, se ejecuta dentro de la misma transacción
+    que el cambio del consumidor
+    """
+    nucleos = NucleoS.__table__
+    return (sql_update(nucleos).where(nucleos.c.id_nucleo == id_nucleo)
+            .values(cant_miembros=nucleos.c.cant_miembros + delta, version=nucleos.c.version + 1))
+
+
+@event.listens_for(ConsumidorS, 'after_insert')
+def _sumar_miembro(mapper, connection, target):
+    if not target.desac:
+        connection.execute(_miembros(target.id_nucleo, 1))
+
+
+@event.listens_for(ConsumidorS, 'after_delete')
+def _restar_miembro(mapper, connection, target):
+    if not target.desac:
+        connection.execute(_miembros(target.id_nucleo, -1))
+
+
 # noinspection PyTypeChecker
 async def _find(p: BaseModel, db: Session):
     query = db.query(ConsumidorS)
@@ -149,57 +178,96 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[ConsumidorP])
-async def read_all(skip: int = 0, limit: int = 100, p: ConsumidorR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: ConsumidorR = None, db: Session = Depends(get_db_lectura)):
+    query = await _find(p, db)
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, ConsumidorS, ConsumidorP, fields)
+    return await forwards.page(query, ConsumidorP)
+
+
+# noinspection PyTypeChecker
+@router.post("/export")
+async def export(formato: str = 'ndjson', p: ConsumidorR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    return await forwards.export(query, ConsumidorEx, formato)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=ConsumidorP)
-async def read(p: ConsumidorR, db: Session = Depends(get_db)):
+async def read(p: ConsumidorR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
+def _oficinas(db: Session, query, *nucleos: int | None):
+    """
+    Oficina de la bodega del núcleo de los consumidores de query y de los núcleos dados
+    """
+    oficinas = [query.join(ConsumidorS.nucleo).join(NucleoS.bodega).with_entities(BodegaS.id_oficina).scalar()] \
+        if query is not None else []
+    ids = [id_nucleo for id_nucleo in nucleos if id_nucleo is not None]
+    if ids:
+        oficinas += [id_oficina for id_oficina, in db.query(BodegaS.id_oficina).join(NucleoS.bodega)
+                     .filter(NucleoS.id_nucleo.in_(ids))]
+    return oficinas
+
+
 # noinspection PyTypeChecker
 @router.post("/create", response_model=ConsumidorP)
-async def create(p: ConsumidorC, db: Session = Depends(get_db)):
-    query = db.query(ConsumidorS).filter(ConsumidorS.id_nucleo == p.id_nucleo,
-                                          ConsumidorS.id_usuario == p.id_usuario)
-    model = ConsumidorS(id_usuario=p.id_usuario, id_nucleo=p.id_nucleo)
+async def create(p: ConsumidorC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, None, p.nucleo.id_nucleo))
+    query = db.query(ConsumidorS).filter(ConsumidorS.id_nucleo == p.nucleo.id_nucleo,
+                                          ConsumidorS.id_usuario == p.usuario.id_usuario)
+    model = ConsumidorS(id_usuario=p.usuario.id_usuario, id_nucleo=p.nucleo.id_nucleo, verificado=bool(p.verificado),
+                        fecha_creacion=p.fecha_creacion)
     return await forwards.create(model, query, db)
 
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=ConsumidorP)
-async def update(up: ConsumidorU, db: Session = Depends(get_db)):
+async def update(up: ConsumidorU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(ConsumidorS).filter(ConsumidorS.id_consumidor == up.id_consumidor)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query, up.id_nucleo))
+    if up.id_nucleo:
+        consumidor = await forwards.read(query.with_for_update())
+        if consumidor.id_nucleo != up.id_nucleo and not consumidor.desac:
+            db.execute(_miembros(consumidor.id_nucleo, -1))
+            db.execute(_miembros(up.id_nucleo, 1))
     return await forwards.update(up, query, ['id_consumidor'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=ConsumidorE)
-async def delete(p: ConsumidorId, db: Session = Depends(get_db)):
+async def delete(p: ConsumidorId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(ConsumidorS).filter(ConsumidorS.id_consumidor == p.id_consumidor)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query))
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=ConsumidorP)
-async def activate(up: ConsumidorId, db: Session = Depends(get_db)):
+async def activate(up: ConsumidorId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(ConsumidorS).filter(ConsumidorS.id_consumidor == up.id_consumidor)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query))
+    consumidor = await forwards.read(query.with_for_update())
+    db.execute(_miembros(consumidor.id_nucleo, 1 if consumidor.desac else -1))
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/nucleo", response_model=ConsumidorNu)
-async def read_nucleo(p: ConsumidorId, db: Session = Depends(get_db)):
+async def read_nucleo(p: ConsumidorId, db: Session = Depends(get_db_lectura)):
     query = db.query(ConsumidorS).filter(ConsumidorS.id_consumidor == p.id_consumidor)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/usuario", response_model=ConsumidorUs)
-async def read_usuario(p: ConsumidorId, db: Session = Depends(get_db)):
+async def read_usuario(p: ConsumidorId, db: Session = Depends(get_db_lectura)):
     query = db.query(ConsumidorS).filter(ConsumidorS.id_consumidor == p.id_consumidor)
     return await forwards.read(query)
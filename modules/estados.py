@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
@@ -97,14 +97,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[EstadoP])
-async def read_all(skip: int = 0, limit: int = 100, p: EstadoR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: EstadoR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, EstadoS, EstadoP, fields)
+    return await forwards.page(query, EstadoP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=EstadoP)
-async def read(p: EstadoR, db: Session = Depends(get_db)):
+async def read(p: EstadoR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -133,6 +136,6 @@ async def delete(p: EstadoId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/compras", response_model=EstadoCo)
-async def read_compras(p: EstadoId, db: Session = Depends(get_db)):
+async def read_compras(p: EstadoId, db: Session = Depends(get_db_lectura)):
     query = db.query(EstadoS).filter(EstadoS.id_estado == p.id_estado)
     return await forwards.read(query)
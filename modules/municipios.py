@@ -1,11 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import Session, relationship, Mapped
-from fastapi import Depends, APIRouter
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, Text
+from sqlalchemy.orm import Session, relationship, Mapped, joinedload
+from fastapi import Depends, APIRouter, HTTPException, Response
 from typing import List, Optional
-from service import forwards
+from service import forwards, arbol
+from service.arbol import MunicipioA
+from service.normalizar import catalogo, coincide, normalizada, trigrama
 
 router = APIRouter()
 
@@ -90,6 +92,7 @@ class MunicipioS(Base):
     __tablename__ = "municipios"
     id_municipio = Column(Integer, primary_key=True, index=True)
     nombre = Column(String, unique=True, nullable=False, index=True)
+    nombre_norm = Column(Text, normalizada('nombre'))
     siglas = Column(String, unique=False, nullable=True, index=False)
     ubicacion = Column(String, unique=False, nullable=True, index=False)
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
@@ -98,13 +101,17 @@ class MunicipioS(Base):
     provincia: Mapped['ProvinciaS'] = relationship('ProvinciaS', back_populates="municipios")
     tiendas: Mapped[List["TiendaS"]] = relationship(back_populates="municipio", cascade="all, delete")
     oficinas: Mapped[List["OficinaS"]] = relationship(back_populates="municipio", cascade="all, delete")
-    __table_args__ = (UniqueConstraint(nombre, id_provincia, name='u_nombre_provincia'),)
+    __table_args__ = (UniqueConstraint(nombre, id_provincia, name='u_nombre_provincia'),
+                      trigrama('municipios', 'nombre_norm'))
+
+
+catalogo(MunicipioS, 'nombre')
 
 
 from .provincias import ProvinciaE, ProvinciaS, ProvinciaId
 from .tiendas import TiendaE, TiendaS
 from .oficinas import OficinaE, OficinaS
-from .bodegas import BodegaE
+from .bodegas import BodegaE, BodegaS
 
 MunicipioP.model_rebuild()
 MunicipioR.model_rebuild()
@@ -123,7 +130,7 @@ async def _find(p: BaseModel, db: Session):
         if p.id_municipio:
             query = query.filter(MunicipioS.id_municipio == p.id_municipio)
         if p.nombre:
-            query = query.filter(MunicipioS.nombre.ilike(f'%{p.nombre}%'))
+            query = query.filter(coincide(db, MunicipioS, 'nombre', p.nombre))
         if p.siglas:
             query = query.filter(MunicipioS.siglas.ilike(f'%{p.siglas}%'))
         if p.ubicacion:
@@ -136,7 +143,7 @@ async def _find(p: BaseModel, db: Session):
             if r.id_provincia:
                 query = query.filter(ProvinciaS.id_provincia == r.id_provincia)
             if r.nombre:
-                query = query.filter(ProvinciaS.nombre.ilike(f'%{r.nombre}%'))
+                query = query.filter(coincide(db, ProvinciaS, 'nombre', r.nombre))
             if r.siglas:
                 query = query.filter(ProvinciaS.siglas.ilike(f'%{r.siglas}%'))
             if r.ubicacion:
@@ -156,7 +163,7 @@ async def _find(p: BaseModel, db: Session):
             if r.id_tienda:
                 query = query.filter(TiendaS.id_tienda == r.id_tienda)
             if r.nombre:
-                query = query.filter(TiendaS.nombre.ilike(f'%{r.nombre}%'))
+                query = query.filter(coincide(db, TiendaS, 'nombre', r.nombre))
             if r.direccion:
                 query = query.filter(TiendaS.direccion.ilike(f'%{r.direccion}%'))
             if r.frecuencia_venta:
@@ -166,14 +173,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[MunicipioP])
-async def read_all(skip: int = 0, limit: int = 100, p: MunicipioR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: MunicipioR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, MunicipioS, MunicipioP, fields)
+    return await forwards.page(query, MunicipioP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=MunicipioP)
-async def read(p: MunicipioR, db: Session = Depends(get_db)):
+async def read(p: MunicipioR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -211,32 +221,41 @@ async def activate(up: MunicipioId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/provincia", response_model=MunicipioPr)
-async def read_provincia(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_provincia(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(MunicipioS).filter(MunicipioS.id_municipio == p.id_municipio)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/tiendas", response_model=MunicipioTi)
-async def read_tiendas(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_tiendas(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(MunicipioS).filter(MunicipioS.id_municipio == p.id_municipio)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/oficinas", response_model=MunicipioOf)
-async def read_oficinas(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_oficinas(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(MunicipioS).filter(MunicipioS.id_municipio == p.id_municipio)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/bodegas", response_model=MunicipioBo)
-async def read_oficinas(p: MunicipioId, db: Session = Depends(get_db)):
-    query = db.query(MunicipioS).filter(MunicipioS.id_municipio == p.id_municipio)
-    query = await forwards.read(query)
-    bodegas = []
-    for ofi in query.oficinas:
-        bodegas.extend([BodegaE(**i.__dict__) for i in ofi.bodegas])
-    return MunicipioBo(id_municipio=query.id_municipio, nombre=query.nombre,
-                       provincia=ProvinciaE(**query.provincia.__dict__), bodegas=bodegas)
+async def read_bodegas(p: MunicipioId, db: Session = Depends(get_db_lectura)):
+    query = db.query(MunicipioS).options(joinedload(MunicipioS.provincia))
+    query = await forwards.read(query.filter(MunicipioS.id_municipio == p.id_municipio))
+    bodegas = db.query(BodegaS).join(OficinaS, OficinaS.id_oficina == BodegaS.id_oficina)
+    bodegas = bodegas.filter(OficinaS.id_municipio == p.id_municipio).all()
+    return {'id_municipio': query.id_municipio, 'nombre': query.nombre, 'provincia': query.provincia,
+            'bodegas': bodegas}
+
+
+# noinspection PyTypeChecker
+@router.post("/arbol", response_model=MunicipioA)
+async def read_arbol(p: MunicipioId, response: Response, conteos: bool = False, db: Session = Depends(get_db_lectura)):
+    query = await arbol.municipio(db, p.id_municipio, conteos)
+    if not query:
+        raise HTTPException(status_code=400, detail="Is not Exists")
+    response.headers['Cache-Control'] = f"max-age={int(arbol.cache.ttl)}"
+    return query
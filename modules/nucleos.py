@@ -1,12 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, ForeignKey, String, UniqueConstraint, Boolean
 from sqlalchemy.orm import Session, Mapped, relationship, mapped_column
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Request, Response
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, exigir_oficina, principal
 
 router = APIRouter()
 
@@ -45,6 +46,11 @@ class NucleoE(BaseModel):
     desac: bool | None = None
 
 
+class NucleoEx(NucleoE):
+    id_bodega: int
+    id_consumidor_jefe: int | None = None
+
+
 class NucleoR(BaseModel):
     id_nucleo: int | None = None
     numero: str | None = None
@@ -97,7 +103,7 @@ class NucleoS(Base):
     id_nucleo = Column(Integer, primary_key=True, index=True)
     numero = Column(String, nullable=False, index=True)
     cant_miembros = Column(Integer, nullable=False, index=True, default=0)
-    cant_modulos = Column(Integer, nullable=False, index=True, default=0)
+    cant_modulos = Column(Integer, nullable=False, index=False, default=0)
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     id_bodega: Mapped[int] = mapped_column(ForeignKey('bodegas.id_bodega', ondelete='CASCADE'), nullable=False, index=True)
     bodega: Mapped['BodegaS'] = relationship(back_populates="nucleos")
@@ -105,7 +111,10 @@ class NucleoS(Base):
     id_consumidor_jefe: Mapped[Optional[int]] = mapped_column(ForeignKey('consumidores.id_consumidor', ondelete='CASCADE'), index=True)
     consumidor_jefe: Mapped[Optional['ConsumidorS']] = relationship(back_populates="nucleos_jefe", foreign_keys=id_consumidor_jefe)
     compras: Mapped[List['CompraS']] = relationship(back_populates="nucleo", cascade="all, delete")
+    # Se incrementa en cada cambio, de ella sale el ETag de las lecturas
+    version = Column(Integer, nullable=False, server_default='1')
     __table_args__ = (UniqueConstraint(numero, id_bodega, name='u_numero_bodega'),)
+    __mapper_args__ = {'version_id_col': version}
 
 
 from .bodegas import BodegaE, BodegaId, BodegaS
@@ -185,72 +194,102 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[NucleoP])
-async def read_all(skip: int = 0, limit: int = 100, p: NucleoR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: NucleoR = None, db: Session = Depends(get_db_lectura)):
+    query = await _find(p, db)
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, NucleoS, NucleoP, fields)
+    return await forwards.page(query, NucleoP)
+
+
+# noinspection PyTypeChecker
+@router.post("/export")
+async def export(formato: str = 'ndjson', p: NucleoR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    return await forwards.export(query, NucleoEx, formato)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=NucleoP)
-async def read(p: NucleoR, db: Session = Depends(get_db)):
+async def read(p: NucleoR, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, NucleoS.consumidores, NucleoS.compras)
+
+
+def _oficinas(db: Session, query, *bodegas: int | None):
+    """
+    Oficina de la bodega de los núcleos de query y de las bodegas dadas
+    """
+    oficinas = [query.join(NucleoS.bodega).with_entities(BodegaS.id_oficina).scalar()] if query is not None else []
+    ids = [id_bodega for id_bodega in bodegas if id_bodega is not None]
+    if ids:
+        oficinas += [id_oficina for id_oficina, in db.query(BodegaS.id_oficina).filter(BodegaS.id_bodega.in_(ids))]
+    return oficinas
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=NucleoP)
-async def create(p: NucleoC, db: Session = Depends(get_db)):
+async def create(p: NucleoC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, None, p.bodega.id_bodega))
     query = db.query(NucleoS).filter(NucleoS.numero == p.numero)
-    query = query.filter(NucleoS.id_bodega == p.bodega.id_bodega).first()
+    query = query.filter(NucleoS.id_bodega == p.bodega.id_bodega)
     model = NucleoS(numero=p.numero, cant_miembros=p.cant_miembros, cant_modulos=p.cant_modulos,
-                    id_bodega=p.bodega.id_bodega, id_consumidor_jefe=p.consumidor_jefe.id_consumidor)
+                    id_bodega=p.bodega.id_bodega,
+                    id_consumidor_jefe=p.consumidor_jefe.id_consumidor if p.consumidor_jefe else None)
     return await forwards.create(model, query, db)
 
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=NucleoP)
-async def update(up: NucleoU, db: Session = Depends(get_db)):
+async def update(up: NucleoU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == up.id_nucleo)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query, up.id_bodega))
     return await forwards.update(up, query, ['id_nucleo'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=NucleoE)
-async def delete(p: NucleoId, db: Session = Depends(get_db)):
+async def delete(p: NucleoId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == p.id_nucleo)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query))
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=NucleoP)
-async def activate(up: NucleoId, db: Session = Depends(get_db)):
+async def activate(up: NucleoId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == up.id_nucleo)
+    if not permisos.admin:
+        exigir_oficina(permisos, *_oficinas(db, query))
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/bodega", response_model=NucleoBo)
-async def read_bodega(p: NucleoId, db: Session = Depends(get_db)):
+async def read_bodega(p: NucleoId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == p.id_nucleo)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response)
 
 
 # noinspection PyTypeChecker
 @router.post("/consumidor_jefe", response_model=NucleoJe)
-async def read_consumidor_jefe(p: NucleoId, db: Session = Depends(get_db)):
+async def read_consumidor_jefe(p: NucleoId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == p.id_nucleo)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response)
 
 
 # noinspection PyTypeChecker
 @router.post("/consumidores", response_model=NucleoCs)
-async def read_consumidores(p: NucleoId, db: Session = Depends(get_db)):
+async def read_consumidores(p: NucleoId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == p.id_nucleo)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, NucleoS.consumidores)
 
 
 # noinspection PyTypeChecker
 @router.post("/compras", response_model=NucleoCp)
-async def read_compras(p: NucleoId, db: Session = Depends(get_db)):
+async def read_compras(p: NucleoId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(NucleoS).filter(NucleoS.id_nucleo == p.id_nucleo)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, NucleoS.compras)
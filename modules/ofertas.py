@@ -1,13 +1,14 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, ForeignKey, Integer, func, Date, String
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, ForeignKey, Integer, func, Date, String, Index
 from sqlalchemy.orm import Session, Mapped, relationship
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Request, Response
 from typing import List, Optional
 import datetime
 
 from service import forwards
+from service.permisos import Permisos, exigir_tienda, principal
 
 router = APIRouter()
 
@@ -95,10 +96,14 @@ class OfertaS(Base):
     cantidad = Column(Integer, unique=False, nullable=False, index=True)
     id_ciclo = Column(Integer, ForeignKey('ciclos.id_ciclo', ondelete='CASCADE'), nullable=False, index=True)
     ciclo: Mapped['CicloS'] = relationship('CicloS', back_populates="ofertas")
-    id_tienda = Column(Integer, ForeignKey('tiendas.id_tienda', ondelete='CASCADE'), nullable=False, index=True)
+    id_tienda = Column(Integer, ForeignKey('tiendas.id_tienda', ondelete='CASCADE'), nullable=False, index=False)
     tienda: Mapped['TiendaS'] = relationship('TiendaS', back_populates="ofertas")
     subofertas: Mapped[List['SubOfertaS']] = relationship(back_populates="oferta", cascade="all, delete")
     compras: Mapped[List['CompraS']] = relationship(back_populates="oferta", cascade="all, delete")
+    # Se incrementa en cada cambio, de ella sale el ETag de las lecturas
+    version = Column(Integer, nullable=False, server_default='1')
+    __table_args__ = (Index('ix_ofertas_tienda_fechas', id_tienda, fecha_inicio, fecha_fin),)
+    __mapper_args__ = {'version_id_col': version}
 
 
 from .tiendas import TiendaE, TiendaId, TiendaS
@@ -184,65 +189,74 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[OfertaP])
-async def read_all(skip: int = 0, limit: int = 100, p: OfertaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: OfertaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, OfertaS, OfertaP, fields)
+    return await forwards.page(query, OfertaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=OfertaP)
-async def read(p: OfertaR, db: Session = Depends(get_db)):
+async def read(p: OfertaR, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, OfertaS.tienda, OfertaS.subofertas, OfertaS.compras)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=OfertaP)
-async def create(p: OfertaC, db: Session = Depends(get_db)):
-    query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
+async def create(p: OfertaC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    exigir_tienda(permisos, p.tienda.id_tienda)
+    query = db.query(OfertaS).filter(OfertaS.id_ciclo == p.ciclo.id_ciclo, OfertaS.id_tienda == p.tienda.id_tienda,
+                                     OfertaS.descripcion == p.descripcion)
 
-    model = OfertaS(descripcion=p.descripcion, fecha_inicio=p.fecha_inicio,
-                    fecha_fin=p.fecha_fin, cantidad=p.cantidad, id_ciclo=p.id_ciclo)
+    model = OfertaS(descripcion=p.descripcion, fecha_inicio=p.fecha_inicio, fecha_fin=p.fecha_fin,
+                    cantidad=p.cantidad, id_ciclo=p.ciclo.id_ciclo, id_tienda=p.tienda.id_tienda)
     return await forwards.create(model, query, db)
 
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=OfertaP)
-async def update(up: OfertaU, db: Session = Depends(get_db)):
+async def update(up: OfertaU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == up.id_oferta)
+    if not permisos.admin:
+        exigir_tienda(permisos, query.with_entities(OfertaS.id_tienda).scalar(), up.id_tienda)
     return await forwards.update(up, query, ['id_oferta'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=OfertaE)
-async def delete(p: OfertaId, db: Session = Depends(get_db)):
+async def delete(p: OfertaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
+    if not permisos.admin:
+        exigir_tienda(permisos, query.with_entities(OfertaS.id_tienda).scalar())
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/ciclo", response_model=OfertaCi)
-async def read_ciclo(p: OfertaId, db: Session = Depends(get_db)):
+async def read_ciclo(p: OfertaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response)
 
 
 # noinspection PyTypeChecker
 @router.post("/tienda", response_model=OfertaTi)
-async def read_tienda(p: OfertaId, db: Session = Depends(get_db)):
+async def read_tienda(p: OfertaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, OfertaS.tienda)
 
 
 # noinspection PyTypeChecker
 @router.post("/subofertas", response_model=OfertaSu)
-async def read_subofertas(p: OfertaId, db: Session = Depends(get_db)):
+async def read_subofertas(p: OfertaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, OfertaS.subofertas)
 
 
 # noinspection PyTypeChecker
 @router.post("/compras", response_model=OfertaCo)
-async def read_compras(p: OfertaId, db: Session = Depends(get_db)):
+async def read_compras(p: OfertaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(OfertaS).filter(OfertaS.id_oferta == p.id_oferta)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, OfertaS.compras)
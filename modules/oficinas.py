@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, Boolean, String, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
@@ -151,14 +151,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[OficinaP])
-async def read_all(skip: int = 0, limit: int = 100, p: OficinaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: OficinaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, OficinaS, OficinaP, fields)
+    return await forwards.page(query, OficinaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=OficinaP)
-async def read(p: OficinaR, db: Session = Depends(get_db)):
+async def read(p: OficinaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -195,20 +198,20 @@ async def activate(up: OficinaId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/bodegas", response_model=OficinaBo)
-async def read_bodegas(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_bodegas(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(OficinaS).filter(OficinaS.id_oficina == p.id_oficina)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/oficodas", response_model=OficinaOf)
-async def read_oficodas(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_oficodas(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(OficinaS).filter(OficinaS.id_oficina == p.id_oficina)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/municipio", response_model=OficinaMu)
-async def read_municipio(p: MunicipioId, db: Session = Depends(get_db)):
+async def read_municipio(p: MunicipioId, db: Session = Depends(get_db_lectura)):
     query = db.query(OficinaS).filter(OficinaS.id_oficina == p.id_oficina)
     return await forwards.read(query)
@@ -2,13 +2,14 @@ from __future__ import annotations
 import datetime
 
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, ForeignKey, Integer, DateTime, func, Boolean, UniqueConstraint
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, requiere_rol, vigilar
 
 router = APIRouter()
 
@@ -78,6 +79,9 @@ class OficodaS(Base):
     __table_args__ = (UniqueConstraint(id_oficina, id_usuario, name='u_oficina_usuario'),)
 
 
+vigilar(OficodaS)
+
+
 from .usuarios import UsuarioE, UsuarioS, UsuarioId
 from .oficinas import OficinaE, OficinaS, OficinaId
 
@@ -138,21 +142,24 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[OficodaP])
-async def read_all(skip: int = 0, limit: int = 100, p: OficodaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: OficodaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, OficodaS, OficodaP, fields)
+    return await forwards.page(query, OficodaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=OficodaP)
-async def read(p: OficodaR, db: Session = Depends(get_db)):
+async def read(p: OficodaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=OficodaP)
-async def create(p: OficodaC, db: Session = Depends(get_db)):
+async def create(p: OficodaC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(OficodaS).filter(OficodaS.id_oficina == p.id_oficina,
                                       OficodaS.id_usuario == p.id_usuario)
     model = OficodaS(id_usuario=p.id_usuario, id_oficina=p.id_oficina)
@@ -161,34 +168,34 @@ async def create(p: OficodaC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=OficodaP)
-async def update(up: OficodaU, db: Session = Depends(get_db)):
+async def update(up: OficodaU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(OficodaS).filter(OficodaS.id_oficoda == up.id_oficoda)
     return await forwards.update(up, query, ['id_oficoda'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=OficodaE)
-async def delete(p: OficodaId, db: Session = Depends(get_db)):
+async def delete(p: OficodaId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(OficodaS).filter(OficodaS.id_oficoda == p.id_oficoda)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=OficodaP)
-async def activate(up: OficodaId, db: Session = Depends(get_db)):
+async def activate(up: OficodaId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(OficodaS).filter(OficodaS.id_oficoda == up.id_oficoda)
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/oficina", response_model=OficodaOf)
-async def read_oficina(p: OficodaId, db: Session = Depends(get_db)):
+async def read_oficina(p: OficodaId, db: Session = Depends(get_db_lectura)):
     query = db.query(OficodaS).filter(OficodaS.id_oficoda == p.id_oficoda)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/usuario", response_model=OficodaUs)
-async def read_usuario(p: OficodaId, db: Session = Depends(get_db)):
+async def read_usuario(p: OficodaId, db: Session = Depends(get_db_lectura)):
     query = db.query(OficodaS).filter(OficodaS.id_oficoda == p.id_oficoda)
     return await forwards.read(query)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, ForeignKey, String, Boolean
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
@@ -125,14 +125,17 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[ProductoP])
-async def read_all(skip: int = 0, limit: int = 100, p: ProductoR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: ProductoR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, ProductoS, ProductoP, fields)
+    return await forwards.page(query, ProductoP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=ProductoP)
-async def read(p: ProductoR, db: Session = Depends(get_db)):
+async def read(p: ProductoR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -169,13 +172,13 @@ async def activate(up: ProductoId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/subofertas", response_model=ProductoSu)
-async def read_ofe(p: ProductoId, db: Session = Depends(get_db)):
+async def read_ofe(p: ProductoId, db: Session = Depends(get_db_lectura)):
     query = db.query(ProductoS).filter(ProductoS.id_producto == p.id_producto)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/categoria", response_model=ProductoCa)
-async def read_categoria(p: ProductoId, db: Session = Depends(get_db)):
+async def read_categoria(p: ProductoId, db: Session = Depends(get_db_lectura)):
     query = db.query(ProductoS).filter(ProductoS.id_producto == p.id_producto)
     return await forwards.read(query)
@@ -1,11 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
-from sqlalchemy import Column, Integer, String, Boolean
+from database import Base, get_db, get_db_lectura
+from sqlalchemy import Column, Integer, String, Boolean, Text
 from sqlalchemy.orm import Session, Mapped, relationship
-from fastapi import Depends, APIRouter, Query
+from fastapi import Depends, APIRouter, Query, Response
 from typing import List, Optional
-from service import forwards
+from service import forwards, arbol
+from service.arbol import ProvinciaA
+from service.normalizar import catalogo, coincide, normalizada, trigrama
 
 router = APIRouter()
 
@@ -63,10 +65,15 @@ class ProvinciaS(Base):
     __tablename__ = "provincias"
     id_provincia = Column(Integer, primary_key=True, index=True)
     nombre = Column(String, unique=True, nullable=False, index=True)
+    nombre_norm = Column(Text, normalizada('nombre'))
     siglas = Column(String, unique=True, nullable=True, index=False)
     ubicacion = Column(String, unique=False, nullable=True, index=False)
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     municipios: Mapped[List["MunicipioS"]] = relationship(back_populates="provincia", cascade="all, delete")
+    __table_args__ = (trigrama('provincias', 'nombre_norm'),)
+
+
+catalogo(ProvinciaS, 'nombre')
 
 
 from .municipios import MunicipioE, MunicipioS
@@ -91,7 +98,7 @@ async def _find(p: BaseModel, db: Session):
         if p.id_provincia:
             query = query.filter(ProvinciaS.id_provincia == p.id_provincia)
         if p.nombre:
-            query = query.filter(ProvinciaS.nombre.ilike(f'%{p.nombre}%'))
+            query = query.filter(coincide(db, ProvinciaS, 'nombre', p.nombre))
         if p.siglas:
             query = query.filter(ProvinciaS.siglas.ilike(f'%{p.siglas}%'))
         if p.ubicacion:
@@ -104,7 +111,7 @@ async def _find(p: BaseModel, db: Session):
             if r.id_municipio:
                 query = query.filter(MunicipioS.id_municipio == r.id_municipio)
             if r.nombre:
-                query = query.filter(MunicipioS.nombre.ilike(f'%{r.nombre}%'))
+                query = query.filter(coincide(db, MunicipioS, 'nombre', r.nombre))
             if r.siglas:
                 query = query.filter(MunicipioS.siglas.ilike(f'%{r.siglas}%'))
             if r.ubicacion:
@@ -113,14 +120,17 @@ async def _find(p: BaseModel, db: Session):
 
 
 @router.post("/all", response_model=List[ProvinciaP])
-async def read_all(skip: int = 0, limit: int = 100, p: ProvinciaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: ProvinciaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, ProvinciaS, ProvinciaP, fields)
+    return await forwards.page(query, ProvinciaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=ProvinciaP)
-async def read(p: ProvinciaR, db: Session = Depends(get_db)):
+async def read(p: ProvinciaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
@@ -156,6 +166,13 @@ async def activate(up: ProvinciaId, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.post("/municipios", response_model=ProvinciaMu)
-async def read_municipios(p: ProvinciaId, db: Session = Depends(get_db)):
+async def read_municipios(p: ProvinciaId, db: Session = Depends(get_db_lectura)):
     query = db.query(ProvinciaS).filter(ProvinciaS.id_provincia == p.id_provincia)
     return await forwards.read(query)
+
+
+# noinspection PyTypeChecker
+@router.post("/arbol", response_model=List[ProvinciaA])
+async def read_arbol(response: Response, conteos: bool = False, p: ProvinciaId = None, db: Session = Depends(get_db_lectura)):
+    response.headers['Cache-Control'] = f"max-age={int(arbol.cache.ttl)}"
+    return await arbol.provincias(db, p.id_provincia if p else None, conteos)
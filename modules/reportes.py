@@ -0,0 +1,169 @@
+from __future__ import annotations
+import datetime
+import os
+
+from pydantic import BaseModel
+from database import Base, get_db_lectura
+from sqlalchemy import Column, ForeignKey, Integer, Double, DateTime, func
+from sqlalchemy.orm import Session
+from fastapi import Depends, APIRouter
+from typing import List
+
+from service import forwards
+
+router = APIRouter()
+
+# Días después del fin del ciclo en que sus ofertas se siguen refrescando, por pagos y entregas tardías
+GRACIA = int(os.getenv('REPORTES_GRACIA', 30))
+
+
+class ReporteR(BaseModel):
+    id_oferta: int | None = None
+    id_ciclo: int | None = None
+    id_tienda: int | None = None
+
+
+class ReporteP(BaseModel):
+    id_oferta: int
+    id_ciclo: int
+    id_tienda: int
+    compras: int
+    pagadas: int
+    terminadas: int
+    nucleos: int
+    nucleos_tienda: int
+    unidades: int
+    importe: float
+    actualizado: datetime.datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ReporteCi(BaseModel):
+    id_ciclo: int
+    ofertas: int
+    compras: int
+    pagadas: int
+    terminadas: int
+    unidades: int
+    importe: float
+    cobertura: float | None
+
+    class Config:
+        from_attributes = True
+
+
+class ReporteTi(ReporteCi):
+    id_tienda: int
+
+
+# noinspection PyTypeChecker
+class ReporteS(Base):
+    """
+    Resumen por oferta de sus compras, se refresca con refrescar() en lugar de agregarse en cada consulta
+    """
+    __tablename__ = "reportes_ofertas"
+    id_oferta = Column(Integer, ForeignKey('ofertas.id_oferta', ondelete='CASCADE'), primary_key=True)
+    id_ciclo = Column(Integer, ForeignKey('ciclos.id_ciclo', ondelete='CASCADE'), nullable=False, index=True)
+    id_tienda = Column(Integer, ForeignKey('tiendas.id_tienda', ondelete='CASCADE'), nullable=False, index=True)
+    compras = Column(Integer, nullable=False, default=0)
+    pagadas = Column(Integer, nullable=False, default=0)
+    terminadas = Column(Integer, nullable=False, default=0)
+    # Núcleos distintos que compraron y núcleos activos que atiende la tienda, su cociente es la cobertura
+    nucleos = Column(Integer, nullable=False, default=0)
+    nucleos_tienda = Column(Integer, nullable=False, default=0)
+    unidades = Column(Integer, nullable=False, default=0)
+    importe = Column(Double, nullable=False, default=0)
+    actualizado = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+_REFRESCAR = (
+    "INSERT INTO reportes_ofertas (id_oferta, id_ciclo, id_tienda, compras, pagadas, terminadas, nucleos, "
+    "nucleos_tienda, unidades, importe, actualizado) "
+    "SELECT o.id_oferta, o.id_ciclo, o.id_tienda, c.compras, c.pagadas, c.terminadas, c.nucleos, t.nucleos, "
+    "c.compras * s.unidades, c.pagadas * s.importe, now() "
+    "FROM ofertas o JOIN ciclos ci ON ci.id_ciclo = o.id_ciclo "
+    "CROSS JOIN LATERAL (SELECT COUNT(*) AS compras, COUNT(*) FILTER (WHERE pagado) AS pagadas, "
+    "                    COUNT(*) FILTER (WHERE terminado) AS terminadas, COUNT(DISTINCT id_nucleo) AS nucleos "
+    "                    FROM compras WHERE compras.id_oferta = o.id_oferta) c "
+    "CROSS JOIN LATERAL (SELECT COALESCE(SUM(cantidad), 0) AS unidades, COALESCE(SUM(precio * cantidad), 0) AS importe "
+    "                    FROM subofertas WHERE subofertas.id_oferta = o.id_oferta) s "
+    "CROSS JOIN LATERAL (SELECT COUNT(*) AS nucleos FROM nucleos n JOIN bodegas b ON b.id_bodega = n.id_bodega "
+    "                    WHERE b.id_tienda = o.id_tienda AND NOT n.desac) t "
+    "{filtro} "
+    "ON CONFLICT (id_oferta) DO UPDATE SET id_ciclo = EXCLUDED.id_ciclo, id_tienda = EXCLUDED.id_tienda, "
+    "compras = EXCLUDED.compras, pagadas = EXCLUDED.pagadas, terminadas = EXCLUDED.terminadas, "
+    "nucleos = EXCLUDED.nucleos, nucleos_tienda = EXCLUDED.nucleos_tienda, unidades = EXCLUDED.unidades, "
+    "importe = EXCLUDED.importe, actualizado = EXCLUDED.actualizado"
+)
+
+# Ciclos abiertos o cerrados hace menos de GRACIA días y ofertas que todavía no tienen resumen
+_ABIERTAS = ("WHERE ci.fecha_fin IS NULL OR ci.fecha_fin >= current_date - %s "
+             "OR NOT EXISTS (SELECT 1 FROM reportes_ofertas r WHERE r.id_oferta = o.id_oferta)")
+
+
+async def refrescar(todo: bool = False):
+    """
+    Recalcula el resumen de las ofertas de ciclos abiertos, o de todas con todo, en una sola sentencia
+    """
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    cursor = conn.cursor()
+    try:
+        if todo:
+            cursor.execute(_REFRESCAR.format(filtro=''))
+        else:
+            cursor.execute(_REFRESCAR.format(filtro=_ABIERTAS), (GRACIA,))
+        conn.commit()
+        print(f"Resumen actualizado para {cursor.rowcount} ofertas")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error al refrescar los reportes:", e)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _filtrar(query, p: ReporteR | None):
+    if p:
+        if p.id_oferta:
+            query = query.filter(ReporteS.id_oferta == p.id_oferta)
+        if p.id_ciclo:
+            query = query.filter(ReporteS.id_ciclo == p.id_ciclo)
+        if p.id_tienda:
+            query = query.filter(ReporteS.id_tienda == p.id_tienda)
+    return query
+
+
+def _totales():
+    return [func.count().label('ofertas'), func.sum(ReporteS.compras).label('compras'),
+            func.sum(ReporteS.pagadas).label('pagadas'), func.sum(ReporteS.terminadas).label('terminadas'),
+            func.sum(ReporteS.unidades).label('unidades'), func.sum(ReporteS.importe).label('importe'),
+            (func.sum(ReporteS.nucleos) / func.nullif(func.sum(ReporteS.nucleos_tienda), 0).cast(Double))
+            .label('cobertura')]
+
+
+# noinspection PyTypeChecker
+@router.post("/ofertas", response_model=List[ReporteP])
+async def read_ofertas(skip: int = 0, limit: int = 100, p: ReporteR = None, db: Session = Depends(get_db_lectura)):
+    query = _filtrar(db.query(ReporteS), p).order_by(ReporteS.id_oferta).offset(skip).limit(limit)
+    return await forwards.page(query, ReporteP)
+
+
+# noinspection PyTypeChecker
+@router.post("/ciclos", response_model=List[ReporteCi])
+async def read_ciclos(skip: int = 0, limit: int = 100, p: ReporteR = None, db: Session = Depends(get_db_lectura)):
+    query = _filtrar(db.query(ReporteS.id_ciclo, *_totales()), p).group_by(ReporteS.id_ciclo)
+    query = query.order_by(ReporteS.id_ciclo.desc()).offset(skip).limit(limit)
+    return await forwards.page(query, ReporteCi)
+
+
+# noinspection PyTypeChecker
+@router.post("/tiendas", response_model=List[ReporteTi])
+async def read_tiendas(skip: int = 0, limit: int = 100, p: ReporteR = None, db: Session = Depends(get_db_lectura)):
+    query = _filtrar(db.query(ReporteS.id_tienda, ReporteS.id_ciclo, *_totales()), p)
+    query = query.group_by(ReporteS.id_tienda, ReporteS.id_ciclo)
+    query = query.order_by(ReporteS.id_ciclo.desc(), ReporteS.id_tienda).offset(skip).limit(limit)
+    return await forwards.page(query, ReporteTi)
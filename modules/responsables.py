@@ -2,13 +2,14 @@ from __future__ import annotations
 import datetime
 
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, ForeignKey, Integer, DateTime, func, Boolean, UniqueConstraint
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, requiere_rol, vigilar
 
 router = APIRouter()
 
@@ -77,6 +78,9 @@ class ResponsableS(Base):
     __table_args__ = (UniqueConstraint(id_tienda, id_usuario, name='u_tienda_usuario'),)
 
 
+vigilar(ResponsableS)
+
+
 from .usuarios import UsuarioE, UsuarioS, UsuarioId
 from .tiendas import TiendaE, TiendaS, TiendaId
 
@@ -139,21 +143,24 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[ResponsableP])
-async def read_all(skip: int = 0, limit: int = 100, p: ResponsableR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: ResponsableR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, ResponsableS, ResponsableP, fields)
+    return await forwards.page(query, ResponsableP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=ResponsableP)
-async def read(p: ResponsableR, db: Session = Depends(get_db)):
+async def read(p: ResponsableR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=ResponsableP)
-async def create(p: ResponsableC, db: Session = Depends(get_db)):
+async def create(p: ResponsableC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ResponsableS).filter(ResponsableS.id_tienda == p.id_tienda,
                                           ResponsableS.id_usuario == p.id_usuario)
     model = ResponsableS(id_usuario=p.id_usuario, id_tienda=p.id_tienda)
@@ -162,34 +169,34 @@ async def create(p: ResponsableC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=ResponsableP)
-async def update(up: ResponsableU, db: Session = Depends(get_db)):
+async def update(up: ResponsableU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ResponsableS).filter(ResponsableS.id_responsable == up.id_responsable)
     return await forwards.update(up, query, ['id_responsable'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=ResponsableE)
-async def delete(p: ResponsableId, db: Session = Depends(get_db)):
+async def delete(p: ResponsableId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ResponsableS).filter(ResponsableS.id_responsable == p.id_responsable)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=ResponsableP)
-async def activate(up: ResponsableId, db: Session = Depends(get_db)):
+async def activate(up: ResponsableId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(ResponsableS).filter(ResponsableS.id_responsable == up.id_responsable)
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/tienda", response_model=ResponsableTi)
-async def read_tienda(p: ResponsableId, db: Session = Depends(get_db)):
+async def read_tienda(p: ResponsableId, db: Session = Depends(get_db_lectura)):
     query = db.query(ResponsableS).filter(ResponsableS.id_responsable == p.id_responsable)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/usuario", response_model=ResponsableUs)
-async def read_usuario(p: ResponsableId, db: Session = Depends(get_db)):
+async def read_usuario(p: ResponsableId, db: Session = Depends(get_db_lectura)):
     query = db.query(ResponsableS).filter(ResponsableS.id_responsable == p.id_responsable)
     return await forwards.read(query)
@@ -1,12 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, requiere_rol, vigilar
 
 router = APIRouter()
 
@@ -60,6 +61,9 @@ class RolS(Base):
     usuarios: Mapped[List['UsuarioS']] = relationship(back_populates="rol", cascade="all, delete")
 
 
+# Cambiar un rol cambia los permisos de todos sus usuarios
+vigilar(RolS, todos=True)
+
 from .usuarios import UsuarioS, UsuarioE
 
 RolP.model_rebuild()
@@ -109,21 +113,24 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[RolP])
-async def read_all(skip: int = 0, limit: int = 100, p: RolR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: RolR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, RolS, RolP, fields)
+    return await forwards.page(query, RolP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=RolP)
-async def read(p: RolR, db: Session = Depends(get_db)):
+async def read(p: RolR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=RolP)
-async def create(p: RolC, db: Session = Depends(get_db)):
+async def create(p: RolC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(RolS).filter(RolS.nombre == p.nombre)
     model = RolS(nombre=p.nombre, descripcion=p.descripcion)
     return await forwards.create(model, query, db)
@@ -131,20 +138,20 @@ async def create(p: RolC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=RolP)
-async def update(up: RolU, db: Session = Depends(get_db)):
+async def update(up: RolU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(RolS).filter(RolS.id_rol == up.id_rol)
     return await forwards.update(up, query, ['id_rol'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=RolE)
-async def delete(p: RolId, db: Session = Depends(get_db)):
+async def delete(p: RolId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(RolS).filter(RolS.id_rol == p.id_rol)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/usuarios", response_model=RolCo)
-async def read_usuarios(p: RolId, db: Session = Depends(get_db)):
+async def read_usuarios(p: RolId, db: Session = Depends(get_db_lectura)):
     query = db.query(RolS).filter(RolS.id_rol == p.id_rol)
     return await forwards.read(query)
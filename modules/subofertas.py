@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, ForeignKey, Integer, Double, String
 from sqlalchemy.orm import Session, Mapped, relationship
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, exigir_tienda, principal
 
 router = APIRouter()
 
@@ -133,50 +134,72 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[SubOfertaP])
-async def read_all(skip: int = 0, limit: int = 100, p: SubOfertaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: SubOfertaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, SubOfertaS, SubOfertaP, fields)
+    return await forwards.page(query, SubOfertaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=SubOfertaP)
-async def read(p: SubOfertaR, db: Session = Depends(get_db)):
+async def read(p: SubOfertaR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
+def _tiendas(db: Session, query, *ofertas: int | None):
+    """
+    Tienda de la oferta de las subofertas de query y de las ofertas dadas
+    """
+    tiendas = [query.join(SubOfertaS.oferta).with_entities(OfertaS.id_tienda).scalar()] if query is not None else []
+    ids = [id_oferta for id_oferta in ofertas if id_oferta is not None]
+    if ids:
+        tiendas += [id_tienda for id_tienda, in db.query(OfertaS.id_tienda).filter(OfertaS.id_oferta.in_(ids))]
+    return tiendas
+
+
 # noinspection PyTypeChecker
 @router.post("/create", response_model=SubOfertaP)
-async def create(p: SubOfertaC, db: Session = Depends(get_db)):
-    query = db.query(SubOfertaS).filter(SubOfertaS.id_suboferta == p.id_suboferta)
-    model = SubOfertaS(precio=p.precio, cantidad=p.cantidad, id_producto=p.id_producto,
-                       id_oferta=p.id_oferta, descripcion=p.descripcion)
+async def create(p: SubOfertaC, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, None, p.oferta.id_oferta))
+    query = db.query(SubOfertaS).filter(SubOfertaS.id_oferta == p.oferta.id_oferta,
+                                        SubOfertaS.id_producto == p.producto.id_producto,
+                                        SubOfertaS.descripcion == p.descripcion)
+    model = SubOfertaS(precio=p.precio, cantidad=p.cantidad, id_producto=p.producto.id_producto,
+                       id_oferta=p.oferta.id_oferta, descripcion=p.descripcion)
     return await forwards.create(model, query, db)
 
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=SubOfertaP)
-async def update(up: SubOfertaU, db: Session = Depends(get_db)):
+async def update(up: SubOfertaU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(SubOfertaS).filter(SubOfertaS.id_suboferta == up.id_suboferta)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query, up.id_oferta))
     return await forwards.update(up, query, ['id_suboferta'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=SubOfertaE)
-async def delete(p: SubOfertaId, db: Session = Depends(get_db)):
+async def delete(p: SubOfertaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
     query = db.query(SubOfertaS).filter(SubOfertaS.id_suboferta == p.id_suboferta)
+    if not permisos.admin:
+        exigir_tienda(permisos, *_tiendas(db, query))
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/producto", response_model=SubOfertaPr)
-async def read_producto(p: SubOfertaId, db: Session = Depends(get_db)):
+async def read_producto(p: SubOfertaId, db: Session = Depends(get_db_lectura)):
     query = db.query(SubOfertaS).filter(SubOfertaS.id_suboferta == p.id_suboferta)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/subsubofertas", response_model=SubOfertaOf)
-async def read_ofertas(p: SubOfertaId, db: Session = Depends(get_db)):
+async def read_ofertas(p: SubOfertaId, db: Session = Depends(get_db_lectura)):
     query = db.query(SubOfertaS).filter(SubOfertaS.id_suboferta == p.id_suboferta)
     return await forwards.read(query)
@@ -1,11 +1,13 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, ForeignKey, Text, UniqueConstraint, Boolean
 from sqlalchemy.orm import Session, Mapped, relationship
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Request, Response
 from typing import List, Optional
 from service import forwards
+from service.permisos import Permisos, exigir_tienda, principal, requiere_rol
+from service.normalizar import coincide, normalizada, trigrama
 
 router = APIRouter()
 
@@ -103,6 +105,7 @@ class TiendaS(Base):
     __tablename__ = "tiendas"
     id_tienda = Column(Integer, primary_key=True, index=True)
     nombre = Column(Text, unique=False, nullable=False, index=True)
+    nombre_norm = Column(Text, normalizada('nombre'))
     direccion = Column(Text, unique=False, nullable=True, index=False)
     desac = Column(Boolean, unique=False, nullable=False, index=False, default=False)
     frecuencia_venta = Column(Integer, unique=False, nullable=False, index=True, default=0)
@@ -115,7 +118,11 @@ class TiendaS(Base):
     bodegas: Mapped[List['BodegaS']] = relationship(back_populates="tienda", cascade="all, delete")
     responsables: Mapped[List['ResponsableS']] = relationship(back_populates="tienda", cascade="all, delete")
     ofertas: Mapped[List['OfertaS']] = relationship(back_populates="tienda", cascade="all, delete")
-    __table_args__ = (UniqueConstraint(nombre, id_municipio, id_cadena, name='nombre, id_municipio, id_cadena'),)
+    # Se incrementa en cada cambio, de ella sale el ETag de las lecturas
+    version = Column(Integer, nullable=False, server_default='1')
+    __table_args__ = (UniqueConstraint(nombre, id_municipio, id_cadena, name='nombre, id_municipio, id_cadena'),
+                      trigrama('tiendas', 'nombre_norm'))
+    __mapper_args__ = {'version_id_col': version}
 
 
 from .municipios import MunicipioId, MunicipioE, MunicipioS
@@ -143,7 +150,7 @@ async def _find(p: BaseModel, db: Session):
         if p.id_tienda:
             query = query.filter(TiendaS.id_tienda == p.id_tienda)
         if p.nombre:
-            query = query.filter(TiendaS.nombre.ilike(f'%{p.nombre}%'))
+            query = query.filter(coincide(db, TiendaS, 'nombre', p.nombre))
         if p.direccion:
             query = query.filter(TiendaS.direccion.ilike(f'%{p.direccion}%'))
         if p.frecuencia_venta:
@@ -160,14 +167,14 @@ async def _find(p: BaseModel, db: Session):
             if r.descripcion:
                 query = query.filter(CadenaS.descripcion.ilike(f'%{r.descripcion}%'))
             if r.siglas:
-                query = query.filter(CadenaS.siglas.ilike(f'%{r.siglas}%'))
+                query = query.filter(coincide(db, CadenaS, 'siglas', r.siglas))
         if p.municipio:
             r = p.municipio
             query = query.join(MunicipioS, MunicipioS.id_municipio == TiendaS.id_municipio)
             if r.id_municipio:
                 query = query.filter(MunicipioS.id_municipio == r.id_municipio)
             if r.nombre:
-                query = query.filter(MunicipioS.nombre.ilike(f'%{r.nombre}%'))
+                query = query.filter(coincide(db, MunicipioS, 'nombre', r.nombre))
             if r.siglas:
                 query = query.filter(MunicipioS.siglas.ilike(f'%{r.siglas}%'))
             if r.ubicacion:
@@ -210,21 +217,24 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[TiendaP])
-async def read_all(skip: int = 0, limit: int = 100, p: TiendaR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: TiendaR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, TiendaS, TiendaP, fields)
+    return await forwards.page(query, TiendaP)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=TiendaP)
-async def read(p: TiendaR, db: Session = Depends(get_db)):
+async def read(p: TiendaR, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, TiendaS.ofertas, TiendaS.bodegas, TiendaS.responsables)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=TiendaP)
-async def create(p: TiendaC, db: Session = Depends(get_db)):
+async def create(p: TiendaC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(TiendaS).filter(TiendaS.nombre == p.nombre)
     query = query.filter(TiendaS.id_municipio == p.municipio.id_municipio)
     query = query.filter(TiendaS.id_cadena == p.cadena.id_cadena)
@@ -235,55 +245,58 @@ async def create(p: TiendaC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=TiendaP)
-async def update(up: TiendaU, db: Session = Depends(get_db)):
+async def update(up: TiendaU, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    exigir_tienda(permisos, up.id_tienda)
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
     return await forwards.update(up, query, ['id_tienda'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=TiendaE)
-async def delete(p: TiendaId, db: Session = Depends(get_db)):
+async def delete(p: TiendaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    exigir_tienda(permisos, p.id_tienda)
     query = db.query(TiendaS).filter(TiendaS.id_tienda == p.id_tienda)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=TiendaP)
-async def activate(up: TiendaId, db: Session = Depends(get_db)):
+async def activate(up: TiendaId, db: Session = Depends(get_db), permisos: Permisos = Depends(principal)):
+    exigir_tienda(permisos, up.id_tienda)
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/municipio", response_model=TiendaMu)
-async def read_municipio(up: TiendaId, db: Session = Depends(get_db)):
+async def read_municipio(up: TiendaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response)
 
 
 # noinspection PyTypeChecker
 @router.post("/cadena", response_model=TiendaCa)
-async def read_cadena(up: TiendaId, db: Session = Depends(get_db)):
+async def read_cadena(up: TiendaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response)
 
 
 # noinspection PyTypeChecker
 @router.post("/bodegas", response_model=TiendaBo)
-async def read_bodegas(up: TiendaId, db: Session = Depends(get_db)):
+async def read_bodegas(up: TiendaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, TiendaS.bodegas)
 
 
 # noinspection PyTypeChecker
 @router.post("/ofertas", response_model=TiendaOf)
-async def read_ofertas(up: TiendaId, db: Session = Depends(get_db)):
+async def read_ofertas(up: TiendaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, TiendaS.ofertas)
 
 
 # noinspection PyTypeChecker
 @router.post("/responsables", response_model=TiendaRe)
-async def read_responsables(up: TiendaId, db: Session = Depends(get_db)):
+async def read_responsables(up: TiendaId, request: Request, response: Response, db: Session = Depends(get_db_lectura)):
     query = db.query(TiendaS).filter(TiendaS.id_tienda == up.id_tienda)
-    return await forwards.read(query)
+    return await forwards.read(query, request, response, TiendaS.responsables)
@@ -3,13 +3,14 @@ from __future__ import annotations
 import datetime
 
 from pydantic import BaseModel
-from database import Base, get_db
+from database import Base, get_db, get_db_lectura
 from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, func
 from sqlalchemy.orm import Session, relationship, Mapped
 from fastapi import Depends, APIRouter
 from typing import List, Optional
 
 from service import forwards
+from service.permisos import Permisos, requiere_rol, vigilar
 
 router = APIRouter()
 
@@ -69,6 +70,10 @@ class UsuarioE(BaseModel):
     desac: bool | None = None
 
 
+class UsuarioEx(UsuarioE):
+    id_rol: int | None = None
+
+
 class UsuarioR(BaseModel):
     id_usuario: int | None = None
     nom_usuario: str | None = None
@@ -152,12 +157,12 @@ class UsuarioS(Base):
     hash_clave = Column(String, nullable=False, index=False)
     num_cel = Column(String, unique=True, nullable=True, index=True)
     ci = Column(String, unique=True, nullable=False, index=True)
-    nombre_completo = Column(String, nullable=True, index=True)
-    dir_postal = Column(String, nullable=True, index=True)
-    usuario_ws = Column(String, nullable=True, index=True)
-    usuario_te = Column(String, nullable=True, index=True)
-    usuario_to = Column(String, nullable=True, index=True)
-    dir_correo = Column(String, nullable=True, index=True)
+    nombre_completo = Column(String, nullable=True, index=False)
+    dir_postal = Column(String, nullable=True, index=False)
+    usuario_ws = Column(String, nullable=True, index=False)
+    usuario_te = Column(String, nullable=True, index=False)
+    usuario_to = Column(String, nullable=True, index=False)
+    dir_correo = Column(String, nullable=True, index=False)
     fecha_creacion = Column(DateTime(timezone=True), nullable=True, server_default=func.now())
     desac = Column(Boolean, nullable=False, index=False, default=True)
     id_rol = Column(Integer, ForeignKey('roles.id_rol', ondelete="CASCADE"), nullable=True, index=True)
@@ -168,6 +173,9 @@ class UsuarioS(Base):
     compras: Mapped[List['CompraS']] = relationship(back_populates="usuario", cascade="all, delete")
 
 
+vigilar(UsuarioS)
+
+
 from .roles import RolS, RolId, RolE
 from .oficodas import OficodaS, OficodaE
 from .consumidores import ConsumidorS, ConsumidorE
@@ -263,21 +271,31 @@ async def _find(p: BaseModel, db: Session):
 
 # noinspection PyTypeChecker
 @router.post("/all", response_model=List[UsuarioP])
-async def read_all(skip: int = 0, limit: int = 100, p: UsuarioR = None, db: Session = Depends(get_db)):
+async def read_all(skip: int = 0, limit: int = 100, fields: str | None = None, p: UsuarioR = None, db: Session = Depends(get_db_lectura)):
+    query = await _find(p, db)
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return await forwards.project(query, UsuarioS, UsuarioP, fields)
+    return await forwards.page(query, UsuarioP)
+
+
+# noinspection PyTypeChecker
+@router.post("/export")
+async def export(formato: str = 'ndjson', p: UsuarioR = None, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
-    return query.offset(skip).limit(limit).all()
+    return await forwards.export(query, UsuarioEx, formato)
 
 
 # noinspection PyTypeChecker
 @router.post("/read", response_model=UsuarioP)
-async def read(p: UsuarioR, db: Session = Depends(get_db)):
+async def read(p: UsuarioR, db: Session = Depends(get_db_lectura)):
     query = await _find(p, db)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/create", response_model=UsuarioP)
-async def create(p: UsuarioC, db: Session = Depends(get_db)):
+async def create(p: UsuarioC, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(UsuarioS).filter(
         (UsuarioS.ci == p.ci) | (UsuarioS.nom_usuario == p.nom_usuario) | (UsuarioS.num_cel == p.num_cel))
 
@@ -290,55 +308,55 @@ async def create(p: UsuarioC, db: Session = Depends(get_db)):
 
 # noinspection PyTypeChecker
 @router.patch("/update", response_model=UsuarioP)
-async def update(up: UsuarioU, db: Session = Depends(get_db)):
+async def update(up: UsuarioU, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == up.id_usuario)
     return await forwards.update(up, query, ['id_usuario'], db)
 
 
 # noinspection PyTypeChecker
 @router.delete("/delete", response_model=UsuarioE)
-async def delete(p: UsuarioId, db: Session = Depends(get_db)):
+async def delete(p: UsuarioId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.delete(query, db)
 
 
 # noinspection PyTypeChecker
 @router.put("/activate", response_model=UsuarioP)
-async def activate(up: UsuarioId, db: Session = Depends(get_db)):
+async def activate(up: UsuarioId, db: Session = Depends(get_db), _: Permisos = Depends(requiere_rol())):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == up.id_usuario)
     return await forwards.activate(query, db)
 
 
 # noinspection PyTypeChecker
 @router.post("/rol", response_model=UsuarioRo)
-async def read_rol(p: UsuarioId, db: Session = Depends(get_db)):
+async def read_rol(p: UsuarioId, db: Session = Depends(get_db_lectura)):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/responsables", response_model=UsuarioRe)
-async def read_responsables(p: UsuarioId, db: Session = Depends(get_db)):
+async def read_responsables(p: UsuarioId, db: Session = Depends(get_db_lectura)):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/consumidores", response_model=UsuarioCo)
-async def read_consumidores(p: UsuarioId, db: Session = Depends(get_db)):
+async def read_consumidores(p: UsuarioId, db: Session = Depends(get_db_lectura)):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/oficodas", response_model=UsuarioOf)
-async def read_oficodas(p: UsuarioId, db: Session = Depends(get_db)):
+async def read_oficodas(p: UsuarioId, db: Session = Depends(get_db_lectura)):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.read(query)
 
 
 # noinspection PyTypeChecker
 @router.post("/compras", response_model=UsuarioCm)
-async def read_compras(p: UsuarioId, db: Session = Depends(get_db)):
+async def read_compras(p: UsuarioId, db: Session = Depends(get_db_lectura)):
     query = db.query(UsuarioS).filter(UsuarioS.id_usuario == p.id_usuario)
     return await forwards.read(query)
@@ -2,7 +2,7 @@ from fastapi import APIRouter
 
 from modules import (autenticar, cadenas, provincias, municipios, tiendas, oficinas, bodegas, estados,
                      consumidores, responsables, oficodas, categorias, nucleos, roles,
-                     productos, subofertas, ofertas, ciclos, usuarios, compras, configuracion)
+                     productos, subofertas, ofertas, ciclos, usuarios, compras, configuracion, reportes)
 
 api_router = APIRouter()
 
@@ -27,3 +27,4 @@ api_router.include_router(responsables.router, prefix="/responsables", tags=["/r
 api_router.include_router(consumidores.router, prefix="/consumidores", tags=["/consumidores"])
 api_router.include_router(compras.router, prefix="/compras", tags=["/compras"])
 api_router.include_router(configuracion.router, prefix="/configuracion", tags=["/configuracion"])
+api_router.include_router(reportes.router, prefix="/reportes", tags=["/reportes"])
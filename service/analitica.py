@@ -0,0 +1,144 @@
+"""
+Analítica fuera de línea para los planificadores de ofertas. Lee compras, núcleos, ofertas y subofertas en columnas
+con COPY a un CSV en memoria, calcula con pandas/numpy sin recorrer filas y escribe los resultados con COPY en
+analitica_pronosticos (demanda esperada del próximo ciclo por bodega y por tienda) y analitica_ciclos (utilización
+de cada ciclo).
+"""
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Ciclos de historia que se leen y peso del último ciclo en el suavizado exponencial
+CICLOS = int(os.getenv('ANALITICA_CICLOS', 12))
+ALFA = float(os.getenv('ANALITICA_ALFA', 0.5))
+
+_ULTIMOS = "SELECT id_ciclo FROM ciclos ORDER BY fecha_inicio DESC LIMIT %s"
+
+_CONSULTAS = {
+    'ofertas': ("SELECT o.id_oferta, o.id_ciclo, o.id_tienda, o.cantidad, ci.fecha_inicio FROM ofertas o "
+                f"JOIN ciclos ci ON ci.id_ciclo = o.id_ciclo WHERE o.id_ciclo IN ({_ULTIMOS})"),
+    'compras': ("SELECT c.id_oferta, c.id_nucleo FROM compras c JOIN ofertas o ON o.id_oferta = c.id_oferta "
+                f"WHERE o.id_ciclo IN ({_ULTIMOS})"),
+    'nucleos': "SELECT id_nucleo, id_bodega, desac FROM nucleos",
+    'subofertas': ("SELECT s.id_oferta, s.cantidad, s.precio FROM subofertas s JOIN ofertas o ON o.id_oferta = s.id_oferta "
+                   f"WHERE o.id_ciclo IN ({_ULTIMOS})"),
+}
+
+_TIPOS = {
+    'ofertas': {'id_oferta': 'int32', 'id_ciclo': 'int32', 'id_tienda': 'int32', 'cantidad': 'int64'},
+    'compras': {'id_oferta': 'int32', 'id_nucleo': 'int32'},
+    'nucleos': {'id_nucleo': 'int32', 'id_bodega': 'int32', 'desac': 'bool'},
+    'subofertas': {'id_oferta': 'int32', 'cantidad': 'int64', 'precio': 'float64'},
+}
+
+_TABLAS = [
+    "CREATE TABLE IF NOT EXISTS analitica_pronosticos (id_tienda INTEGER NOT NULL, id_bodega INTEGER, "
+    "compras DOUBLE PRECISION NOT NULL, unidades DOUBLE PRECISION NOT NULL, tendencia DOUBLE PRECISION NOT NULL, "
+    "calculado TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())",
+    "CREATE TABLE IF NOT EXISTS analitica_ciclos (id_ciclo INTEGER PRIMARY KEY, ofertas INTEGER NOT NULL, "
+    "tiendas INTEGER NOT NULL, cantidad BIGINT NOT NULL, compras BIGINT NOT NULL, unidades DOUBLE PRECISION NOT NULL, "
+    "utilizacion DOUBLE PRECISION, cobertura DOUBLE PRECISION, "
+    "calculado TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())",
+]
+
+
+def _leer(cursor, nombre: str):
+    buffer = io.StringIO()
+    consulta = cursor.mogrify(_CONSULTAS[nombre], (CICLOS,) * _CONSULTAS[nombre].count('%s')).decode()
+    cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=_TIPOS[nombre], true_values=['t'], false_values=['f'])
+
+
+def _escribir(cursor, tabla: str, datos: pd.DataFrame):
+    buffer = io.StringIO()
+    datos.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.execute(f"TRUNCATE {tabla}")
+    cursor.copy_expert(f"COPY {tabla} ({', '.join(datos.columns)}) FROM STDIN WITH CSV", buffer)
+
+
+def _pronostico(serie: pd.DataFrame):
+    """
+    Una columna por ciclo en orden cronológico y una fila por serie, NaN donde no hubo oferta. Devuelve el nivel
+    suavizado más la pendiente de mínimos cuadrados, ambos calculados para todas las series a la vez
+    """
+    nivel = serie.T.ewm(alpha=ALFA, ignore_na=True).mean().iloc[-1].to_numpy()
+    y = serie.to_numpy(dtype='float64')
+    x = np.where(np.isnan(y), np.nan, np.arange(y.shape[1], dtype='float64'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dx = x - np.nanmean(x, axis=1, keepdims=True)
+        dy = y - np.nanmean(y, axis=1, keepdims=True)
+        tendencia = np.nansum(dx * dy, axis=1) / np.nansum(dx * dx, axis=1)
+    tendencia = np.nan_to_num(tendencia)
+    return np.clip(np.nan_to_num(nivel) + tendencia, 0, None), tendencia
+
+
+def calcular(ofertas: pd.DataFrame, compras: pd.DataFrame, nucleos: pd.DataFrame, subofertas: pd.DataFrame):
+    orden = ofertas.drop_duplicates('id_ciclo').sort_values('fecha_inicio')['id_ciclo'].to_numpy()
+    paquete = subofertas.groupby('id_oferta')['cantidad'].sum()
+
+    compras = compras.merge(ofertas[['id_oferta', 'id_ciclo', 'id_tienda']], on='id_oferta')
+    compras = compras.merge(nucleos[['id_nucleo', 'id_bodega']], on='id_nucleo', how='left')
+    compras['unidades'] = compras['id_oferta'].map(paquete).fillna(0)
+
+    # Demanda por bodega y ciclo, los ciclos en que la tienda de la bodega no tuvo oferta quedan en NaN
+    demanda = compras.dropna(subset=['id_bodega']).groupby(['id_tienda', 'id_bodega', 'id_ciclo']).agg(
+        compras=('id_oferta', 'size'), unidades=('unidades', 'sum'))
+    tabla = demanda['compras'].unstack('id_ciclo').reindex(columns=orden)
+    con_oferta = ofertas.groupby(['id_tienda', 'id_ciclo']).size().unstack('id_ciclo').reindex(columns=orden).notna()
+    con_oferta = con_oferta.reindex(tabla.index.get_level_values('id_tienda')).to_numpy()
+    tabla = tabla.where(~con_oferta | tabla.notna(), 0).where(con_oferta)
+
+    totales = demanda.groupby(level=['id_tienda', 'id_bodega']).sum()
+    por_compra = (totales['unidades'] / totales['compras']).reindex(tabla.index).fillna(0).to_numpy()
+    esperadas, tendencia = _pronostico(tabla)
+    bodegas = pd.DataFrame({'compras': esperadas, 'unidades': esperadas * por_compra, 'tendencia': tendencia},
+                           index=tabla.index).reset_index()
+    bodegas['id_bodega'] = bodegas['id_bodega'].astype('Int64')
+    tiendas = bodegas.groupby('id_tienda', as_index=False)[['compras', 'unidades', 'tendencia']].sum()
+    # Mismo tipo en las dos partes, así concat no tiene que adivinarlo de una columna toda nula
+    tiendas['id_bodega'] = pd.array([pd.NA] * len(tiendas), dtype='Int64')
+    pronosticos = pd.concat([bodegas, tiendas], ignore_index=True)
+    pronosticos = pronosticos[['id_tienda', 'id_bodega', 'compras', 'unidades', 'tendencia']]
+
+    # Utilización de cada ciclo: compras sobre cantidad ofertada y núcleos activos que compraron
+    por_oferta = ofertas.set_index('id_oferta')
+    por_oferta['compras'] = compras.groupby('id_oferta').size().reindex(por_oferta.index, fill_value=0)
+    por_oferta['unidades'] = por_oferta['compras'] * paquete.reindex(por_oferta.index, fill_value=0)
+    ciclos = por_oferta.groupby('id_ciclo').agg(ofertas=('id_tienda', 'size'), tiendas=('id_tienda', 'nunique'),
+                                                cantidad=('cantidad', 'sum'), compras=('compras', 'sum'),
+                                                unidades=('unidades', 'sum'))
+    ciclos['utilizacion'] = ciclos['compras'] / ciclos['cantidad'].replace(0, np.nan)
+    # Solo cuentan los núcleos activos que compraron, los desactivados o desconocidos no están en el divisor
+    activos = nucleos.loc[~nucleos['desac'], 'id_nucleo']
+    compraron = compras[compras['id_nucleo'].isin(activos)].groupby('id_ciclo')['id_nucleo'].nunique()
+    ciclos['cobertura'] = compraron.reindex(ciclos.index, fill_value=0) / (len(activos) or np.nan)
+    return pronosticos, ciclos.reset_index()
+
+
+async def analitica():
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    cursor = conn.cursor()
+    inicio = time.perf_counter()
+    try:
+        datos = {nombre: _leer(cursor, nombre) for nombre in _CONSULTAS}
+        print(f"Leídos {', '.join(f'{len(d)} {n}' for n, d in datos.items())} en {time.perf_counter() - inicio:.1f} s")
+        pronosticos, ciclos = calcular(**datos)
+        for sql in _TABLAS:
+            cursor.execute(sql)
+        _escribir(cursor, 'analitica_pronosticos', pronosticos)
+        _escribir(cursor, 'analitica_ciclos', ciclos)
+        conn.commit()
+        print(f"{len(pronosticos)} pronósticos y {len(ciclos)} ciclos escritos en {time.perf_counter() - inicio:.1f} s")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error en la analítica:", e)
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,152 @@
+import os
+from typing import List
+
+from pydantic import BaseModel
+from sqlalchemy import func, distinct
+from sqlalchemy.orm import Session
+
+from service.cache import TTLCache
+
+cache = TTLCache(maxsize=256, ttl=float(os.getenv('ARBOL_TTL', 300)))
+
+
+class TiendaA(BaseModel):
+    id_tienda: int
+    nombre: str
+
+
+class BodegaA(BaseModel):
+    id_bodega: int
+    numero: str
+    tienda: TiendaA | None = None
+    nucleos: int | None = None
+    consumidores: int | None = None
+
+
+class OficinaA(BaseModel):
+    id_oficina: int
+    nombre: str
+    bodegas: List[BodegaA] = []
+    nucleos: int | None = None
+    consumidores: int | None = None
+
+
+class MunicipioA(BaseModel):
+    id_municipio: int
+    nombre: str
+    oficinas: List[OficinaA] = []
+    nucleos: int | None = None
+    consumidores: int | None = None
+
+
+class ProvinciaA(BaseModel):
+    id_provincia: int
+    nombre: str
+    municipios: List[MunicipioA] = []
+    nucleos: int | None = None
+    consumidores: int | None = None
+
+
+# noinspection PyTypeChecker
+def _filas(db: Session, id_provincia: int | None, id_municipio: int | None, conteos: bool):
+    from modules.provincias import ProvinciaS
+    from modules.municipios import MunicipioS
+    from modules.oficinas import OficinaS
+    from modules.bodegas import BodegaS
+    from modules.tiendas import TiendaS
+    from modules.nucleos import NucleoS
+    from modules.consumidores import ConsumidorS
+
+    columnas = [ProvinciaS.id_provincia, ProvinciaS.nombre, MunicipioS.id_municipio, MunicipioS.nombre,
+                OficinaS.id_oficina, OficinaS.nombre, BodegaS.id_bodega, BodegaS.numero,
+                TiendaS.id_tienda, TiendaS.nombre]
+    query = db.query(*columnas).select_from(ProvinciaS)
+    query = query.join(MunicipioS, MunicipioS.id_provincia == ProvinciaS.id_provincia)
+    query = query.outerjoin(OficinaS, OficinaS.id_municipio == MunicipioS.id_municipio)
+    query = query.outerjoin(BodegaS, BodegaS.id_oficina == OficinaS.id_oficina)
+    query = query.outerjoin(TiendaS, TiendaS.id_tienda == BodegaS.id_tienda)
+    if conteos:
+        # Los conteos se agregan por bodega en la misma consulta, limitados al alcance pedido
+        conteo = db.query(NucleoS.id_bodega.label('id_bodega'),
+                          func.count(distinct(NucleoS.id_nucleo)).label('nucleos'),
+                          func.count(ConsumidorS.id_consumidor).label('consumidores'))
+        conteo = conteo.outerjoin(ConsumidorS, ConsumidorS.id_nucleo == NucleoS.id_nucleo)
+        if id_provincia or id_municipio:
+            conteo = conteo.join(BodegaS, BodegaS.id_bodega == NucleoS.id_bodega)
+            conteo = conteo.join(OficinaS, OficinaS.id_oficina == BodegaS.id_oficina)
+            if id_municipio:
+                conteo = conteo.filter(OficinaS.id_municipio == id_municipio)
+            else:
+                conteo = conteo.join(MunicipioS, MunicipioS.id_municipio == OficinaS.id_municipio)
+                conteo = conteo.filter(MunicipioS.id_provincia == id_provincia)
+        conteo = conteo.group_by(NucleoS.id_bodega).subquery()
+        query = query.add_columns(func.coalesce(conteo.c.nucleos, 0), func.coalesce(conteo.c.consumidores, 0))
+        query = query.outerjoin(conteo, conteo.c.id_bodega == BodegaS.id_bodega)
+    if id_provincia:
+        query = query.filter(ProvinciaS.id_provincia == id_provincia)
+    if id_municipio:
+        query = query.filter(MunicipioS.id_municipio == id_municipio)
+    return query.order_by(ProvinciaS.id_provincia, MunicipioS.id_municipio, OficinaS.id_oficina,
+                          BodegaS.id_bodega).all()
+
+
+def _sumar(nodo, hijos):
+    nodo.nucleos = sum(h.nucleos for h in hijos)
+    nodo.consumidores = sum(h.consumidores for h in hijos)
+
+
+def _construir(filas, conteos: bool):
+    provincias, municipios, oficinas = {}, {}, {}
+    for fila in filas:
+        id_prov, nom_prov, id_mun, nom_mun, id_ofi, nom_ofi, id_bod, num_bod, id_tie, nom_tie = fila[:10]
+        provincia = provincias.get(id_prov)
+        if provincia is None:
+            provincia = provincias[id_prov] = ProvinciaA(id_provincia=id_prov, nombre=nom_prov)
+        municipio = municipios.get(id_mun)
+        if municipio is None:
+            municipio = municipios[id_mun] = MunicipioA(id_municipio=id_mun, nombre=nom_mun)
+            provincia.municipios.append(municipio)
+        if id_ofi is None:
+            continue
+        oficina = oficinas.get(id_ofi)
+        if oficina is None:
+            oficina = oficinas[id_ofi] = OficinaA(id_oficina=id_ofi, nombre=nom_ofi)
+            municipio.oficinas.append(oficina)
+        if id_bod is None:
+            continue
+        tienda = TiendaA(id_tienda=id_tie, nombre=nom_tie) if id_tie is not None else None
+        bodega = BodegaA(id_bodega=id_bod, numero=num_bod, tienda=tienda)
+        if conteos:
+            bodega.nucleos, bodega.consumidores = fila[10], fila[11]
+        oficina.bodegas.append(bodega)
+    if conteos:
+        for oficina in oficinas.values():
+            _sumar(oficina, oficina.bodegas)
+        for municipio in municipios.values():
+            _sumar(municipio, municipio.oficinas)
+        for provincia in provincias.values():
+            _sumar(provincia, provincia.municipios)
+    return list(provincias.values())
+
+
+async def provincias(db: Session, id_provincia: int | None = None, conteos: bool = False):
+    """
+    Árbol provincia → municipio → oficina → bodega → tienda en una sola consulta, con conteos opcionales
+    de núcleos y consumidores por nodo
+    """
+    key = ('provincia', id_provincia, conteos)
+    arbol = cache.get(key)
+    if arbol is None:
+        arbol = _construir(_filas(db, id_provincia, None, conteos), conteos)
+        cache.set(key, arbol)
+    return arbol
+
+
+async def municipio(db: Session, id_municipio: int, conteos: bool = False):
+    key = ('municipio', id_municipio, conteos)
+    arbol = cache.get(key)
+    if arbol is None:
+        provincias_ = _construir(_filas(db, None, id_municipio, conteos), conteos)
+        arbol = provincias_[0].municipios[0] if provincias_ else None
+        cache.set(key, arbol)
+    return arbol
@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Caché en memoria del proceso, acotada por cantidad de entradas (LRU) y con expiración por entrada
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._datos.get(key)
+            if item is None:
+                return default
+            expira, valor = item
+            if expira < time.monotonic():
+                del self._datos[key]
+                return default
+            self._datos.move_to_end(key)
+            return valor
+
+    def set(self, key, valor, ttl: float | None = None):
+        expira = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._datos[key] = (expira, valor)
+            self._datos.move_to_end(key)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._datos.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
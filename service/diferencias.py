@@ -0,0 +1,161 @@
+"""
+Diferencias entre las fotos de xutil y la base de datos. La foto nueva y el estado actual se cargan en diccionarios
+por llave (bodega por id, núcleo por bodega y número, consumidor por ci del usuario), se comparan en una pasada y el
+resultado se aplica con pocas sentencias por conjunto: altas, cambios y bajas (desac), nunca borrados.
+"""
+import json
+from collections import Counter
+
+from psycopg2.extras import execute_values
+
+# Ejemplos por tipo de cambio que muestra el informe
+MUESTRA = 5
+
+
+class Diferencias:
+    def __init__(self):
+        self.bodegas_alta = []
+        self.bodegas_cambio = []
+        self.bodegas_baja = []
+        self.nucleos_alta = []
+        self.nucleos_baja = []
+        self.jefes = []
+        self.usuarios_alta = []
+        self.consumidores_alta = []
+        self.consumidores_baja = []
+
+    def informe(self) -> str:
+        lineas = []
+        for nombre, filas in vars(self).items():
+            if filas:
+                lineas.append(f"{nombre}: {len(filas)}  ej. {', '.join(map(str, filas[:MUESTRA]))}")
+        return '\n'.join(lineas) or "Sin diferencias"
+
+
+def _bodegas(cursor, foto: list, dif: Diferencias):
+    cursor.execute("SELECT id_bodega, numero, id_oficina, desac FROM bodegas")
+    actuales = {id_: (numero, oficina, desac) for id_, numero, oficina, desac in cursor.fetchall()}
+    nuevas = {res['id']: (str(res['numero']), res['oficina_id'], False) for res in foto}
+    for id_, valor in nuevas.items():
+        if id_ not in actuales:
+            dif.bodegas_alta.append((id_, *valor[:2]))
+        elif actuales[id_] != valor:
+            dif.bodegas_cambio.append((id_, *valor[:2]))
+    # Una foto vacía es una descarga fallida, no el cierre de todas las bodegas
+    if nuevas:
+        dif.bodegas_baja = [id_ for id_, (_, _, desac) in actuales.items() if id_ not in nuevas and not desac]
+
+
+def _nucleos(cursor, foto: list, bodegas, dif: Diferencias):
+    nucleos = {}
+    miembros = {}
+    for res in foto:
+        llave = (res['bodega_id'], str(res['numero_nucleo']))
+        jefe = None
+        for usuario in json.loads(res['cons_lista'] or '[]'):
+            miembros[usuario['identidad_numero']] = llave
+            if usuario['jefe_nucleo']:
+                jefe = usuario['identidad_numero']
+        nucleos[llave] = jefe
+
+    alcance = "TRUE" if bodegas is None else "n.id_bodega = ANY(%(bodegas)s)"
+    params = {'bodegas': list(bodegas or []), 'cis': list(miembros)}
+    cursor.execute(
+        "SELECT n.id_bodega, n.numero, n.id_nucleo, n.desac, u.ci FROM nucleos n "
+        "LEFT JOIN consumidores c ON c.id_consumidor = n.id_consumidor_jefe "
+        f"LEFT JOIN usuarios u ON u.id_usuario = c.id_usuario WHERE {alcance}", params)
+    actuales = {(b, numero): (id_, desac, jefe) for b, numero, id_, desac, jefe in cursor.fetchall()}
+    # Consumidores activos del alcance y, fuera de él, los de la foto que pudieron mudarse de núcleo
+    cursor.execute(
+        "SELECT u.ci, n.id_bodega, n.numero FROM consumidores c JOIN usuarios u ON u.id_usuario = c.id_usuario "
+        f"JOIN nucleos n ON n.id_nucleo = c.id_nucleo WHERE NOT c.desac AND ({alcance} OR u.ci = ANY(%(cis)s))",
+        params)
+    activos = {}
+    for ci, b, numero in cursor.fetchall():
+        activos.setdefault(ci, set()).add((b, numero))
+    cursor.execute("SELECT ci FROM usuarios WHERE ci = ANY(%(cis)s)", params)
+    existentes = {ci for ci, in cursor.fetchall()}
+
+    cantidades = Counter(miembros.values())
+    for llave, jefe in nucleos.items():
+        actual = actuales.get(llave)
+        # Los nuevos y los que estaban desactivados, el contador lo corrige sync_contadores
+        if actual is None or actual[1]:
+            dif.nucleos_alta.append((*llave, cantidades[llave]))
+        if jefe and (actual is None or actual[2] != jefe):
+            dif.jefes.append((*llave, jefe))
+    if nucleos or bodegas is not None:
+        dif.nucleos_baja = [id_ for llave, (id_, desac, _) in actuales.items() if llave not in nucleos and not desac]
+
+    for ci, llave in miembros.items():
+        if ci not in existentes:
+            dif.usuarios_alta.append(ci)
+        if llave not in activos.get(ci, ()):
+            dif.consumidores_alta.append((ci, *llave))
+    for ci, llaves in activos.items():
+        dif.consumidores_baja.extend((ci, *llave) for llave in llaves if miembros.get(ci) != llave)
+
+
+def comparar(cursor, foto_bodegas: list, foto_nucleos: list, bodegas=None) -> Diferencias:
+    """
+    Cambios para llevar la base de datos a las fotos. Con bodegas solo se comparan los núcleos de esas bodegas
+    (las que xutil marcó como cambiadas), sin ellas todos
+    """
+    dif = Diferencias()
+    _bodegas(cursor, foto_bodegas, dif)
+    if bodegas is not None:
+        foto_nucleos = [res for res in foto_nucleos if res['bodega_id'] in bodegas]
+    _nucleos(cursor, foto_nucleos, bodegas, dif)
+    return dif
+
+
+def aplicar(cursor, dif: Diferencias):
+    """
+    Ejecuta las diferencias dentro de la transacción del cursor, el que llama confirma
+    """
+    if dif.bodegas_alta:
+        execute_values(cursor, "INSERT INTO bodegas (id_bodega, numero, id_oficina, direccion, grupos_rs, es_especial, desac) "
+                               "SELECT v.id_bodega, v.numero, v.id_oficina, '', '', false, false "
+                               "FROM (VALUES %s) AS v (id_bodega, numero, id_oficina) "
+                               "JOIN oficinas o ON o.id_oficina = v.id_oficina ON CONFLICT (id_bodega) DO NOTHING",
+                       dif.bodegas_alta)
+    if dif.bodegas_cambio:
+        execute_values(cursor, "UPDATE bodegas SET numero = v.numero, id_oficina = v.id_oficina, desac = false "
+                               "FROM (VALUES %s) AS v (id_bodega, numero, id_oficina) "
+                               "WHERE bodegas.id_bodega = v.id_bodega", dif.bodegas_cambio)
+    if dif.bodegas_baja:
+        cursor.execute("UPDATE bodegas SET desac = true WHERE id_bodega = ANY(%s)", (dif.bodegas_baja,))
+
+    if dif.nucleos_alta:
+        execute_values(cursor, "INSERT INTO nucleos (id_bodega, numero, cant_miembros, cant_modulos, desac) "
+                               "SELECT v.id_bodega, v.numero, v.cant, 0, false "
+                               "FROM (VALUES %s) AS v (id_bodega, numero, cant) "
+                               "JOIN bodegas b ON b.id_bodega = v.id_bodega "
+                               "ON CONFLICT (numero, id_bodega) DO UPDATE SET desac = false, version = nucleos.version + 1",
+                       dif.nucleos_alta)
+    if dif.nucleos_baja:
+        cursor.execute("UPDATE nucleos SET desac = true, version = version + 1 WHERE id_nucleo = ANY(%s)",
+                       (dif.nucleos_baja,))
+
+    if dif.usuarios_alta:
+        # La cédula queda de clave hasta que --actualizarhash la reemplace por su hash
+        execute_values(cursor, "INSERT INTO usuarios (hash_clave, ci, desac) VALUES %s ON CONFLICT (ci) DO NOTHING",
+                       [(ci, ci, True) for ci in dif.usuarios_alta])
+    if dif.consumidores_baja:
+        execute_values(cursor, "UPDATE consumidores SET desac = true FROM (VALUES %s) AS v (ci, id_bodega, numero), "
+                               "usuarios u, nucleos n WHERE u.ci = v.ci AND n.id_bodega = v.id_bodega "
+                               "AND n.numero = v.numero AND consumidores.id_usuario = u.id_usuario "
+                               "AND consumidores.id_nucleo = n.id_nucleo", dif.consumidores_baja)
+    if dif.consumidores_alta:
+        execute_values(cursor, "INSERT INTO consumidores (id_usuario, id_nucleo, verificado, desac) "
+                               "SELECT u.id_usuario, n.id_nucleo, true, false "
+                               "FROM (VALUES %s) AS v (ci, id_bodega, numero) JOIN usuarios u ON u.ci = v.ci "
+                               "JOIN nucleos n ON n.id_bodega = v.id_bodega AND n.numero = v.numero "
+                               "ON CONFLICT (id_usuario, id_nucleo) DO UPDATE SET desac = false",
+                       dif.consumidores_alta)
+    if dif.jefes:
+        execute_values(cursor, "UPDATE nucleos SET id_consumidor_jefe = c.id_consumidor, version = nucleos.version + 1 "
+                               "FROM (VALUES %s) AS v (id_bodega, numero, ci) JOIN usuarios u ON u.ci = v.ci "
+                               "JOIN consumidores c ON c.id_usuario = u.id_usuario "
+                               "WHERE nucleos.id_bodega = v.id_bodega AND nucleos.numero = v.numero "
+                               "AND c.id_nucleo = nucleos.id_nucleo", dif.jefes)
@@ -1,6 +1,15 @@
-from fastapi import HTTPException, Query
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
+import csv
+import hashlib
+import io
+from functools import lru_cache
+
+from typing import List
+
+from fastapi import HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import Session, load_only, selectinload
 
 
 async def _ascertain(up: BaseModel, keys: set[str]):
@@ -45,14 +54,174 @@ async def _commit(update_query, db: Session, ret: bool = True):
         raise HTTPException(status_code=500, detail="Error in DataServer")
 
 
-async def read(query: Query):
+@lru_cache(maxsize=256)
+def _adapter(schema: type[BaseModel]):
+    return TypeAdapter(List[schema])
+
+
+async def _serialize(rows, schema: type[BaseModel]):
+    """
+    Valida las filas del ORM contra schema una sola vez y las serializa directo a bytes JSON,
+    sin pasar por jsonable_encoder
+    """
+    adapter = _adapter(schema)
+    return Response(content=adapter.dump_json(adapter.validate_python(rows, from_attributes=True)),
+                    media_type="application/json")
+
+
+async def _fields(fields: str, entity, schema: type[BaseModel]):
+    keys = [k.strip() for k in fields.split(',') if k.strip()]
+    unknown = set(keys) - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Fields {', '.join(sorted(unknown))} is not Exists")
+    mapper = inspect(entity)
+    primary = [mapper.get_property_by_column(c).key for c in mapper.primary_key]
+    return tuple(dict.fromkeys([k for k in primary if k in schema.model_fields] + keys))
+
+
+@lru_cache(maxsize=256)
+def _schema(schema: type[BaseModel], keys: tuple[str, ...]):
+    """
+    Construye (una sola vez por combinación) el modelo de respuesta con solo los campos pedidos
+    """
+    campos = {k: (schema.model_fields[k].annotation, schema.model_fields[k]) for k in keys}
+    return create_model(f"{schema.__name__}F", __config__=ConfigDict(from_attributes=True), **campos)
+
+
+async def project(query: Query, entity, schema: type[BaseModel], fields: str):
+    """
+    Carga solo las columnas y relaciones pedidas en fields (separadas por coma) y responde con ese subconjunto
+    del modelo schema
+    """
+    keys = await _fields(fields, entity, schema)
+    mapper = inspect(entity)
+    columns = [getattr(entity, k) for k in keys if k in mapper.column_attrs]
+    relations = [selectinload(getattr(entity, k)) for k in keys if k in mapper.relationships]
+    model = _schema(schema, keys)
+    try:
+        rows = query.options(load_only(*columns), *relations).all()
+    except (Exception,):
+        raise HTTPException(status_code=500, detail="Error in Query")
+    return await _serialize(rows, model)
+
+
+async def page(query: Query, schema: type[BaseModel]):
+    try:
+        rows = query.all()
+    except (Exception,):
+        raise HTTPException(status_code=500, detail="Error in Query")
+    return await _serialize(rows, schema)
+
+
+def _lines(adapter: TypeAdapter, lote: list):
+    return "".join(f"{r.model_dump_json()}\n" for r in adapter.validate_python(lote, from_attributes=True)).encode()
+
+
+def _ndjson(rows, schema: type[BaseModel], chunk: int):
+    adapter = _adapter(schema)
+    lote = []
+    for row in rows:
+        lote.append(row)
+        if len(lote) == chunk:
+            yield _lines(adapter, lote)
+            lote = []
+    if lote:
+        yield _lines(adapter, lote)
+
+
+def _csv(rows, schema: type[BaseModel], chunk: int):
+    adapter = _adapter(schema)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(schema.model_fields))
+    writer.writeheader()
+    lote = []
+    for row in rows:
+        lote.append(row)
+        if len(lote) == chunk:
+            writer.writerows(adapter.dump_python(adapter.validate_python(lote, from_attributes=True), mode="json"))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            lote = []
+    if lote:
+        writer.writerows(adapter.dump_python(adapter.validate_python(lote, from_attributes=True), mode="json"))
+    yield buffer.getvalue()
+
+
+async def export(query: Query, schema: type[BaseModel], formato: str = 'ndjson', chunk: int = 1000):
+    """
+    Exporta todas las filas de la consulta con un cursor del lado del servidor (yield_per), en ndjson o csv,
+    sin cargar la tabla completa en memoria
+    """
+    if formato not in ('ndjson', 'csv'):
+        raise HTTPException(status_code=400, detail=f"Format {formato} is not Exists")
+    table = query.column_descriptions[0]['entity'].__tablename__
+    rows = query.yield_per(chunk)
+    if formato == 'csv':
+        return StreamingResponse(_csv(rows, schema, chunk), media_type="text/csv",
+                                 headers={"Content-Disposition": f"attachment; filename={table}.csv"})
+    return StreamingResponse(_ndjson(rows, schema, chunk), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f"attachment; filename={table}.ndjson"})
+
+
+def _version(query: Query):
+    """
+    Columna version_id_col de la entidad de la consulta, None si la tabla no lleva versión
+    """
+    return inspect(query.column_descriptions[0]['entity']).version_id_col
+
+
+def _bump(query: Query, values: dict):
+    version = _version(query)
+    if version is not None:
+        values[version.key] = version + 1
+    return values
+
+
+async def _etag(query: Query, relations):
+    """
+    ETag a partir de la versión de la fila y, por cada relación pedida, de la cantidad, la suma de versiones y el
+    mayor id de las filas relacionadas, sin cargar el objeto ni sus relaciones. Todas las relaciones llevan versión
+    """
+    mapper = inspect(query.column_descriptions[0]['entity'])
+    locals_ = [pair[0] for r in relations for pair in r.property.local_remote_pairs]
+    try:
+        row = query.with_entities(*mapper.primary_key, mapper.version_id_col, *locals_).first()
+        if not row:
+            return None
+        parts = list(row[:len(mapper.primary_key) + 1])
+        values = dict(zip(locals_, row[len(mapper.primary_key) + 1:]))
+        for r in relations:
+            target = r.property.mapper
+            filters = [remote == values[local] for local, remote in r.property.local_remote_pairs]
+            versions = func.coalesce(func.sum(target.version_id_col), 0)
+            parts.extend(query.session.query(func.count(), versions, func.max(target.primary_key[0]))
+                         .filter(*filters).one())
+    except (Exception,):
+        raise HTTPException(status_code=500, detail="Error in Query")
+    return f'W/"{hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()}"'
+
+
+async def read(query: Query, request: Request = None, response: Response = None, *relations):
+    """
+    Con request y response responde 304 si el If-None-Match del cliente coincide con el ETag de la fila, las
+    relaciones que devuelve el endpoint se pasan para que sus cambios también cambien el ETag. Si alguna relación no
+    tiene versión un cambio en sus filas no movería el ETag, esas lecturas se sirven siempre completas
+    """
+    if request is not None and _version(query) is not None and \
+            all(r.property.mapper.version_id_col is not None for r in relations):
+        etag = await _etag(query, relations)
+        if etag:
+            if etag in request.headers.get('if-none-match', ''):
+                return Response(status_code=304, headers={'ETag': etag})
+            response.headers['ETag'] = etag
     return await _query_first(query, False)
 
 
 async def update(up: BaseModel, query: Query, keys: [str], db: Session):
     await _ascertain(up, keys)
     update_query = await _query_first(query, False)
-    query_aux = await _composer(up, keys)
+    query_aux = _bump(query, await _composer(up, keys))
     try:
         query.update(query_aux)
     except (Exception,):
@@ -87,7 +256,7 @@ async def delete(query: Query, db: Session):
 async def activate(query: Query, db: Session):
     act_query = await _query_first(query, False)
     try:
-        query.update({'desac': not act_query.desac})
+        query.update(_bump(query, {'desac': not act_query.desac}))
     except (Exception,):
         raise HTTPException(status_code=400, detail="Is not Exists")
     await _commit(act_query, db)
@@ -97,7 +266,7 @@ async def activate(query: Query, db: Session):
 async def changeTrue(query: Query, db: Session, attr:str):
     act_query = await _query_first(query, False)
     try:
-        query.update({f'{attr}': True})
+        query.update(_bump(query, {f'{attr}': True}))
     except (Exception,):
         raise HTTPException(status_code=400, detail="Is not Exists")
     await _commit(act_query, db)
@@ -0,0 +1,78 @@
+import re
+from collections import Counter
+
+_PREDICADO = re.compile(r'\b(\w+)\.(\w+)\s*(?:=|>=|<=|<|>|IN\b|BETWEEN\b)', re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|\bOFFSET\b|\bFOR UPDATE\b|$)',
+                    re.IGNORECASE | re.DOTALL)
+
+
+def _formas(sql: str):
+    """
+    Columnas filtradas por igualdad o rango en el WHERE, agrupadas por tabla (los ILIKE '%x%' no usan btree)
+    """
+    formas = {}
+    for where in _WHERE.findall(sql):
+        for tabla, columna in _PREDICADO.findall(where):
+            formas.setdefault(tabla, set()).add(columna)
+    return {tabla: tuple(sorted(columnas)) for tabla, columnas in formas.items()}
+
+
+def _consultas(cursor):
+    from service.lentas import leer
+    consultas = Counter()
+    for registro in leer():
+        consultas[registro['sql']] += 1
+    try:
+        cursor.execute("SELECT query, calls FROM pg_stat_statements ORDER BY total_exec_time DESC LIMIT 500")
+        for sql, calls in cursor.fetchall():
+            consultas[sql] += calls
+    except Exception:
+        cursor.connection.rollback()
+    return consultas
+
+
+async def asesor(top: int = 20):
+    """
+    Índices sin uso según pg_stat_user_indexes, tablas leídas con seq scan y combinaciones de columnas filtradas
+    (log de consultas lentas y pg_stat_statements si está instalado) que ningún índice cubre
+    """
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT s.relname, s.indexrelname, pg_size_pretty(pg_relation_size(s.indexrelid)) "
+            "FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid "
+            "WHERE NOT i.indisunique AND NOT i.indisprimary AND s.idx_scan = 0 "
+            "ORDER BY pg_relation_size(s.indexrelid) DESC")
+        print("Índices sin uso desde el último reinicio de estadísticas:")
+        for tabla, indice, size in cursor.fetchall():
+            print(f"   DROP INDEX CONCURRENTLY {indice};  -- {tabla}, {size}")
+
+        cursor.execute(
+            "SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup FROM pg_stat_user_tables "
+            "WHERE seq_scan > 0 AND n_live_tup > 1000 ORDER BY seq_tup_read DESC LIMIT %s", (top,))
+        print("Tablas más leídas con seq scan:")
+        for tabla, seq, leidas, idx, vivas in cursor.fetchall():
+            print(f"   {tabla}: {seq} seq scans ({leidas} filas leídas), {idx} index scans, {vivas} filas")
+
+        cursor.execute("SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = 'public'")
+        existentes = {}
+        for tabla, definicion in cursor.fetchall():
+            columnas = re.search(r'\((.*)\)', definicion).group(1)
+            existentes.setdefault(tabla, []).append([c.strip().strip('"') for c in columnas.split(',')])
+
+        formas = Counter()
+        for sql, veces in _consultas(cursor).items():
+            for tabla, columnas in _formas(sql).items():
+                formas[(tabla, columnas)] += veces
+        print("Combinaciones filtradas sin índice que las cubra:")
+        for (tabla, columnas), veces in formas.most_common():
+            if any(set(indice[:len(columnas)]) == set(columnas) for indice in existentes.get(tabla, [])):
+                continue
+            nombre = f"ix_{tabla}_{'_'.join(columnas)}"[:63]
+            print(f"   CREATE INDEX CONCURRENTLY {nombre} ON {tabla} ({', '.join(columnas)});  -- {veces} veces")
+    finally:
+        cursor.close()
+        conn.close()
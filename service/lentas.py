@@ -0,0 +1,120 @@
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+
+from service.metricas import peticion
+
+UMBRAL_MS = float(os.getenv('LENTAS_MS', 200))
+ARCHIVO = os.getenv('LENTAS_LOG', 'logs/lentas.log')
+
+_cola = queue.Queue(maxsize=100)
+_logger = logging.getLogger('tetoca.lentas')
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    context._lentas_inicio = time.perf_counter()
+
+
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    ms = (time.perf_counter() - context._lentas_inicio) * 1000
+    if ms < UMBRAL_MS or executemany or conn.info.get('lentas'):
+        return
+    estado = peticion.get() or {}
+    registro = {'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'), 'ms': round(ms, 2), 'sql': statement,
+                'servidor': conn.engine.url.host,
+                'parametros': repr(parameters)[:2000], 'ruta': estado.get('ruta'), 'metodo': estado.get('metodo')}
+    try:
+        _cola.put_nowait((conn.engine, registro, statement, parameters))
+    except queue.Full:
+        pass
+
+
+# SELECT que al ejecutarse toman bloqueos o cambian algo, para ellos el plan es sin ANALYZE
+_EFECTOS = re.compile(r'\bFOR\s+(NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(KEY\s+)?SHARE\b|\bINTO\b|'
+                      r'\b(nextval|setval|pg_(try_)?advisory\w*|lo_\w+|dblink\w*)\s*\(', re.IGNORECASE)
+
+
+def _explicar(engine, statement, parameters):
+    # ANALYZE ejecuta la sentencia, solo se usa con SELECT sin efectos y siempre dentro de una transacción que se
+    # revierte
+    analizar = statement.lstrip().upper().startswith('SELECT') and not _EFECTOS.search(statement)
+    opciones = '(ANALYZE, BUFFERS)' if analizar else ''
+    with engine.connect() as conn:
+        conn.info['lentas'] = True
+        try:
+            filas = conn.exec_driver_sql(f"EXPLAIN {opciones} {statement}", parameters).fetchall()
+            return '\n'.join(f[0] for f in filas)
+        finally:
+            conn.rollback()
+            conn.info.pop('lentas', None)
+
+
+def _trabajador():
+    while True:
+        engine, registro, statement, parameters = _cola.get()
+        try:
+            registro['plan'] = _explicar(engine, statement, parameters)
+        except Exception as e:
+            registro['plan'] = f"Error en EXPLAIN: {e}"
+        _logger.info(json.dumps(registro, ensure_ascii=False))
+
+
+def registrar(*engines):
+    """
+    Guarda las sentencias que tardan más de LENTAS_MS en un log rotativo junto a sus parámetros, la ruta que
+    las originó y su plan, el EXPLAIN se hace en un hilo aparte y en el mismo engine para no demorar la petición
+    """
+    os.makedirs(os.path.dirname(ARCHIVO) or '.', exist_ok=True)
+    handler = RotatingFileHandler(ARCHIVO, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _antes)
+        event.listen(engine, 'after_cursor_execute', _despues)
+    threading.Thread(target=_trabajador, name='lentas', daemon=True).start()
+
+
+def leer(archivo: str = ARCHIVO):
+    for ruta in sorted(glob.glob(f"{archivo}*")):
+        with open(ruta, encoding='utf-8') as file:
+            for linea in file:
+                try:
+                    yield json.loads(linea)
+                except ValueError:
+                    continue
+
+
+async def resumen(top: int = 10):
+    """
+    Agrupa el log de sentencias lentas por forma de la consulta y muestra las peores
+    """
+    grupos = {}
+    for registro in leer():
+        forma = re.sub(r'\s+', ' ', registro['sql']).strip()
+        grupo = grupos.setdefault(forma, {'veces': 0, 'total': 0.0, 'peor': None, 'rutas': set()})
+        grupo['veces'] += 1
+        grupo['total'] += registro['ms']
+        grupo['rutas'].add(registro.get('ruta') or '-')
+        if grupo['peor'] is None or registro['ms'] > grupo['peor']['ms']:
+            grupo['peor'] = registro
+    if not grupos:
+        print(f"No hay sentencias lentas registradas en {ARCHIVO}")
+        return
+    for forma, grupo in sorted(grupos.items(), key=lambda g: g[1]['total'], reverse=True)[:top]:
+        peor = grupo['peor']
+        print(f"{grupo['total']:10.1f} ms total  {grupo['veces']:5d} veces  "
+              f"{grupo['total'] / grupo['veces']:8.1f} ms media  {peor['ms']:8.1f} ms peor")
+        print(f"   Rutas: {', '.join(sorted(grupo['rutas']))}")
+        print(f"   SQL: {forma[:500]}")
+        print('   ' + (peor.get('plan') or '').replace('\n', '\n   '))
+        print()
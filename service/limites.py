@@ -0,0 +1,121 @@
+"""
+Límite de intentos por ventana deslizante para los endpoints de acceso (/token, /registro, /recuperar, /compaginar).
+Cada intento cuenta por IP y por cuenta (ci o móvil) antes de tocar la base de datos o bcrypt. Sin LIMITES_REDIS las
+ventanas viven en el proceso, con él se comparten entre todos los workers en un sorted set por llave.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException, Request, status
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def _limite(nombre: str, defecto: str):
+    """
+    'intentos/segundos' de la variable de entorno
+    """
+    intentos, segundos = os.getenv(nombre, defecto).split('/')
+    return int(intentos), float(segundos)
+
+
+POR_IP = _limite('LIMITE_IP', '30/60')
+POR_CUENTA = _limite('LIMITE_CUENTA', '10/300')
+REDIS_URL = os.getenv('LIMITES_REDIS')
+# Llaves distintas que se recuerdan en el proceso, las más viejas se descartan
+MAX_LLAVES = int(os.getenv('LIMITES_LLAVES', 100000))
+
+
+class Ventanas:
+    """
+    Marcas de tiempo de los intentos recientes por llave, en memoria del proceso
+    """
+
+    def __init__(self, maxsize: int = MAX_LLAVES):
+        self.maxsize = maxsize
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def intentar(self, llave: str, intentos: int, segundos: float) -> float:
+        """
+        Anota el intento si cabe en la ventana y devuelve 0, si no los segundos que faltan para el próximo
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            marcas = self._datos.get(llave)
+            if marcas is None:
+                marcas = self._datos[llave] = deque()
+                while len(self._datos) > self.maxsize:
+                    self._datos.popitem(last=False)
+            self._datos.move_to_end(llave)
+            while marcas and marcas[0] <= ahora - segundos:
+                marcas.popleft()
+            if len(marcas) >= intentos:
+                return marcas[0] + segundos - ahora
+            marcas.append(ahora)
+            return 0
+
+
+class VentanasRedis:
+    """
+    Las mismas ventanas en un sorted set por llave, compartidas entre procesos. Limpiar, contar y anotar van en un
+    script de Lua para que dos workers no cuenten a la vez el mismo hueco de la ventana
+    """
+
+    _SCRIPT = """
+    local ahora, segundos = tonumber(ARGV[1]), tonumber(ARGV[2])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, ahora - segundos)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+        local primero = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+        return tostring(tonumber(primero[2]) + segundos - ahora)
+    end
+    redis.call('ZADD', KEYS[1], ahora, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.floor(segundos) + 1)
+    return '0'
+    """
+
+    def __init__(self, url: str):
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._intentar = self._cliente.register_script(self._SCRIPT)
+
+    def intentar(self, llave: str, intentos: int, segundos: float) -> float:
+        # Lua devuelve los números como enteros, la espera viaja como texto
+        espera = self._intentar(keys=[f'limites:{llave}'], args=[time.time(), segundos, intentos, uuid.uuid4().hex])
+        return max(float(espera), 0)
+
+
+if REDIS_URL and redis is None:
+    # Con varios workers cada uno contaría solo sus intentos y el límite real se multiplicaría
+    raise RuntimeError("LIMITES_REDIS está definido pero el paquete redis no está instalado (pip install redis)")
+
+_local = Ventanas()
+_compartidas = VentanasRedis(REDIS_URL) if REDIS_URL else None
+
+
+def _intentar(llave: str, intentos: int, segundos: float) -> float:
+    if _compartidas is not None:
+        try:
+            return _compartidas.intentar(llave, intentos, segundos)
+        except redis.RedisError:
+            # Redis caído no deja la api sin acceso, se limita por proceso
+            pass
+    return _local.intentar(llave, intentos, segundos)
+
+
+def revisar(request: Request, *cuentas: str | None):
+    """
+    Cuenta el intento para la IP del cliente y para cada cuenta dada, 429 con Retry-After si alguna se pasó
+    """
+    ruta = request.url.path
+    llaves = [(f'{ruta}:ip:{request.client.host if request.client else "-"}', *POR_IP)]
+    llaves += [(f'{ruta}:cuenta:{cuenta}', *POR_CUENTA) for cuenta in dict.fromkeys(cuentas) if cuenta]
+    espera = max(_intentar(*llave) for llave in llaves)
+    if espera:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Demasiados intentos",
+                            headers={'Retry-After': str(int(espera) + 1)})
@@ -0,0 +1,148 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# Estado de la petición en curso, un dict mutable para que las sentencias ejecutadas en el threadpool
+# (StreamingResponse, dependencias síncronas) también se sumen a la misma petición
+peticion = contextvars.ContextVar('peticion', default=None)
+
+MAX_SQL = int(os.getenv('METRICAS_MAX_SQL', 20))
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SQL = (1, 2, 5, 10, 20, 50, 100, 250)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class _Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def exportar(self, nombre: str, etiquetas: str):
+        acumulado = 0
+        for limite, cuenta in zip(self.buckets, self.cuentas):
+            acumulado += cuenta
+            yield f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}'
+        yield f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {self.total}'
+        yield f'{nombre}_sum{{{etiquetas}}} {self.suma}'
+        yield f'{nombre}_count{{{etiquetas}}} {self.total}'
+
+
+class Registro:
+    """
+    Métricas por ruta del proceso actual: latencia, sentencias SQL, tiempo en base de datos y tamaño de respuesta
+    """
+
+    HISTOGRAMAS = (('tetoca_peticion_segundos', 'Latencia de la petición', BUCKETS_SEGUNDOS),
+                   ('tetoca_peticion_sql', 'Sentencias SQL por petición', BUCKETS_SQL),
+                   ('tetoca_peticion_bd_segundos', 'Tiempo en base de datos por petición', BUCKETS_SEGUNDOS),
+                   ('tetoca_respuesta_bytes', 'Tamaño de la respuesta', BUCKETS_BYTES))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas = {}
+        self._estados = {}
+        self._excedidas = {}
+
+    def observar(self, metodo: str, ruta: str, estado: int, segundos: float, sql: int, bd: float, size: int):
+        key = (metodo, ruta)
+        with self._lock:
+            histogramas = self._rutas.get(key)
+            if histogramas is None:
+                histogramas = self._rutas[key] = [_Histograma(b) for _, _, b in self.HISTOGRAMAS]
+            for histograma, valor in zip(histogramas, (segundos, sql, bd, size)):
+                histograma.observar(valor)
+            self._estados[key + (estado,)] = self._estados.get(key + (estado,), 0) + 1
+            if sql > MAX_SQL:
+                self._excedidas[key] = self._excedidas.get(key, 0) + 1
+
+    def exportar(self):
+        lineas = []
+        with self._lock:
+            lineas.append('# HELP tetoca_peticiones_total Peticiones atendidas')
+            lineas.append('# TYPE tetoca_peticiones_total counter')
+            for (metodo, ruta, estado), cuenta in sorted(self._estados.items()):
+                lineas.append(f'tetoca_peticiones_total{{metodo="{metodo}",ruta="{ruta}",estado="{estado}"}} {cuenta}')
+            for i, (nombre, ayuda, _) in enumerate(self.HISTOGRAMAS):
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} histogram')
+                for (metodo, ruta), histogramas in sorted(self._rutas.items()):
+                    lineas.extend(histogramas[i].exportar(nombre, f'metodo="{metodo}",ruta="{ruta}"'))
+            lineas.append(f'# HELP tetoca_peticiones_excedidas_total Peticiones con más de {MAX_SQL} sentencias SQL')
+            lineas.append('# TYPE tetoca_peticiones_excedidas_total counter')
+            for (metodo, ruta), cuenta in sorted(self._excedidas.items()):
+                lineas.append(f'tetoca_peticiones_excedidas_total{{metodo="{metodo}",ruta="{ruta}"}} {cuenta}')
+        return '\n'.join(lineas) + '\n'
+
+
+registro = Registro()
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    context._metricas_inicio = time.perf_counter()
+
+
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    estado = peticion.get()
+    if estado is not None:
+        estado['sql'] += 1
+        estado['bd'] += time.perf_counter() - context._metricas_inicio
+
+
+def instrumentar(engine):
+    """
+    Cuenta las sentencias y el tiempo en base de datos de cada petición con los eventos del engine
+    """
+    event.listen(engine, 'before_cursor_execute', _antes)
+    event.listen(engine, 'after_cursor_execute', _despues)
+
+
+class MetricasMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._rutas = None
+
+    def _ruta(self, scope):
+        if self._rutas is None and 'app' in scope:
+            self._rutas = {r.endpoint: r.path for r in scope['app'].routes if hasattr(r, 'endpoint')}
+        return (self._rutas or {}).get(scope.get('endpoint'), 'desconocida')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        estado = {'sql': 0, 'bd': 0.0, 'bytes': 0, 'estado': 500, 'metodo': scope['method'], 'ruta': scope['path']}
+        token = peticion.set(estado)
+        inicio = time.perf_counter()
+
+        async def enviar(message):
+            if message['type'] == 'http.response.start':
+                estado['estado'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-sql-count', str(estado['sql']).encode()),
+                    (b'x-db-time', f"{estado['bd'] * 1000:.2f}".encode())]
+            elif message['type'] == 'http.response.body':
+                estado['bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            peticion.reset(token)
+            segundos = time.perf_counter() - inicio
+            ruta = self._ruta(scope)
+            registro.observar(scope['method'], ruta, estado['estado'], segundos, estado['sql'], estado['bd'],
+                              estado['bytes'])
+            if estado['sql'] > MAX_SQL:
+                print(f"Posible N+1 en {scope['method']} {ruta}: {estado['sql']} sentencias SQL, "
+                      f"{estado['bd'] * 1000:.1f} ms en base de datos")
@@ -0,0 +1,117 @@
+"""
+Cambios de esquema para bases de datos ya creadas. create_all solo crea tablas nuevas, por eso cada cambio sobre
+tablas existentes se agrega aquí en orden, con sentencias idempotentes, y se registra en la tabla migraciones.
+Cada migración puede llevar una consulta que decide si hace falta, en una base creada con los modelos actuales no
+hace falta y solo se registra.
+"""
+from service.normalizar import EXPRESION, FUNCIONES
+from service.particiones import ADELANTE, MESES
+
+_NORMALIZADAS = [('provincias', 'nombre'), ('municipios', 'nombre'), ('cadenas', 'siglas'), ('tiendas', 'nombre')]
+
+# compras todavía es una tabla normal, es decir la base se creó antes de particionarla
+SIN_PARTICIONAR = "SELECT relkind = 'r' FROM pg_class WHERE oid = 'compras'::regclass"
+
+MIGRACIONES = [
+    ('001_indices_compuestos', SIN_PARTICIONAR, [
+        # Compuestos según los filtros reales, se crean antes de borrar los simples que cubren
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_compras_nucleo_oferta ON compras (id_nucleo, id_oferta)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ofertas_tienda_fechas ON ofertas (id_tienda, fecha_inicio, fecha_fin)",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_compras_id_nucleo",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_ofertas_id_tienda",
+        # (id_usuario, id_nucleo) ya lo cubre la restricción u_nucleo_usuario
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_consumidores_id_usuario",
+        # Columnas que solo se filtran con ILIKE '%x%' o nunca, el índice no se usa y encarece cada INSERT
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_nombre_completo",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_dir_postal",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_usuario_ws",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_usuario_te",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_usuario_to",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_dir_correo",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_bodegas_direccion",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_nucleos_cant_modulos",
+        "ANALYZE compras, ofertas, consumidores, usuarios, bodegas, nucleos",
+    ]),
+    ('002_compras_particionada', SIN_PARTICIONAR, [
+        # Se copia a una tabla particionada por mes de fecha en una sola transacción, la secuencia se conserva
+        "BEGIN",
+        "LOCK TABLE compras IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE compras RENAME TO compras_sin_particion",
+        "ALTER TABLE compras_sin_particion RENAME CONSTRAINT compras_pkey TO compras_sin_particion_pkey",
+        "ALTER TABLE compras_sin_particion ALTER COLUMN id_compra DROP DEFAULT",
+        "ALTER SEQUENCE compras_id_compra_seq OWNED BY NONE",
+        "DROP INDEX IF EXISTS ix_compras_id_compra, ix_compras_id_oferta, ix_compras_id_usuario, "
+        "ix_compras_id_estado, ix_compras_nucleo_oferta",
+        "CREATE TABLE compras ("
+        "id_compra INTEGER NOT NULL DEFAULT nextval('compras_id_compra_seq'), "
+        "fecha TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(), "
+        "terminado BOOLEAN NOT NULL, pagado BOOLEAN NOT NULL, "
+        "id_oferta INTEGER NOT NULL REFERENCES ofertas (id_oferta) ON DELETE CASCADE, "
+        "id_nucleo INTEGER NOT NULL REFERENCES nucleos (id_nucleo) ON DELETE CASCADE, "
+        "id_usuario INTEGER NOT NULL REFERENCES usuarios (id_usuario) ON DELETE CASCADE, "
+        "id_estado INTEGER NOT NULL REFERENCES estados (id_estado) ON DELETE CASCADE, "
+        "seleccion VARCHAR, notificado BOOLEAN, "
+        "PRIMARY KEY (id_compra, fecha)) PARTITION BY RANGE (fecha)",
+        "ALTER SEQUENCE compras_id_compra_seq OWNED BY compras.id_compra",
+        "CREATE TABLE compras_default PARTITION OF compras DEFAULT",
+        MESES.format(desde="COALESCE((SELECT MIN(fecha) FROM compras_sin_particion), now())",
+                     hasta=f"now() + interval '{ADELANTE} months'"),
+        "INSERT INTO compras (id_compra, fecha, terminado, pagado, id_oferta, id_nucleo, id_usuario, id_estado, "
+        "seleccion, notificado) "
+        "SELECT id_compra, COALESCE(fecha, now()), terminado, pagado, id_oferta, id_nucleo, id_usuario, id_estado, "
+        "seleccion, notificado FROM compras_sin_particion",
+        "CREATE INDEX ix_compras_id_oferta ON compras (id_oferta)",
+        "CREATE INDEX ix_compras_id_usuario ON compras (id_usuario)",
+        "CREATE INDEX ix_compras_id_estado ON compras (id_estado)",
+        "CREATE INDEX ix_compras_nucleo_oferta ON compras (id_nucleo, id_oferta)",
+        "DROP TABLE compras_sin_particion",
+        "COMMIT",
+        "ANALYZE compras",
+    ]),
+    ('003_versiones', "SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns "
+                      "WHERE table_name = 'tiendas' AND column_name = 'version')", [
+        # Con DEFAULT constante no se reescriben las tablas
+        "ALTER TABLE tiendas ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE ofertas ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE nucleos ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    ]),
+    ('004_nombres_normalizados', "SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns "
+                                 "WHERE table_name = 'tiendas' AND column_name = 'nombre_norm')", FUNCIONES + [
+        # Las columnas generadas reescriben la tabla, son tablas de catálogo pequeñas
+        *(f"ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS {columna}_norm TEXT "
+          f"GENERATED ALWAYS AS ({EXPRESION.format(columna=columna)}) STORED" for tabla, columna in _NORMALIZADAS),
+        *(f"CREATE INDEX IF NOT EXISTS ix_{tabla}_{columna}_norm_trgm ON {tabla} USING gin ({columna}_norm gin_trgm_ops)"
+          for tabla, columna in _NORMALIZADAS),
+    ]),
+]
+
+
+async def migrar():
+    """
+    Aplica en orden las migraciones pendientes, fuera de transacción para poder usar CONCURRENTLY
+    """
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS migraciones "
+                       "(nombre VARCHAR PRIMARY KEY, fecha TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())")
+        cursor.execute("SELECT nombre FROM migraciones")
+        aplicadas = {fila[0] for fila in cursor.fetchall()}
+        for nombre, condicion, sentencias in MIGRACIONES:
+            if nombre in aplicadas:
+                continue
+            cursor.execute(condicion)
+            if cursor.fetchone()[0]:
+                print(f"Aplicando migración {nombre}")
+                for sql in sentencias:
+                    cursor.execute(sql)
+            cursor.execute("INSERT INTO migraciones (nombre) VALUES (%s)", (nombre,))
+        print("La base de datos está al día")
+    except psycopg2.Error as e:
+        print("Error al aplicar la migración:", e)
+    finally:
+        cursor.close()
+        conn.close()
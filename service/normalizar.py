@@ -0,0 +1,111 @@
+"""
+Comparación de nombres sin tildes ni mayúsculas. En la base de datos cada nombre buscado tiene una columna generada
+*_norm con f_unaccent(lower(...)) e índice trigrama, en la aplicación los catálogos chicos (provincias, municipios,
+cadenas) se guardan ya normalizados en memoria y una búsqueda se resuelve en una lista de ids. La copia se descarta
+al confirmar cualquier escritura del proceso sobre la tabla; lo escrito por otro proceso se ve al vencer CATALOGO_TTL.
+"""
+import os
+import unicodedata
+
+from sqlalchemy import DDL, Computed, Index, event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from service.cache import TTLCache
+
+# unaccent no es IMMUTABLE y una columna generada lo exige, por eso el envoltorio con el diccionario explícito
+FUNCIONES = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+    "AS $$ SELECT public.unaccent('public.unaccent', $1) $$",
+]
+
+EXPRESION = "f_unaccent(lower(regexp_replace(btrim({columna}), '[[:space:]]+', ' ', 'g')))"
+
+cache = TTLCache(maxsize=64, ttl=float(os.getenv('CATALOGO_TTL', 60)))
+_catalogos = set()
+_tablas = set()
+
+
+def normalizar(texto) -> str:
+    """
+    Minúsculas, sin tildes y con los espacios colapsados, igual que la expresión de las columnas *_norm
+    """
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(texto.lower().split())
+
+
+def normalizada(columna: str):
+    return Computed(EXPRESION.format(columna=columna), persisted=True)
+
+
+def trigrama(tabla: str, columna: str):
+    return Index(f'ix_{tabla}_{columna}_trgm', columna, postgresql_using='gin', postgresql_ops={columna: 'gin_trgm_ops'})
+
+
+def _pendiente(sesion, tabla: str):
+    if sesion is not None:
+        sesion.info.setdefault('catalogos', set()).add(tabla)
+
+
+def _limpiar(mapper, connection, target):
+    _pendiente(object_session(target), mapper.class_.__tablename__)
+
+
+def _masivo(contexto):
+    """
+    query.update() y query.delete() (forwards.update, activate, changeTrue) no pasan por los eventos del mapper
+    """
+    tabla = contexto.query.column_descriptions[0]['entity'].__tablename__
+    if tabla in _tablas:
+        _pendiente(contexto.session, tabla)
+
+
+def _confirmado(sesion):
+    # Al confirmar y no antes, si no otra petición podría volver a cargar la versión vieja entre medio
+    for tabla in sesion.info.pop('catalogos', ()):
+        cache.pop(tabla)
+
+
+def catalogo(entidad, campo: str):
+    """
+    Declara que entidad.campo se busca en memoria, la copia se descarta al confirmar un alta, cambio o baja
+    """
+    _catalogos.add((entidad.__tablename__, campo))
+    _tablas.add(entidad.__tablename__)
+    for evento in ('after_insert', 'after_update', 'after_delete'):
+        if not event.contains(entidad, evento, _limpiar):
+            event.listen(entidad, evento, _limpiar)
+
+
+def _filas(db, entidad, campo: str):
+    filas = cache.get(entidad.__tablename__)
+    if filas is None:
+        pk = inspect(entidad).primary_key[0]
+        filas = [(normalizar(nombre), id_) for id_, nombre in db.query(pk, getattr(entidad, campo))]
+        cache.set(entidad.__tablename__, filas)
+    return filas
+
+
+def coincide(db, entidad, campo: str, texto: str):
+    """
+    Condición campo ILIKE '%texto%' sin tildes. Con catálogo en memoria es un IN por llave primaria sobre la copia
+    del proceso, que puede no tener las filas que otro proceso escribió en los últimos CATALOGO_TTL segundos; sin
+    catálogo o sin ninguna coincidencia en la copia va a la columna *_norm
+    """
+    valor = normalizar(texto)
+    if (entidad.__tablename__, campo) in _catalogos:
+        ids = [id_ for nombre, id_ in _filas(db, entidad, campo) if valor in nombre]
+        if ids:
+            return inspect(entidad).primary_key[0].in_(ids)
+    return getattr(entidad, f'{campo}_norm').contains(valor, autoescape=True)
+
+
+def registrar(metadata):
+    for sql in FUNCIONES:
+        event.listen(metadata, 'before_create', DDL(sql))
+
+
+event.listen(Session, 'after_bulk_update', _masivo)
+event.listen(Session, 'after_bulk_delete', _masivo)
+event.listen(Session, 'after_commit', _confirmado)
@@ -0,0 +1,72 @@
+"""
+Particiones mensuales de compras por fecha. La tabla se crea particionada desde el modelo, cada mes vive en
+compras_AAAA_MM y lo que no cae en ningún mes va a compras_default.
+"""
+import datetime
+import os
+
+ADELANTE = int(os.getenv('PARTICIONES_ADELANTE', 3))
+RETENER = int(os.getenv('PARTICIONES_RETENER', 24))
+
+# Crea los meses que faltan entre desde y hasta, sin usar % para que sirva tanto en un DDL como en psycopg2
+MESES = ("DO $$ DECLARE mes date; BEGIN "
+         "FOR mes IN SELECT generate_series(date_trunc('month', {desde}), "
+         "date_trunc('month', {hasta}), interval '1 month')::date LOOP "
+         "EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident('compras_' || to_char(mes, 'YYYY_MM')) || "
+         "' PARTITION OF compras FOR VALUES FROM (' || quote_literal(mes) || ') TO (' || "
+         "quote_literal((mes + interval '1 month')::date) || ')'; "
+         "END LOOP; END $$")
+
+INICIAL = ["CREATE TABLE IF NOT EXISTS compras_default PARTITION OF compras DEFAULT",
+           MESES.format(desde="now()", hasta=f"now() + interval '{ADELANTE} months'")]
+
+
+def _mes(fecha: datetime.date, meses: int):
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def _nombre(mes: datetime.date):
+    return f"compras_{mes:%Y_%m}"
+
+
+async def sync_particiones(adelante: int = ADELANTE, retener: int = RETENER):
+    """
+    Crea las particiones de los próximos meses y separa de compras las que pasaron de retener meses, las separadas
+    quedan como tablas sueltas para archivarlas o borrarlas
+    """
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    cursor = conn.cursor()
+    hoy = datetime.date.today().replace(day=1)
+    try:
+        cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                       "WHERE i.inhparent = 'compras'::regclass")
+        existentes = {fila[0] for fila in cursor.fetchall()}
+        for n in range(adelante + 1):
+            mes = _mes(hoy, n)
+            if _nombre(mes) in existentes:
+                continue
+            desde, hasta = mes, _mes(mes, 1)
+            # Las filas de ese mes que hayan caído en default se mueven a la partición nueva
+            cursor.execute("ALTER TABLE compras DETACH PARTITION compras_default")
+            cursor.execute(f"CREATE TABLE {_nombre(mes)} PARTITION OF compras FOR VALUES FROM (%s) TO (%s)",
+                           (desde, hasta))
+            cursor.execute("WITH movidas AS (DELETE FROM compras_default WHERE fecha >= %s AND fecha < %s "
+                           "RETURNING *) INSERT INTO compras SELECT * FROM movidas", (desde, hasta))
+            cursor.execute("ALTER TABLE compras ATTACH PARTITION compras_default DEFAULT")
+            conn.commit()
+            print(f"Partición {_nombre(mes)} creada")
+        limite = _nombre(_mes(hoy, -retener))
+        for nombre in sorted(existentes):
+            if nombre != 'compras_default' and nombre < limite:
+                cursor.execute(f"ALTER TABLE compras DETACH PARTITION {nombre}")
+                conn.commit()
+                print(f"Partición {nombre} separada de compras")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error al mantener las particiones:", e)
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,158 @@
+"""
+Autorización con permisos precalculados. Para cada usuario se arma una vez su conjunto de permisos (rol, tiendas de
+las que es responsable, oficinas donde trabaja) y se guarda en memoria con el principal del token, así revisar un
+endpoint es buscar en conjuntos. La copia se descarta al confirmar cambios del proceso en el usuario, sus
+responsables, oficodas o en los roles; lo que cambie otro proceso se ve al vencer PERMISOS_TTL.
+"""
+import os
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, object_session
+
+from database import get_db
+from service import tokens
+from service.cache import TTLCache
+
+# Roles que pasan todas las revisiones, separados por coma
+ADMINISTRADORES = frozenset(r.strip() for r in os.getenv('ROLES_ADMIN', 'admin').split(',') if r.strip())
+
+cache = TTLCache(maxsize=int(os.getenv('PERMISOS_CACHE', 10000)), ttl=float(os.getenv('PERMISOS_TTL', 300)))
+# Tablas vigiladas y si un cambio en ellas afecta a todos los usuarios en lugar de al de la fila
+_vigiladas = {}
+TODOS = '*'
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+_CONSULTA = text(
+    "SELECT u.desac, r.nombre, "
+    "ARRAY(SELECT id_tienda FROM responsables WHERE id_usuario = u.id_usuario AND NOT desac), "
+    "ARRAY(SELECT id_oficina FROM oficodas WHERE id_usuario = u.id_usuario AND NOT desac) "
+    "FROM usuarios u LEFT JOIN roles r ON r.id_rol = u.id_rol WHERE u.id_usuario = :id"
+)
+
+
+class Permisos:
+    __slots__ = ('id_usuario', 'desac', 'rol', 'tiendas', 'oficinas')
+
+    def __init__(self, id_usuario: int, desac: bool, rol: str | None, tiendas: frozenset, oficinas: frozenset):
+        self.id_usuario = id_usuario
+        self.desac = desac
+        self.rol = rol
+        self.tiendas = tiendas
+        self.oficinas = oficinas
+
+    @property
+    def admin(self) -> bool:
+        return self.rol in ADMINISTRADORES
+
+    def tienda(self, id_tienda: int) -> bool:
+        return self.admin or id_tienda in self.tiendas
+
+    def oficina(self, id_oficina: int) -> bool:
+        return self.admin or id_oficina in self.oficinas
+
+
+def calcular(db: Session, id_usuario: int) -> Permisos | None:
+    """
+    Permisos del usuario desde la caché o con una sola consulta, None si el usuario no existe
+    """
+    permisos = cache.get(id_usuario)
+    if permisos is None:
+        fila = db.execute(_CONSULTA, {'id': id_usuario}).first()
+        if fila is None:
+            return None
+        permisos = Permisos(id_usuario, fila[0], fila[1], frozenset(fila[2]), frozenset(fila[3]))
+        cache.set(id_usuario, permisos)
+    return permisos
+
+
+def _pendiente(sesion, clave):
+    if sesion is not None:
+        sesion.info.setdefault('permisos', set()).add(clave)
+
+
+def _olvidar(mapper, connection, target):
+    sesion = object_session(target)
+    if _vigiladas[mapper.class_.__tablename__]:
+        _pendiente(sesion, TODOS)
+        return
+    _pendiente(sesion, target.id_usuario)
+    # Una fila pasada a otro usuario también cambia los permisos del anterior
+    for anterior in inspect(target).attrs.id_usuario.history.deleted:
+        _pendiente(sesion, anterior)
+
+
+def _masivo(contexto):
+    """
+    query.update() y query.delete() (forwards.update, activate, changeTrue) no pasan por los eventos del mapper ni
+    dicen qué filas tocaron, se descartan los permisos de todos
+    """
+    if contexto.query.column_descriptions[0]['entity'].__tablename__ in _vigiladas:
+        _pendiente(contexto.session, TODOS)
+
+
+def _confirmado(sesion):
+    claves = sesion.info.pop('permisos', ())
+    if TODOS in claves:
+        cache.clear()
+    for clave in claves:
+        cache.pop(clave)
+
+
+def vigilar(entidad, todos: bool = False):
+    """
+    Declara que los cambios en filas de entidad (con id_usuario) cambian los permisos de ese usuario, o con todos
+    los de cualquiera (roles)
+    """
+    _vigiladas[entidad.__tablename__] = todos
+    for evento in ('after_insert', 'after_update', 'after_delete'):
+        if not event.contains(entidad, evento, _olvidar):
+            event.listen(entidad, evento, _olvidar)
+
+
+async def principal(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)) -> Permisos:
+    """
+    Permisos del dueño del token, sin leer el usuario completo como get_user
+    """
+    from modules.autenticar import usuarios_desacti
+    cred_exc = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
+                             headers={"WWW-Authenticate": "Bearer"}, )
+    try:
+        id_usuario = int(tokens.verificar(token)['user'])
+    except (JWTError, KeyError, ValueError):
+        raise cred_exc
+    permisos = calcular(db, id_usuario)
+    if permisos is None:
+        raise cred_exc
+    if permisos.desac or id_usuario in usuarios_desacti:
+        raise HTTPException(status_code=status.HTTP_423_LOCKED, detail="Inactive user")
+    return permisos
+
+
+def requiere_rol(*roles: str):
+    """
+    Dependencia que deja pasar a los administradores y a los roles dados
+    """
+    async def dependencia(permisos: Annotated[Permisos, Depends(principal)]) -> Permisos:
+        if not (permisos.admin or permisos.rol in roles):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+        return permisos
+    return dependencia
+
+
+def exigir_tienda(permisos: Permisos, *tiendas: int | None):
+    if not all(permisos.tienda(id_tienda) for id_tienda in tiendas if id_tienda is not None):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+
+
+def exigir_oficina(permisos: Permisos, *oficinas: int | None):
+    if not all(permisos.oficina(id_oficina) for id_oficina in oficinas if id_oficina is not None):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+
+
+event.listen(Session, 'after_bulk_update', _masivo)
+event.listen(Session, 'after_bulk_delete', _masivo)
+event.listen(Session, 'after_commit', _confirmado)
@@ -0,0 +1,20 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RespuestaJSON(JSONResponse):
+    """
+    Respuesta por defecto de la api, serializa con orjson y si no está instalado con el encoder estándar
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,69 @@
+"""
+Emisión y verificación de los tokens de acceso. Las claves se cargan una vez como objetos de python-jose y los tokens
+ya verificados se guardan hasta su exp, así una petición autenticada no repite la firma ni la decodificación.
+Con ALGORITHM HS* firma con SECRET_KEY; con RS*/ES* firma con la clave privada de JWT_PRIVADA y verifica con la
+pública de JWT_PUBLICA, que se publica en /jwks para que otros servicios verifiquen sin pedirle nada a la api.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from jose import JWTError, jwk, jwt
+
+from service.cache import TTLCache
+
+load_dotenv()
+
+ALGORITMO = os.getenv('ALGORITHM', 'HS256')
+MINUTOS = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 30))
+# Tokens verificados que se recuerdan, cada uno hasta su exp
+verificados = TTLCache(maxsize=int(os.getenv('TOKENS_CACHE', 10000)), ttl=MINUTOS * 60)
+
+
+def _pem(variable: str):
+    ruta = os.getenv(variable)
+    if not ruta:
+        return None
+    with open(ruta, 'rb') as file:
+        return file.read()
+
+
+if ALGORITMO.startswith('HS'):
+    _firma = _verifica = jwk.construct(os.getenv('SECRET_KEY', ''), ALGORITMO)
+    KID = None
+else:
+    _privada, _publica = _pem('JWT_PRIVADA'), _pem('JWT_PUBLICA')
+    if not (_privada or _publica):
+        raise RuntimeError(f"ALGORITHM={ALGORITMO} necesita JWT_PRIVADA (para firmar) o JWT_PUBLICA (para solo "
+                           "verificar), ninguna está definida")
+    _firma = jwk.construct(_privada, ALGORITMO) if _privada else None
+    _verifica = jwk.construct(_publica, ALGORITMO) if _publica else _firma.public_key()
+    KID = hashlib.sha256(_publica or _verifica.to_pem()).hexdigest()[:16]
+
+
+def emitir(claims: dict, minutos: int = MINUTOS) -> str:
+    if _firma is None:
+        raise JWTError("Sin clave privada para firmar")
+    claims = dict(claims, exp=datetime.utcnow() + timedelta(minutes=minutos))
+    return jwt.encode(claims, _firma, algorithm=ALGORITMO, headers={'kid': KID} if KID else None)
+
+
+def verificar(token: str) -> dict:
+    """
+    Claims del token, JWTError si la firma no vale o expiró
+    """
+    claims = verificados.get(token)
+    if claims is not None and claims['exp'] > time.time():
+        return claims
+    claims = jwt.decode(token, _verifica, algorithms=[ALGORITMO])
+    if 'exp' in claims:
+        verificados.set(token, claims, ttl=claims['exp'] - time.time())
+    return claims
+
+
+def jwks() -> dict:
+    if KID is None:
+        return {'keys': []}
+    return {'keys': [dict(_verifica.to_dict(), kid=KID, use='sig', alg=ALGORITMO)]}
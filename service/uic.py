@@ -1,8 +1,10 @@
 import psycopg2
+from psycopg2.extras import execute_values
 from openpyxl import load_workbook
 import os
 from database import user, dbs, passw, server, port
 from modules.autenticar import get_password_hash
+from service.normalizar import normalizar
 
 
 async def actualizar_pass_hash():
@@ -26,55 +28,82 @@ async def actualizar_pass_hash():
         conn.close()
 
 
-async def vinculacion():
-    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
-    cursor = conn.cursor()
-
-    ruta_archivo_excel = os.getenv('VINCULACION')
-    hoja_trabajo = load_workbook(filename=ruta_archivo_excel)['Todo']
+def _indice(filas):
+    indice = {}
+    for clave, nombre, id_ in filas:
+        indice.setdefault(clave, {}).setdefault(normalizar(nombre), id_)
+    return indice
 
-    for fila in hoja_trabajo.iter_rows(min_row=2, values_only=True):
-        bodega, total_nucleo, tienda, cadena, municipio, provincia = fila
 
-        try:
-            consulta = "SELECT id_municipio FROM municipios, provincias WHERE provincias.id_provincia = municipios.id_provincia and LOWER(provincias.nombre) LIKE LOWER(%s) and LOWER(municipios.nombre) LIKE LOWER(%s) LIMIT 1; "
-            cursor.execute(consulta, ('%' + provincia + '%', '%' + municipio + '%'))
-            municipio = cursor.fetchone()
+def _buscar(indice: dict, clave, nombre: str):
+    """
+    Primero la coincidencia exacta y si no la primera que contenga el nombre, como hacía el LIKE '%x%'
+    """
+    grupo = indice.get(clave, {})
+    encontrado = grupo.get(nombre)
+    if encontrado is None and nombre:
+        encontrado = next((v for n, v in grupo.items() if nombre in n), None)
+    return encontrado
 
-            consulta = "SELECT id_cadena FROM cadenas WHERE LOWER(cadenas.siglas) LIKE LOWER(%s) LIMIT 1; "
-            cursor.execute(consulta, ('%' + cadena + '%',))
-            cadena = cursor.fetchone()
 
-            if municipio and cadena:
-                municipio = str(municipio[0])
-                cadena = str(cadena[0])
-
-                consulta = "SELECT id_tienda FROM tiendas WHERE id_municipio = %s and LOWER(nombre) LIKE LOWER(%s) LIMIT 1;"
-                cursor.execute(consulta, (municipio, '%' + tienda + '%'))
-                rtienda = cursor.fetchone()
-                if not rtienda:
-                    consulta = ("INSERT INTO tiendas (nombre, direccion, desac, frecuencia_venta, id_municipio, id_cadena) "
-                                "VALUES (%s, %s, %s, %s, %s, %s);")
-                    cursor.execute(consulta, (tienda, tienda, False, 0, municipio, cadena))
-                    conn.commit()
-                    cursor.execute("SELECT id_tienda FROM tiendas WHERE nombre LIKE %s and id_municipio = %s and id_cadena = %s LIMIT 1;")
-                    cursor.execute(consulta, ('%' + tienda + '%', municipio, cadena))
-                    tienda = cursor.fetchone()
-                tienda = rtienda[0]
+async def vinculacion():
+    """
+    Vincula las bodegas con sus tiendas a partir del Excel VINCULACION. Lee la hoja una vez, resuelve todas las
+    filas en memoria contra diccionarios precargados, inserta de una vez las tiendas que faltan y actualiza las
+    bodegas con un solo UPDATE, todo en una transacción
+    """
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    cursor = conn.cursor()
+    libro = load_workbook(filename=os.getenv('VINCULACION'), read_only=True)
+    try:
+        filas = [fila[:6] for fila in libro['Todo'].iter_rows(min_row=2, values_only=True) if any(fila)]
 
-                consulta = "SELECT id_bodega FROM bodegas, oficinas WHERE bodegas.id_oficina = oficinas.id_oficina and id_municipio = %s and LOWER(numero) LIKE LOWER(%s) LIMIT 1;"
-                cursor.execute(consulta, (municipio, bodega))
-                bodega = cursor.fetchone()
+        # Índices {clave: {nombre normalizado: id}}, la clave es la provincia o el municipio al que pertenece el nombre
+        cursor.execute("SELECT p.nombre, m.nombre, m.id_municipio FROM municipios m "
+                       "JOIN provincias p ON p.id_provincia = m.id_provincia")
+        municipios = _indice((normalizar(p), m, i) for p, m, i in cursor.fetchall())
+        cursor.execute("SELECT NULL, siglas, id_cadena FROM cadenas")
+        cadenas = _indice(cursor.fetchall())
+        cursor.execute("SELECT id_municipio, nombre, id_tienda FROM tiendas")
+        tiendas = _indice(cursor.fetchall())
+        cursor.execute("SELECT o.id_municipio, b.numero, b.id_bodega FROM bodegas b "
+                       "JOIN oficinas o ON o.id_oficina = b.id_oficina")
+        bodegas = _indice(cursor.fetchall())
 
-                if bodega:
-                    sql = "UPDATE bodegas SET id_tienda = %s WHERE id_bodega = %s"
-                    cursor.execute(sql, (tienda, bodega))
+        resueltas, nuevas, creadas, errores = [], {}, {}, 0
+        for bodega, total_nucleo, tienda, cadena, municipio, provincia in filas:
+            provincia = normalizar(provincia)
+            provincia = provincia if provincia in municipios else next((p for p in municipios if provincia in p), None)
+            id_municipio = _buscar(municipios, provincia, normalizar(municipio))
+            id_cadena = _buscar(cadenas, None, normalizar(cadena))
+            if id_municipio is None or id_cadena is None:
+                errores += 1
+                continue
+            id_bodega = bodegas.get(id_municipio, {}).get(normalizar(bodega))
+            clave = (id_municipio, normalizar(tienda))
+            id_tienda = _buscar(tiendas, id_municipio, clave[1])
+            if id_tienda is None:
+                nuevas.setdefault(clave, (tienda, tienda, False, 0, id_municipio, id_cadena))
+            if id_bodega is not None:
+                resueltas.append((id_bodega, id_tienda if id_tienda is not None else clave))
 
-                    cursor.execute("SELECT id_tienda FROM tiendas WHERE nombre LIKE %s and id_municipio = %s and id_cadena = %s LIMIT 1;")
-                    cursor.execute(consulta, ('%' + tienda + '%', municipio, cadena))
-                    tienda = cursor.fetchone()
-            print("Todos los datos en la tabla usuario ha sido actualizado")
-        except (Exception, ):
-            print("Error al cambiar datos de la tabla:")
-    cursor.close()
-    conn.close()
\ No newline at end of file
+        if nuevas:
+            creadas = execute_values(
+                cursor, "INSERT INTO tiendas (nombre, direccion, desac, frecuencia_venta, id_municipio, id_cadena) "
+                        "VALUES %s RETURNING id_tienda, nombre, id_municipio", list(nuevas.values()),
+                page_size=1000, fetch=True)
+            creadas = {(m, normalizar(n)): i for i, n, m in creadas}
+        valores = [(id_bodega, creadas[t] if isinstance(t, tuple) else t) for id_bodega, t in resueltas]
+        if valores:
+            execute_values(cursor, "UPDATE bodegas SET id_tienda = v.id_tienda FROM (VALUES %s) AS v (id_bodega, id_tienda) "
+                                   "WHERE bodegas.id_bodega = v.id_bodega", valores, page_size=len(valores))
+        conn.commit()
+        print(f"{len(filas)} filas: {len(nuevas)} tiendas creadas, {len(valores)} bodegas vinculadas, "
+              f"{errores} filas sin municipio o cadena")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error al vincular las bodegas:", e)
+    finally:
+        libro.close()
+        cursor.close()
+        conn.close()
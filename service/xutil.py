@@ -1,8 +1,17 @@
+import glob
+import gzip
+import hashlib
 import json
+import mmap
 import os
 import requests
 from datetime import date
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 async def sync_reset():
     """
@@ -52,25 +61,32 @@ async def info():
     print("Usuarios Conectados:", usuarios_conectados)
 
 
-async def sync_cerodb():
+# Tablas de referencia que se pueden conservar al vaciar la base, ninguna apunta a tablas de datos
+CATALOGOS = ('provincias', 'municipios', 'oficinas', 'cadenas', 'estados', 'roles', 'categorias', 'productos',
+             'configuracion')
+
+
+async def sync_cerodb(conservar_catalogos: bool = False):
+    """
+    Vacía todas las tablas de los modelos con un solo TRUNCATE, la estructura, los índices y las particiones quedan
+    para la carga siguiente. Las tablas fuera de los modelos (migraciones) no se tocan
+    """
     import psycopg2
-    from database import user, dbs, passw, server, port
+    from database import Base, user, dbs, passw, server, port
     conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
 
     cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            "SELECT tablename FROM pg_tables WHERE schemaname = 'public'"
-        )
-
-        tables = cursor.fetchall()
-
-        for table in tables:
-            cursor.execute(f"DROP TABLE {table[0]} CASCADE")
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+        existentes = {fila[0] for fila in cursor.fetchall()}
+        tablas = [t.name for t in Base.metadata.sorted_tables if t.name in existentes
+                  and not (conservar_catalogos and t.name in CATALOGOS)]
 
+        if tablas:
+            cursor.execute(f"TRUNCATE {', '.join(tablas)} RESTART IDENTITY CASCADE")
         conn.commit()
-        print("Todos los datos en las tablas han sido eliminados.")
+        print(f"Vaciadas {len(tablas)} tablas" + (", catálogos conservados." if conservar_catalogos else "."))
 
     except psycopg2.Error as e:
         conn.rollback()
@@ -80,11 +96,142 @@ async def sync_cerodb():
         cursor.close()
         conn.close()
 
+
+def _entorno():
+    from database import passw
+    return dict(os.environ, PGPASSWORD=passw or '')
+
+
+def _conexion_cli():
+    from database import user, dbs, server, port
+    return ['-h', server, '-p', str(port), '-U', user, '-d', dbs]
+
+
+def _restaurar_sql(ruta: str, bloque: int = 1024 * 1024):
+    """
+    Pasa el archivo a psql por bloques en lugar de leerlo completo en memoria, psql además entiende los COPY ... FROM
+    stdin de un pg_dump en texto plano
+    """
+    import subprocess
+    total = os.path.getsize(ruta) or 1
+    enviado, avisado = 0, 0
+    proceso = subprocess.Popen(['psql', *_conexion_cli(), '-q', '-v', 'ON_ERROR_STOP=1'], stdin=subprocess.PIPE,
+                               env=_entorno())
+    try:
+        with open(ruta, 'rb') as archivo:
+            while datos := archivo.read(bloque):
+                proceso.stdin.write(datos)
+                enviado += len(datos)
+                if enviado * 100 // total >= avisado + 5:
+                    avisado = enviado * 100 // total
+                    print(f"Restaurando {ruta}: {avisado}%")
+    except BrokenPipeError:
+        pass
+    finally:
+        proceso.stdin.close()
+    if proceso.wait():
+        raise subprocess.CalledProcessError(proceso.returncode, 'psql')
+
+
+def _pg_restore(ruta: str, opciones: list, total: int = 0, entorno: dict | None = None):
+    """
+    Ejecuta pg_restore -v y cuenta en su salida las tablas cargadas para mostrar el avance
+    """
+    import subprocess
+    proceso = subprocess.Popen(['pg_restore', *_conexion_cli(), '-v', *opciones, ruta], stderr=subprocess.PIPE,
+                               text=True, env=entorno or _entorno())
+    cargadas = 0
+    for linea in proceso.stderr:
+        if 'processing data for table' in linea:
+            cargadas += 1
+            print(f"Tablas cargadas {cargadas}/{total}: {linea.rsplit(' ', 1)[-1].strip()}")
+        elif 'error' in linea.lower():
+            print(linea.rstrip())
+    if proceso.wait():
+        raise subprocess.CalledProcessError(proceso.returncode, 'pg_restore')
+
+
+def _crear_indice(sql: str):
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET maintenance_work_mem = '512MB'")
+            cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+def _restaurar_backup(ruta: str, trabajos: int):
+    """
+    Sin esquema restaura por secciones: tablas, datos con trabajos procesos en paralelo y al final índices y
+    restricciones también en paralelo. Si el esquema ya existe (create_all o sync_cerodb con TRUNCATE) solo carga
+    los datos, con los índices secundarios quitados durante la carga y recreados después en paralelo. La carga en
+    paralelo desactiva las llaves foráneas con session_replication_role, que pide superusuario; sin él se carga con
+    un solo proceso en el orden del respaldo
+    """
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    lista = subprocess.run(['pg_restore', '-l', ruta], capture_output=True, text=True, check=True).stdout
+    total = sum(1 for linea in lista.splitlines() if ' TABLE DATA ' in linea)
+
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM pg_tables WHERE schemaname = 'public'")
+        if not cursor.fetchone()[0]:
+            _pg_restore(ruta, ['--section=pre-data'])
+            _pg_restore(ruta, ['--section=data', '-j', str(trabajos)], total)
+            print("Datos cargados, creando índices y restricciones")
+            _pg_restore(ruta, ['--section=post-data', '-j', str(trabajos)])
+            return
+        cursor.execute("SELECT rolsuper FROM pg_roles WHERE rolname = current_user")
+        superusuario = cursor.fetchone()[0]
+        # Índices que no sostienen una restricción, las llaves primarias y únicas se quedan. Los de las particiones
+        # no se listan, quitar el de la tabla particionada quita los de todas sus particiones
+        cursor.execute("SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid), ic.relkind FROM pg_index i "
+                       "JOIN pg_class c ON c.oid = i.indrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+                       "JOIN pg_class ic ON ic.oid = i.indexrelid "
+                       "WHERE n.nspname = 'public' AND NOT EXISTS "
+                       "(SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid) "
+                       "AND NOT EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = i.indexrelid)")
+        indices = cursor.fetchall()
+        for nombre, _, _ in indices:
+            cursor.execute(f"DROP INDEX IF EXISTS {nombre}")
+        print(f"{len(indices)} índices quitados durante la carga")
+        # La definición de un índice particionado es ON ONLY, sin quitarlo no se crearía en las particiones
+        definiciones = [definicion.replace(' ON ONLY ', ' ON ', 1) if tipo == 'I' else definicion
+                        for _, definicion, tipo in indices]
+        try:
+            if superusuario:
+                # Con las tablas cargadas en paralelo el orden de las llaves foráneas no está garantizado
+                entorno = dict(_entorno(), PGOPTIONS='-c session_replication_role=replica')
+                _pg_restore(ruta, ['--data-only', '-j', str(trabajos)], total, entorno)
+            else:
+                print("Sin superusuario, los datos se cargan con un solo proceso")
+                _pg_restore(ruta, ['--data-only'], total)
+        finally:
+            print("Recreando índices")
+            with ThreadPoolExecutor(trabajos) as pool:
+                list(pool.map(_crear_indice, definiciones))
+            cursor.execute("ANALYZE")
+    finally:
+        cursor.close()
+        conn.close()
+
+
 async def sync_import():
     """
     Si el archivo tetoca.rar está en la raíz del proyecto, esta función lo descomprime
     Si se encuentra  un sql o un backups lo ejecuta.
     """
+    import subprocess
+    import time
     import patoolib
 
     archivo_rar = "tetoca.rar"
@@ -92,134 +239,211 @@ async def sync_import():
         patoolib.extract_archive(archivo_rar)
         os.remove(archivo_rar)
 
-    from database import user, dbs, passw, server, port
-
     sql_file_path = 'tetoca.sql'
     if os.path.exists(sql_file_path):
-        import psycopg2
-        conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
-        cursor = conn.cursor()
-
-        with open(sql_file_path, 'r') as sql_file:
-            sql_query = sql_file.read()
-
-        cursor.execute(sql_query)
-        conn.commit()
-        conn.close()
-        print("La restauración se ha completado exitosamente.")
-        os.remove(sql_file_path)
-        print(f"Eliminado fichero {sql_file_path}")
+        inicio = time.perf_counter()
+        try:
+            _restaurar_sql(sql_file_path)
+            print(f"La restauración se ha completado exitosamente en {time.perf_counter() - inicio:.0f} s.")
+            os.remove(sql_file_path)
+            print(f"Eliminado fichero {sql_file_path}")
+        except subprocess.CalledProcessError as e:
+            print(f"Error al restaurar la base de datos: {e}")
 
     backup_file_path = 'tetoca.backup'
     if os.path.exists(backup_file_path):
-        import subprocess
-        restore_command = f"pg_restore -h {server} -p {port} -U {user} -d {dbs} -v {backup_file_path}"
+        trabajos = int(os.getenv('RESTAURAR_TRABAJOS', os.cpu_count() or 1))
+        inicio = time.perf_counter()
         try:
-            print("restore_command")
-            subprocess.run(restore_command, shell=True, check=True)
-            print("La restauración se ha completado exitosamente.")
+            _restaurar_backup(backup_file_path, trabajos)
+            print(f"La restauración se ha completado exitosamente en {time.perf_counter() - inicio:.0f} s.")
             os.remove(backup_file_path)
         except subprocess.CalledProcessError as e:
             print(f"Error al restaurar la base de datos: {e}")
 
 
+# Las fotos son JSON Lines comprimidas, una entidad por línea. Las .json de antes se siguen leyendo
+CARPETA = "async"
+ESTADO = f"{CARPETA}/estado.json"
+NIVEL = int(os.getenv('FOTOS_COMPRESION', 6))
+
+
+def _ruta(nombre: str, dat, extension: str = 'jsonl.gz') -> str:
+    return f"{CARPETA}/{dat} {nombre}.{extension}"
+
+
+def _lineas(ruta: str):
+    """
+    Líneas de una foto comprimida, el archivo se mapea en memoria y se descomprime por bloques sin copiarlo entero
+    """
+    with open(ruta, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        with gzip.GzipFile(fileobj=mapa) as datos:
+            yield from datos
+
+
+def _leer(nombre: str, dat=None):
+    """
+    Filas de la foto más reciente de nombre con fecha hasta dat, None si no hay ninguna
+    """
+    rutas = [r for extension in ('json', 'jsonl.gz') for r in glob.glob(_ruta(nombre, '*', extension))
+             if dat is None or os.path.basename(r)[:10] <= str(dat)]
+    if not rutas:
+        return None
+    ruta = max(rutas, key=lambda r: (os.path.basename(r)[:10], r.endswith('.gz')))
+    if not ruta.endswith('.gz'):
+        with open(ruta, "r") as file:
+            return json.load(file)
+    cargar = orjson.loads if orjson else json.loads
+    return [cargar(linea) for linea in _lineas(ruta)]
+
+
+def _escribir(nombre: str, dat, filas: list):
+    ruta = _ruta(nombre, dat)
+    # Se escribe aparte y se reemplaza, una descarga cortada no deja una foto a medias
+    with gzip.open(f"{ruta}.tmp", "wb", compresslevel=NIVEL) as file:
+        for fila in filas:
+            file.write(orjson.dumps(fila) if orjson else json.dumps(fila, ensure_ascii=False).encode())
+            file.write(b"\n")
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+def _estado():
+    """
+    Por entidad y contenedor: huella del contenido, ETag y Last-Modified de la api, día de la última revisión y si
+    el cambio todavía no se aplicó a la base de datos
+    """
+    try:
+        with open(ESTADO, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_estado(estado: dict):
+    with open(ESTADO, "w") as file:
+        json.dump(estado, file)
+
+
+def _huella(filas: list) -> str:
+    if orjson:
+        return hashlib.sha1(orjson.dumps(filas, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return hashlib.sha1(json.dumps(filas, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _condicional(previo: dict) -> dict:
+    headers = {}
+    if previo.get('etag'):
+        headers['If-None-Match'] = previo['etag']
+    if previo.get('modificado'):
+        headers['If-Modified-Since'] = previo['modificado']
+    return headers
+
+
+def _revisado(previo: dict, response, filas: list | None, dat) -> bool:
+    """
+    Anota la respuesta en el estado del contenedor, True si el contenido cambió
+    """
+    previo['dia'] = str(dat)
+    if filas is None:
+        return False
+    previo['etag'] = response.headers.get('ETag')
+    previo['modificado'] = response.headers.get('Last-Modified')
+    huella = _huella(filas)
+    if huella == previo.get('huella'):
+        return False
+    previo['huella'] = huella
+    previo['pendiente'] = True
+    return True
+
+
 async def sync_dpa(entidad, dat=date.today()):
-    entidades = []
+    estado = _estado()
+    previo = estado.setdefault(entidad, {}).setdefault('', {})
+    entidades = _leer(entidad, dat)
+    if entidades is not None and previo.get('dia') == str(dat):
+        return entidades
     try:
-        with open(f"async/{dat} {entidad}.json", "r") as file:
-            entidades = json.load(file)
+        headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + os.getenv('XUTIL_TOKEN_DPA'),
+                   **_condicional(previo)}
+        url = os.getenv('XUTIL_API_DPA') + entidad + 's?atributos=*'
+        response = requests.request("GET", url, headers=headers, data={})
+        if response.status_code in (200, 304):
+            filas = response.json()['data'] if response.status_code == 200 else None
+            if _revisado(previo, response, filas, dat):
+                entidades = filas
+                _escribir(entidad, dat, entidades)
+                print(entidad)
+            _guardar_estado(estado)
     except (Exception,):
+        pass
+    return entidades or []
+
+
+def _delta(entidad, contenedor, url, dat, supercon=None):
+    """
+    Foto de entidad armada por contenedor a partir de la última. Solo pide los contenedores que no se revisaron hoy,
+    condicionados a su ETag o Last-Modified, y reemplaza las filas de los que cambiaron de huella. Los que cambiaron
+    o desaparecieron quedan pendientes para sync_all_bd
+    """
+    contenedores = _leer(contenedor, dat) or []
+    clave = f'{contenedor}_id'
+    grupos = {}
+    for fila in _leer(entidad, dat) or []:
+        grupos.setdefault(fila[clave], []).append(fila)
+    estado = _estado()
+    previos = estado.setdefault(entidad, {})
+    cambios = 0
+    for conten in contenedores:
+        previo = previos.setdefault(str(conten['id']), {})
+        if previo.get('dia') == str(dat):
+            continue
         try:
-            headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + os.getenv('XUTIL_TOKEN_DPA')}
-            url = os.getenv('XUTIL_API_DPA') + entidad + 's?atributos=*'
-            response = requests.request("GET", url, headers=headers, data={})
-            if response.status_code == 200:
-                entidades = response.json()['data']
-                with open(f"async/{dat} {entidad}.json", "w") as file:
-                    json.dump(entidades, file, ensure_ascii=False, indent=3)
-                print(entidad)
+            headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + os.getenv('XUTIL_TOKEN_DCPR'),
+                       **_condicional(previo)}
+            response = requests.request("GET", url(conten), headers=headers, data={})
         except (Exception,):
-            pass
+            continue
+        if response.status_code not in (200, 304):
+            continue
+        filas = None
+        if response.status_code == 200:
+            filas = response.json()['data']
+            for fila in filas:
+                fila[clave] = conten['id']
+                if supercon:
+                    fila[f'{supercon}_id'] = conten[f'{supercon}_id']
+        if _revisado(previo, response, filas, dat):
+            grupos[conten['id']] = filas
+            cambios += 1
+    if contenedores:
+        vigentes = {conten['id'] for conten in contenedores}
+        for conten_id in [c for c in grupos if c not in vigentes]:
+            del grupos[conten_id]
+            previos[str(conten_id)] = {'dia': str(dat), 'pendiente': True}
+            cambios += 1
+    entidades = [fila for filas in grupos.values() for fila in filas]
+    _escribir(entidad, dat, entidades)
+    _guardar_estado(estado)
+    print(f"{entidad}: {cambios} de {len(contenedores)} {contenedor}s cambiaron")
     return entidades
 
 
 async def sync_dcpr(entidad, contenedor, dat=date.today()):
-    entidades = []
-    try:
-        with open(f"async/{dat} {entidad}.json", "r") as file:
-            viejos = json.load(file)
-    except (Exception,):
-        viejos = []
-    try:
-        with open(f"async/{dat} {contenedor}.json", "r") as file:
-            contenedores = json.load(file)
-        entidades = []
-        for conten in contenedores:
-            conten_id = conten['id']
-            existe = False
-            for v in viejos:
-                if v[f'{contenedor}_id'] == conten_id:
-                    existe = True
-                    break
-            if not existe:
-                try:
-                    headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + os.getenv('XUTIL_TOKEN_DCPR')}
-                    url = f"https://apis-fuc.xutil.cu/api-dcpr-consulta/0.1.221112/api/v1/{entidad}s?{contenedor}_id={conten_id}"
-                    response = requests.request("GET", url, headers=headers, data={})
-                    if response.status_code == 200:
-                        for entidada in response.json()['data']:
-                            entidada[f'{contenedor}_id'] = conten_id
-                            entidades.append(entidada)
-                except(Exception,):
-                    pass
-        with open(f"async/{dat} {entidad}.json", "w") as file:
-            json.dump(viejos + entidades, file, ensure_ascii=False, indent=3)
-
-    except (Exception,):
-        pass
-    return viejos + entidades
+    return _delta(entidad, contenedor, lambda conten: f"https://apis-fuc.xutil.cu/api-dcpr-consulta/0.1.221112/api/v1/"
+                                                      f"{entidad}s?{contenedor}_id={conten['id']}", dat)
 
 
 async def sync_dcpr2(entidad='nucleo', contenedor='bodega', supercon='oficina', dat=date.today()):
-    entidades = []
-    try:
-        with open(f"async/{dat} {entidad}.json", "r") as file:
-            viejos = json.load(file)
-    except (Exception,):
-        viejos = []
-    try:
-        with open(f"async/{dat} {contenedor}.json", "r") as file:
-            contenedores = json.load(file)
-        entidades = []
-        for conten in contenedores:
-            conten_id = conten['id']
-            supercon_id = conten[f'{supercon}_id']
-            existe = False
-            for v in viejos:
-                if v[f'{contenedor}_id'] == conten_id and v[f'{supercon}_id'] == supercon:
-                    existe = True
-                    break
-            if not existe:
-                try:
-                    headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + os.getenv('XUTIL_TOKEN_DCPR')}
-                    url = f"https://apis-fuc.xutil.cu/api-dcpr-consulta/0.1.221112/api/v1/listar-consumidores-{contenedor}?{supercon}_id={supercon_id}&{contenedor}_id={conten_id}"
-                    response = requests.request("GET", url, headers=headers, data={})
-                    if response.status_code == 200:
-                        for entidada in response.json()['data']:
-                            entidada[f'{contenedor}_id'] = conten_id
-                            entidada[f'{supercon}_id'] = supercon_id
-                            entidades.append(entidada)
-                except(Exception,):
-                    pass
-        with open(f"async/{dat} {entidad}.json", "w") as file:
-            json.dump(viejos + entidades, file, ensure_ascii=False, indent=3)
-
-    except (Exception,):
-        pass
-    return viejos + entidades
+    return _delta(entidad, contenedor, lambda conten: f"https://apis-fuc.xutil.cu/api-dcpr-consulta/0.1.221112/api/v1/"
+                                                      f"listar-consumidores-{contenedor}?{supercon}_id="
+                                                      f"{conten[f'{supercon}_id']}&{contenedor}_id={conten['id']}",
+                  dat, supercon)
 
 
 async def sync_all():
+    """
+    Sincronización diaria por diferencias, solo se descarga y se aplica lo que cambió desde la última foto
+    """
     provincias = await sync_dpa(entidad='provincia')
     municipios = await sync_dpa(entidad='municipio')
     oficinas = await sync_dcpr(entidad='oficina', contenedor='municipio')
@@ -227,152 +451,69 @@ async def sync_all():
     nucleo = await sync_dcpr2(entidad='nucleo', contenedor='bodega', supercon='oficina')
 
 
-async def sync_all_bd():
+async def sync_all_bd(ensayo: bool = False, todo: bool = False):
+    """
+    Lleva a la base de datos las diferencias con la última foto de bodegas y núcleos: altas, cambios, mudanzas de
+    consumidores y bajas. Sin todo solo compara los núcleos de las bodegas pendientes, con ensayo solo informa
+    """
+    import time
     import psycopg2
     from database import user, dbs, passw, server, port
+    from service import diferencias
+    estado = _estado()
+    previos = estado.setdefault('nucleo', {})
+    pendientes = None if todo else {int(b) for b, previo in previos.items() if previo.get('pendiente')}
     conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
-
-    # Provincia
-    """prov = dict()
-    cursor = conn.cursor()
-    insert_query = "INSERT INTO provincias (id_provincia, nombre, desac, siglas, ubicacion) VALUES (%s, %s,  %s, %s, %s)"
-
-    with open("async/2023-10-22 provincia.json") as file:
-        aux = json.load(file)
-
-    for res in aux:
-        prov[res['id']] = {'nombre':res['nombre'], 'desac': not res['activo'], 'siglas': res['siglas']}
-        values = (res['id'], res['nombre'], not res['activo'], res['siglas'], res['ubicacion'])
-        try:
-            cursor.execute(insert_query, values)
-        except (Exception,):
-            print("Error")
-    conn.commit()
-    cursor.close()
-
-    # Municipio
-    muni = dict()
-    cursor = conn.cursor()
-    insert_query = ("INSERT INTO municipios (id_municipio, nombre, desac, siglas, ubicacion, id_provincia) "
-                    "VALUES (%s, %s,  %s, %s, %s, %s)")
-
-    with open("async/2023-10-22 municipio.json") as file:
-        aux = json.load(file)
-
-    for res in aux:
-        muni[res['id']] = {'nombre': res['nombre'], 'desac': not res['activo'], 'siglas': res['siglas'],
-                           'id_provincia': res['provincia_id']}
-        values = (res['id'], res['nombre'], not res['activo'], res['siglas'], res['ubicacion'], res['provincia_id'])
-        try:
-            cursor.execute(insert_query, values)
-        except (Exception,):
-            print("Error")
-    conn.commit()
-    cursor.close()
-
-    # Bodega
-    bode = dict()
     cursor = conn.cursor()
-    insert_query = ("INSERT INTO bodegas (id_bodega, numero, id_oficina, direccion, grupos_rs, es_especial, desac) "
-                    "VALUES (%s, %s, %s, %s, %s, %s, %s)")
+    inicio = time.perf_counter()
+    try:
+        dif = diferencias.comparar(cursor, _leer('bodega') or [], _leer('nucleo') or [], pendientes)
+        print(dif.informe())
+        if ensayo:
+            conn.rollback()
+            return
+        diferencias.aplicar(cursor, dif)
+        conn.commit()
+        print(f"Diferencias aplicadas en {time.perf_counter() - inicio:.1f} s")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error al aplicar las diferencias:", e)
+        return
+    finally:
+        cursor.close()
+        conn.close()
 
-    with open("async/2023-10-22 bodega.json") as file:
-        aux = json.load(file)
+    for previo in previos.values():
+        previo['pendiente'] = False
+    _guardar_estado(estado)
+    await sync_contadores()
 
-    for res in aux:
-        bode[res['id']] = {'numero': res['numero'], 'id_oficina': res['oficina_id'], 'direccion': "",
-                           'grupos_rs':"", 'es_especial':False, 'desac': False, }
-        values = (res['id'], res['numero'], res['oficina_id'], "", "", False, False)
-        try:
-            cursor.execute(insert_query, values)
-        except (Exception,):
-            print("Error")
-    conn.commit()
-    cursor.close()"""
 
-    # Nucleo
+async def sync_contadores():
+    """
+    Recalcula en una sola sentencia cant_miembros de todos los núcleos a partir de sus consumidores activos,
+    solo escribe los núcleos cuyo contador se desvió
+    """
+    import psycopg2
+    from database import user, dbs, passw, server, port
+    conn = psycopg2.connect(dbname=dbs, user=user, password=passw, host=server, port=port)
     cursor = conn.cursor()
-
-    ## recorrer el fichero
-    with open("async/2023-10-22 nucleo.json") as file:
-        aux = json.load(file)
-
-    for res in aux:
-        cant = res['cons_cant']
-        cant_user = 0
-        cant_cons = 0
-        ### crear el nucleo ya probado
-        insert_query = ("INSERT INTO nucleos (numero, cant_miembros, cant_modulos, id_bodega) "
-                        "VALUES (%s, %s, %s, %s) RETURNING id_nucleo")
-        values = (res['numero_nucleo'], res['cons_cant'], 0, res['bodega_id'])
-        try:
-            cursor.execute(insert_query, values)
-            id_nucleodb = cursor.fetchone()[0]
-            conn.commit()
-        except (Exception,):
-            conn.rollback()
-            select_query = "SELECT id_nucleo FROM nucleos WHERE numero LIKE %s and id_bodega= %s"
-            values = (str(res['numero_nucleo']),res['bodega_id'])
-            cursor.execute(select_query, values)
-            id_nucleodb = cursor.fetchone()[0]
-        # con el nucleo en existencia
-        if id_nucleodb and res['cons_lista']:
-            usuarios = list()
-            id_jefenucleo = None
-
-            ### recorrer lista de identificacion
-            for user in json.loads(res['cons_lista']):
-                ### crear los usuarios
-                select_query = ("INSERT INTO usuarios (hash_clave, ci) VALUES (%s, %s) RETURNING id_usuario")
-                values = (user['identidad_numero'], user['identidad_numero'])
-                try:
-                    cursor.execute(select_query, values)
-                    usuariodb = cursor.fetchone()[0]
-                    conn.commit()
-                except (Exception,):
-                    conn.rollback()
-                    select_query = "SELECT id_usuario FROM usuarios WHERE ci LIKE %s"
-                    values = (user['identidad_numero'],)
-                    cursor.execute(select_query, values)
-                    usuariodb = cursor.fetchone()[0]
-                finally:
-                    usuarios.append(usuariodb)
-                    if user['jefe_nucleo']:
-                        id_jefenucleo = usuariodb
-            cant_user = len(usuarios)
-            cant_cons = 0
-            ### crear consumidores
-            for user in usuarios:
-                insert_query_us = ("INSERT INTO consumidores (id_usuario, id_nucleo, verificado) "
-                                   "VALUES (%s, %s, %s) RETURNING id_consumidor")
-                values_us = (user, id_nucleodb, True)
-                try:
-                    cursor.execute(insert_query_us, values_us)
-                    id_consumidordb = cursor.fetchone()[0]
-                    conn.commit()
-                except (Exception,):
-                    conn.rollback()
-                    select_query = "SELECT id_consumidor FROM consumidores WHERE id_usuario = %s and id_nucleo = %s"
-                    values = (user, id_nucleodb)
-                    cursor.execute(select_query, values)
-                    id_consumidordb = cursor.fetchone()[0]
-                finally:
-                    cant_cons = cant_cons + 1
-                    id_consumidorjefe = id_consumidordb if id_jefenucleo and user == id_jefenucleo else None
-            ## consumidor jefe
-            if id_consumidorjefe:
-                insert_query_us = f"UPDATE nucleos SET id_consumidor_jefe = %s WHERE id_nucleo = %s"
-                values_us = (id_consumidorjefe, id_nucleodb)
-                try:
-                    cursor.execute(insert_query_us, values_us)
-                    conn.commit()
-                except (Exception,):
-                    conn.rollback()
-                    print(f"Error con jefe consumidor {id_consumidorjefe} en nucleo {id_nucleodb}")
-        if cant != cant_cons or cant != cant_user:
-            print(f"Error del sistema no coincide usuario y consumidore para el nucleo {id_nucleodb}");
-
-    cursor.close()
+    try:
+        cursor.execute(
+            "UPDATE nucleos SET cant_miembros = c.cant, version = nucleos.version + 1 "
+            "FROM (SELECT n.id_nucleo, COUNT(c.id_consumidor) FILTER (WHERE NOT c.desac) AS cant "
+            "      FROM nucleos n LEFT JOIN consumidores c ON c.id_nucleo = n.id_nucleo "
+            "      GROUP BY n.id_nucleo) c "
+            "WHERE nucleos.id_nucleo = c.id_nucleo AND nucleos.cant_miembros <> c.cant"
+        )
+        conn.commit()
+        print(f"Contadores de miembros corregidos en {cursor.rowcount} núcleos")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Error al corregir los contadores:", e)
+    finally:
+        cursor.close()
+        conn.close()
 
 
 async def sync_json_provincia(conn, entidades):